@@ -1,8 +1,27 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connection
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from .models import UserProfile, Dish, Ingredient, DishIngredient, MealTariff, Allergy
+from datetime import timedelta
+import io
+from .catalog import import_catalog, iter_catalog_csv, iter_catalog_jsonl, read_catalog_csv, read_catalog_jsonl
+from .models import (
+    UserProfile, Dish, DishDailyStats, Ingredient, DishIngredient, IngredientPrice, MealTariff, Allergy,
+    recalculate_dish_totals, catalog_changed, refresh_dish_allergens,
+)
+from .search import filter_dishes_by_search
 
 
 def format_currency(value):
@@ -17,6 +36,78 @@ def format_currency(value):
         return f'{value_float:.2f} ₽'
 
 
+# точный COUNT(*) делается не дальше этой границы; больше — оценка из статистики базы
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimate_table_rows(model):
+    """Оценка числа строк таблицы из статистики планировщика или None, если её нет."""
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            elif connection.vendor == 'sqlite':
+                # заполняется ANALYZE (и PRAGMA optimize); первое число в stat — строки таблицы
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if not row or row[0] is None:
+        return None
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate > 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор списков админки, который не пересчитывает большие таблицы целиком.
+
+    Число строк считается запросом с LIMIT до EXACT_COUNT_LIMIT. Если строк больше, для
+    списка без фильтров берётся оценка из статистики базы, а отфильтрованный список
+    обрезается по границе; без статистики таблица считается целиком.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        bounded = queryset.order_by()[:EXACT_COUNT_LIMIT + 1].count()
+        if bounded <= EXACT_COUNT_LIMIT:
+            return bounded
+        if not queryset.query.has_filters():
+            estimate = estimate_table_rows(queryset.model)
+            return max(estimate, bounded) if estimate is not None else queryset.count()
+        return EXACT_COUNT_LIMIT
+
+
+POPULARITY_METRICS = {
+    'impressions': 'Показы в меню',
+    'swaps_away': 'Замены',
+    'card_views': 'Открытия карточки',
+}
+POPULARITY_LIMIT = 20
+
+
+class AllergenListFilter(admin.SimpleListFilter):
+    """Фильтр по аллергенам через Dish.allergen_mask вместо JOIN и DISTINCT по связи allergies."""
+
+    title = 'Аллергены'
+    parameter_name = 'allergen'
+
+    def lookups(self, request, model_admin):
+        return [(str(pk), name) for pk, name in Allergy.objects.order_by('name').values_list('pk', 'name')]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        allergy_id = int(self.value())
+        bit = Allergy.get_bits().get(allergy_id)
+        if bit is None:
+            return queryset.filter(allergies=allergy_id)
+        return queryset.alias(allergen_bit=F('allergen_mask').bitand(bit)).filter(allergen_bit=bit)
+
+
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
     can_delete = False
@@ -38,16 +129,22 @@ class DishIngredientInline(admin.TabularInline):
     fields = ('ingredient', 'quantity', 'get_price_contribution', 'get_calories_contribution')
     readonly_fields = ('get_price_contribution', 'get_calories_contribution')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient').annotate(
+            price_contribution=F('quantity') * F('ingredient__cost_per_unit'),
+            calories_contribution=F('quantity') * F('ingredient__calories_per_unit'),
+        )
+
     def get_price_contribution(self, obj):
-        if obj.pk and obj.ingredient.average_price and obj.quantity:
-            price = obj.ingredient.average_price * obj.quantity
+        price = getattr(obj, 'price_contribution', None)
+        if price:
             return format_currency(price)
         return '0 ₽'
     get_price_contribution.short_description = 'Стоимость'
 
     def get_calories_contribution(self, obj):
-        if obj.pk and obj.ingredient.calories and obj.quantity:
-            calories = obj.ingredient.calories * obj.quantity
+        calories = getattr(obj, 'calories_contribution', None)
+        if calories:
             return f'{int(calories)} ккал'
         return '0 ккал'
     get_calories_contribution.short_description = 'Калорийность'
@@ -66,26 +163,124 @@ class DishAdmin(admin.ModelAdmin):
         'created_at'
     )
     list_display_links = ('name', 'image_preview')
-    list_filter = ('diet_type', 'meal_type', 'is_active', 'created_at', 'allergies')
+    list_filter = ('diet_type', 'meal_type', 'is_active', 'created_at', AllergenListFilter)
     search_fields = ('name', 'description')
     list_editable = ('is_active',)
-    readonly_fields = ('created_at', 'total_calories', 'total_price', 'image_preview', 'get_formatted_price')
-    filter_horizontal = ('allergies',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = (
+        'created_at', 'total_calories', 'total_price', 'total_protein', 'total_fat', 'total_carbohydrates',
+        'image_preview', 'get_formatted_price', 'get_allergies',
+    )
 
     fieldsets = (
         ('Основная информация', {
             'fields': ('name', 'description', 'recipe', 'image', 'image_preview', 'get_formatted_price', 'total_calories', 'total_price')
         }),
+        ('Пищевая ценность', {
+            'fields': ('total_protein', 'total_fat', 'total_carbohydrates'),
+        }),
         ('Диетические свойства', {
-            'fields': ('diet_type', 'meal_type', 'allergies'),
+            'fields': ('diet_type', 'meal_type', 'get_allergies'),
             'classes': ('collapse',)
         }),
         ('Статус', {
             'fields': ('is_active', 'created_at')
         }),
     )
+    filter_horizontal = ('allergies',)
     inlines = (DishIngredientInline,)
 
+    def get_fieldsets(self, request, obj=None):
+        # у блюда без состава аллергены выводить не из чего, их проставляют вручную
+        if obj is not None and obj.dish_ingredients.exists():
+            return self.fieldsets
+        return tuple(
+            (name, {**options, 'fields': tuple(
+                'allergies' if field == 'get_allergies' else field for field in options['fields']
+            )})
+            for name, options in self.fieldsets
+        )
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        refresh_dish_allergens([form.instance.pk])
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return filter_dishes_by_search(queryset, search_term), False
+
+    def get_urls(self):
+        urls = [
+            path(
+                'import/',
+                self.admin_site.admin_view(self.import_catalog_view),
+                name='favorites_dish_import_catalog',
+            ),
+            path(
+                'popularity/',
+                self.admin_site.admin_view(self.popularity_view),
+                name='favorites_dish_popularity',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def import_catalog_view(self, request):
+        # импорт создаёт и перезаписывает блюда, поэтому нужны оба права
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        if request.method == 'POST' and request.FILES.get('catalog_file'):
+            uploaded = request.FILES['catalog_file']
+            reader = read_catalog_csv if uploaded.name.endswith('.csv') else read_catalog_jsonl
+            lines = io.TextIOWrapper(uploaded.file, encoding='utf-8', newline='')
+            try:
+                counts = import_catalog(reader(lines))
+            except (KeyError, ValueError, DatabaseError) as e:
+                self.message_user(request, f'Не удалось импортировать каталог: {e}', level=messages.ERROR)
+            else:
+                self.message_user(
+                    request,
+                    f'Импортировано: ингредиентов {counts["ingredient"]}, блюд {counts["dish"]}, '
+                    f'позиций состава {counts["dish_ingredient"]}'
+                )
+                return redirect('admin:favorites_dish_changelist')
+
+        context = {**self.admin_site.each_context(request), 'opts': self.model._meta, 'title': 'Импорт каталога'}
+        return TemplateResponse(request, 'admin/favorites/dish/import_catalog.html', context)
+
+    def popularity_view(self, request):
+        """Самые и наименее популярные блюда за период — только по дневным сводкам DishDailyStats."""
+        try:
+            days = min(max(int(request.GET.get('days', 7)), 1), 90)
+        except ValueError:
+            days = 7
+        metric = request.GET.get('metric')
+        if metric not in POPULARITY_METRICS:
+            metric = 'impressions'
+
+        since = timezone.now().date() - timedelta(days=days - 1)
+        stats = DishDailyStats.objects.filter(day__gte=since).values('dish_id', 'dish__name').annotate(
+            **{f'total_{name}': Sum(name) for name in POPULARITY_METRICS}
+        )
+        top = list(stats.order_by(f'-total_{metric}', 'dish_id')[:POPULARITY_LIMIT])
+        bottom = list(stats.order_by(f'total_{metric}', 'dish_id')[:POPULARITY_LIMIT])
+        for row in top + bottom:
+            impressions = row['total_impressions']
+            row['swap_rate'] = round(row['total_swaps_away'] / impressions * 100, 1) if impressions else None
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Популярность блюд',
+            'days': days,
+            'metric': metric,
+            'metrics': POPULARITY_METRICS,
+            'top': top,
+            'bottom': bottom,
+        }
+        return TemplateResponse(request, 'admin/favorites/dish/popularity.html', context)
+
     def image_preview(self, obj):
         if obj.image:
             return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', obj.image.url)
@@ -97,33 +292,69 @@ class DishAdmin(admin.ModelAdmin):
     get_formatted_price.short_description = 'Стоимость'
     get_formatted_price.admin_order_field = 'total_price'
 
-    actions = ['activate_dishes', 'deactivate_dishes', 'recalculate_nutrition']
+    actions = ['activate_dishes', 'deactivate_dishes', 'recalculate_nutrition', 'export_catalog_csv', 'export_catalog_jsonl']
 
     def activate_dishes(self, request, queryset):
         updated = queryset.update(is_active=True)
+        catalog_changed.send(sender=Dish)
+        cache.clear()
         self.message_user(request, f'{updated} блюд активировано')
     activate_dishes.short_description = 'Активировать выбранные блюда'
 
     def deactivate_dishes(self, request, queryset):
         updated = queryset.update(is_active=False)
+        catalog_changed.send(sender=Dish)
+        cache.clear()
         self.message_user(request, f'{updated} блюд деактивировано')
     deactivate_dishes.short_description = 'Деактивировать выбранные блюда'
 
     def recalculate_nutrition(self, request, queryset):
-        for dish in queryset:
-            dish.total_calories = dish.calculate_total_calories()
-            dish.total_price = dish.calculate_total_price()
-            dish.save()
-        self.message_user(request, f'Показатели пересчитаны для {queryset.count()} блюд')
-    recalculate_nutrition.short_description = 'Пересчитать стоимость и калорийность'
+        dish_ids = list(queryset.values_list('pk', flat=True))
+        updated = recalculate_dish_totals(dish_ids)
+        refresh_dish_allergens(dish_ids)
+        cache.clear()
+        self.message_user(request, f'Показатели пересчитаны для {updated} блюд')
+    recalculate_nutrition.short_description = 'Пересчитать стоимость, калорийность и аллергены'
+
+    def get_allergies(self, obj):
+        return ', '.join(allergy.name for allergy in obj.allergies.all()) or '—'
+    get_allergies.short_description = 'Аллергены (по ингредиентам)'
+
+    def export_catalog_csv(self, request, queryset):
+        response = StreamingHttpResponse(iter_catalog_csv(queryset), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="catalog.csv"'
+        return response
+    export_catalog_csv.short_description = 'Выгрузить в CSV'
+
+    def export_catalog_jsonl(self, request, queryset):
+        response = StreamingHttpResponse(iter_catalog_jsonl(queryset), content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="catalog.jsonl"'
+        return response
+    export_catalog_jsonl.short_description = 'Выгрузить в JSONL'
 
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
-    list_display = ('name', 'get_formatted_price', 'unit', 'calories', 'get_dishes_count')
+    list_display = ('name', 'get_formatted_price', 'unit', 'calories', 'protein', 'fat', 'carbohydrates', 'get_dishes_count')
     list_filter = ('unit',)
     search_fields = ('name',)
-    list_editable = ('unit', 'calories')
+    list_editable = ('unit', 'calories', 'protein', 'fat', 'carbohydrates')
+    filter_horizontal = ('allergies',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # коррелированный подзапрос считается только для строк страницы, а не для всей таблицы через GROUP BY
+        dishes_count = DishIngredient.objects.filter(ingredient=OuterRef('pk')).order_by().values('ingredient')
+        return super().get_queryset(request).annotate(dishes_count=Coalesce(Subquery(
+            dishes_count.annotate(count=Count('pk')).values('count'), output_field=IntegerField(),
+        ), 0))
+
+    def get_deleted_objects(self, objs, request):
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        # история цен уходит вместе с ингредиентом, хотя по отдельности её удалить нельзя
+        perms_needed.discard(IngredientPrice._meta.verbose_name)
+        return deleted_objects, model_count, perms_needed, protected
 
     def get_formatted_price(self, obj):
         '''Форматирует цену ингредиента без научной нотации'''
@@ -132,8 +363,31 @@ class IngredientAdmin(admin.ModelAdmin):
     get_formatted_price.admin_order_field = 'average_price'
 
     def get_dishes_count(self, obj):
-        return obj.dishingredient_set.count()
+        return obj.dishes_count
     get_dishes_count.short_description = 'Используется в блюдах'
+    get_dishes_count.admin_order_field = 'dishes_count'
+
+
+@admin.register(IngredientPrice)
+class IngredientPriceAdmin(admin.ModelAdmin):
+    list_display = ('ingredient', 'observed_on', 'price')
+    list_filter = ('observed_on',)
+    search_fields = ('ingredient__name',)
+    date_hierarchy = 'observed_on'
+    list_select_related = ('ingredient',)
+    raw_id_fields = ('ingredient',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # история только пополняется командой ingest_prices: правка или удаление задним числом исказили бы средние
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(MealTariff)
@@ -178,6 +432,8 @@ class MealTariffAdmin(admin.ModelAdmin):
 
     search_fields = ('user__username',)
     list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     @admin.display(description='Есть аллергии')
     def has_allergies(self, obj):
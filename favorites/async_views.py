@@ -0,0 +1,100 @@
+"""Асинхронные версии самых нагруженных страниц для запуска под ASGI.
+
+Подключаются в urls.py вместо синхронных, когда включена настройка ASYNC_VIEWS
+(recipe/asgi.py включает её по умолчанию).
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect, render
+from django.utils import timezone
+
+from . import views
+from .menu import aget_daily_menu_for_user, areplace_dish_in_menu, get_weekly_menu_for_user
+from .models import Dish, MealTariff, UserProfile
+from .popularity import record_card_view, record_impressions
+from .preferences import DishPreferences
+
+
+async def card(request, pk):
+    dish = await Dish.objects.prefetch_related('dish_ingredients__ingredient').filter(pk=pk).afirst()
+    if dish is None:
+        return redirect('favorites:lk')
+
+    record_card_view(dish.pk)
+    user = await request.auser()
+    preferences = await DishPreferences.afor_user(user) if user.is_authenticated else None
+    return render(request, 'card.html', {'dish': dish, 'preferences': preferences})
+
+
+@login_required
+async def lk(request):
+    if request.method == 'POST':
+        return await sync_to_async(views.lk)(request)
+
+    user = await request.auser()
+
+    user_tariff = await MealTariff.objects.filter(user=user).afirst()
+    if user_tariff is None:
+        return redirect('favorites:order')
+
+    user_profile, _ = await UserProfile.objects.aget_or_create(user=user)
+    await user_profile.areset_swaps_if_needed()
+
+    daily_menu = await aget_daily_menu_for_user(user, user_tariff, user_profile.max_dish_price)
+    weekly_menu = await sync_to_async(get_weekly_menu_for_user)(user, user_tariff, user_profile.max_dish_price)
+    record_impressions(*(dish.pk for dish in daily_menu.values()))
+
+    preferences = await DishPreferences.afor_user(user)
+    listed = await Dish.objects.only('pk', 'name').ain_bulk(preferences.favorite_ids | preferences.blocked_ids)
+
+    menu_by_meal_type = {
+        meal_type: [{'dish': dish, 'meal_type': meal_type}]
+        for meal_type, dish in daily_menu.items()
+    }
+
+    context = {
+        'menu_by_meal_type': menu_by_meal_type,
+        'weekly_menu': weekly_menu,
+        'user': user,
+        'user_profile': user_profile,
+        'user_tariff': user_tariff,
+        'today': timezone.now().date(),
+        'favorite_dishes': [listed[pk] for pk in sorted(preferences.favorite_ids) if pk in listed],
+        'blocked_dishes': [listed[pk] for pk in sorted(preferences.blocked_ids) if pk in listed],
+    }
+    # сообщения в шаблоне читаются из сессии синхронно, поэтому рендер уходит в поток одним вызовом
+    return await sync_to_async(render)(request, 'lk.html', context)
+
+
+async def aswap_dish_for_user(user, meal_type):
+    user_profile = await UserProfile.objects.aget(user=user)
+    await user_profile.areset_swaps_if_needed()
+
+    if not await user_profile.atake_swap():
+        return None, user_profile, 'У вас не осталось доступных замен'
+
+    user_tariff = await MealTariff.objects.aget(user=user)
+
+    new_dish = await areplace_dish_in_menu(user, user_tariff, meal_type, user_profile.max_dish_price)
+    if not new_dish:
+        await user_profile.areturn_swap()
+        return None, user_profile, 'Не найдено подходящих блюд для замены'
+
+    return new_dish, user_profile, None
+
+
+@login_required
+async def replace_dish(request, meal_type):
+    if request.method == 'POST':
+        new_dish, user_profile, error = await aswap_dish_for_user(await request.auser(), meal_type)
+
+        if views.wants_swap_fragment(request):
+            return views.render_swap_fragment(request, meal_type, new_dish, user_profile, error)
+
+        if new_dish:
+            messages.success(request, 'Блюдо успешно заменено!')
+        else:
+            messages.error(request, error)
+
+    return redirect('favorites:lk')
@@ -0,0 +1,198 @@
+import math
+import time
+
+
+def percentile(values, q):
+    """Перцентиль `q` (0–100) по методу ближайшего ранга."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_durations(durations):
+    """Сводка по списку длительностей в секундах; результат в миллисекундах."""
+    if not durations:
+        return {'count': 0}
+    return {
+        'count': len(durations),
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 3),
+        'p50_ms': round(percentile(durations, 50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 99) * 1000, 3),
+        'max_ms': round(max(durations) * 1000, 3),
+    }
+
+
+ALLERGY_SLUGS = ('fish', 'meat', 'grains', 'honey', 'nuts', 'dairy')
+SEED_CHUNK_SIZE = 5000
+
+
+def measure(func, iterations, prepare=None):
+    """Вызывает `func` `iterations` раз и возвращает сводку по времени и числу SQL-запросов.
+
+    `prepare(i)` вызывается перед каждым замером вне таймера и возвращает аргументы для `func`.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    durations = []
+    query_counts = []
+    for i in range(iterations):
+        args = prepare(i) if prepare else ()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            func(*args)
+            durations.append(time.perf_counter() - started)
+        query_counts.append(len(queries))
+
+    summary = summarize_durations(durations)
+    summary['queries_mean'] = round(sum(query_counts) / len(query_counts), 2)
+    summary['queries_max'] = max(query_counts)
+    return summary
+
+
+def seed_catalog(rng, dishes=10000, ingredients_per_dish=50, ingredients=None, image='img/1.jpg'):
+    """Заполняет базу синтетическим каталогом через bulk_create и возвращает id блюд."""
+    from .models import (
+        Allergy, Dish, DishIngredient, Ingredient, recalculate_dish_totals, refresh_dish_allergens,
+        refresh_ingredient_unit_columns,
+    )
+
+    ingredients = ingredients or max(ingredients_per_dish * 4, 200)
+    allergies = Allergy.objects.bulk_create([Allergy(name=slug, slug=slug) for slug in ALLERGY_SLUGS])
+
+    Ingredient.objects.bulk_create([
+        Ingredient(
+            name=f'Ингредиент {i}',
+            average_price=rng.randint(5, 300),
+            calories=rng.randint(10, 600),
+            protein=rng.randint(0, 300) / 10,
+            fat=rng.randint(0, 300) / 10,
+            carbohydrates=rng.randint(0, 800) / 10,
+            unit=rng.choice(Ingredient.UNIT_TYPES)[0],
+        )
+        for i in range(ingredients)
+    ], batch_size=SEED_CHUNK_SIZE)
+    refresh_ingredient_unit_columns()
+    ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+
+    diet_types = [choice for choice, _ in Dish.DIET_CHOICES]
+    meal_types = [choice for choice, _ in Dish.MEAL_TYPES]
+    for start in range(0, dishes, SEED_CHUNK_SIZE):
+        Dish.objects.bulk_create([
+            Dish(
+                name=f'Блюдо {i}',
+                description=f'Описание блюда {i}',
+                recipe='Смешать и приготовить.',
+                image=image,
+                diet_type=rng.choice(diet_types),
+                meal_type=rng.choice(meal_types),
+            )
+            for i in range(start, min(start + SEED_CHUNK_SIZE, dishes))
+        ])
+    dish_ids = list(Dish.objects.values_list('pk', flat=True))
+
+    per_dish = min(ingredients_per_dish, len(ingredient_ids))
+    batch = []
+    for dish_id in dish_ids:
+        for ingredient_id in rng.sample(ingredient_ids, per_dish):
+            batch.append(DishIngredient(dish_id=dish_id, ingredient_id=ingredient_id, quantity=rng.randint(1, 30) / 10))
+        if len(batch) >= SEED_CHUNK_SIZE:
+            DishIngredient.objects.bulk_create(batch)
+            batch = []
+    DishIngredient.objects.bulk_create(batch)
+
+    through = Ingredient.allergies.through
+    through.objects.bulk_create([
+        through(ingredient_id=ingredient_id, allergy_id=rng.choice(allergies).pk)
+        for ingredient_id in ingredient_ids
+        if rng.random() < 0.007
+    ], batch_size=SEED_CHUNK_SIZE)
+
+    recalculate_dish_totals()
+    refresh_dish_allergens()
+    return dish_ids
+
+
+def seed_users(rng, users=100000):
+    """Создаёт пользователей с профилями и случайными тарифами и аллергиями."""
+    from django.contrib.auth.models import User
+
+    from .models import Allergy, MealTariff, UserProfile
+
+    diet_types = [choice for choice, _ in MealTariff.DIET_CHOICES]
+    allergy_fields = list(Allergy.TARIFF_FIELD_MAPPING.values())
+    first_id = (User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+
+    for start in range(0, users, SEED_CHUNK_SIZE):
+        stop = min(start + SEED_CHUNK_SIZE, users)
+        User.objects.bulk_create([
+            User(username=f'bench{i}', email=f'bench{i}@example.com', password='!')
+            for i in range(start, stop)
+        ])
+    user_ids = list(User.objects.filter(pk__gte=first_id).values_list('pk', flat=True))
+
+    for start in range(0, len(user_ids), SEED_CHUNK_SIZE):
+        chunk = user_ids[start:start + SEED_CHUNK_SIZE]
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in chunk])
+        tariffs = []
+        for user_id in chunk:
+            meals = {field: rng.random() < 0.7 for field in ('breakfast', 'lunch', 'dinner', 'desserts')}
+            if not any(meals.values()):
+                meals['lunch'] = True
+            allergies = {field: rng.random() < 0.1 for field in allergy_fields}
+            tariffs.append(MealTariff(user_id=user_id, diet_type=rng.choice(diet_types), **meals, **allergies))
+        MealTariff.objects.bulk_create(tariffs)
+    return user_ids
+
+
+def run_concurrently(worker, threads, requests_per_thread):
+    """Запускает `worker(thread_index, i)` в `threads` потоках и собирает результаты.
+
+    `worker` возвращает код ответа; исключения считаются ошибками и группируются по тексту.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.db import connections
+
+    def run_thread(thread_index):
+        samples = []
+        try:
+            for i in range(requests_per_thread):
+                started = time.perf_counter()
+                try:
+                    status, error = worker(thread_index, i), None
+                except Exception as e:
+                    status, error = None, f'{type(e).__name__}: {e}'
+                samples.append((time.perf_counter() - started, status, error))
+        finally:
+            connections.close_all()
+        return samples
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        samples = [sample for result in executor.map(run_thread, range(threads)) for sample in result]
+    elapsed = time.perf_counter() - started
+
+    errors = {}
+    for _, status, error in samples:
+        if error is None and status is not None and status >= 500:
+            error = f'HTTP {status}'
+        if error:
+            errors[error] = errors.get(error, 0) + 1
+    error_count = sum(errors.values())
+    lock_errors = sum(count for error, count in errors.items() if 'locked' in error)
+
+    summary = summarize_durations([duration for duration, _, _ in samples])
+    summary.update({
+        'threads': threads,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(samples) / elapsed, 1) if elapsed else None,
+        'errors': error_count,
+        'error_rate': round(error_count / len(samples), 4) if samples else 0,
+        'lock_errors': lock_errors,
+        'error_kinds': errors,
+    })
+    return summary
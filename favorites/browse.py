@@ -0,0 +1,85 @@
+"""Постраничный просмотр каталога по ключу (created_at, id) вместо OFFSET.
+
+Страница — это «следующие N блюд после курсора»: условие по индексу
+(created_at, id) находит начало страницы сразу, поэтому сотая страница
+стоит столько же, сколько первая.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import F
+
+from .models import Allergy, Dish
+
+
+PAGE_SIZE = 24
+BROWSE_FIELDS = ('id', 'name', 'image', 'diet_type', 'meal_type', 'total_price', 'total_calories', 'created_at')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_cursor(dish):
+    return f'{(dish.created_at - _EPOCH) // _MICROSECOND}-{dish.pk}'
+
+
+def decode_cursor(cursor):
+    """(created_at, id) из курсора или None, если курсор пустой или испорчен."""
+    try:
+        micros, pk = cursor.split('-')
+        return _EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def parse_filters(params):
+    """Фильтры каталога из GET-параметров; неизвестные значения отбрасываются."""
+    diets = dict(Dish.DIET_CHOICES)
+    meals = dict(Dish.MEAL_TYPES)
+    allergens = list(Allergy.TARIFF_FIELD_MAPPING)
+
+    try:
+        max_price = Decimal(params.get('max_price', '').strip())
+        if not max_price.is_finite() or max_price < 0:
+            max_price = None
+    except InvalidOperation:
+        max_price = None
+
+    return {
+        'diet': params.get('diet') if params.get('diet') in diets else '',
+        'meal': params.get('meal') if params.get('meal') in meals else '',
+        'max_price': max_price,
+        'exclude': [slug for slug in params.getlist('exclude') if slug in allergens],
+    }
+
+
+def filter_catalog(filters):
+    dishes = Dish.objects.filter(is_active=True)
+    if filters['diet']:
+        dishes = dishes.filter(diet_type=filters['diet'])
+    if filters['meal']:
+        dishes = dishes.filter(meal_type=filters['meal'])
+    if filters['max_price'] is not None:
+        dishes = dishes.filter(total_price__lte=filters['max_price'])
+    if filters['exclude']:
+        slugs = list(Allergy.TARIFF_FIELD_MAPPING)
+        mask = sum(1 << slugs.index(slug) for slug in filters['exclude'])
+        dishes = dishes.alias(forbidden_allergens=F('allergen_mask').bitand(mask)).filter(forbidden_allergens=0)
+    return dishes
+
+
+def browse_dishes(filters, cursor=None, page_size=PAGE_SIZE):
+    """Возвращает (блюда страницы, курсор следующей страницы или None), от новых к старым."""
+    dishes = filter_catalog(filters).only(*BROWSE_FIELDS).order_by('-created_at', '-id')
+
+    position = decode_cursor(cursor)
+    if position is not None:
+        created_at, pk = position
+        # (created_at, id) < (c, i), записанное как диапазон по created_at, чтобы работал индекс
+        dishes = dishes.filter(created_at__lte=created_at).exclude(created_at=created_at, id__gte=pk)
+
+    page = list(dishes[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+    return page, None
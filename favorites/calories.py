@@ -0,0 +1,131 @@
+"""Подбор блюд по дневной норме калорий.
+
+Кандидаты каждого приёма пищи — пара параллельных списков (калории, id блюд),
+отсортированных по калорийности. Поиск идёт бинарным поиском окна и двумя
+указателями, так что время не зависит от числа сочетаний блюд.
+"""
+from bisect import bisect_left, bisect_right
+import random
+
+
+ATTEMPTS = 32
+
+
+def window_indexes(calories, low, high):
+    return bisect_left(calories, low), bisect_right(calories, high)
+
+
+def pick_in_window(candidates, low, high, rng=random):
+    """Случайный id блюда с калорийностью в [low, high] или None."""
+    calories, dish_ids = candidates
+    start, end = window_indexes(calories, low, high)
+    return dish_ids[rng.randrange(start, end)] if start < end else None
+
+
+def pick_nearest(candidates, target):
+    """id блюда с калорийностью, ближайшей к `target`."""
+    calories, dish_ids = candidates
+    if not dish_ids:
+        return None
+    i = bisect_left(calories, target)
+    if i == len(dish_ids) or (i > 0 and target - calories[i - 1] <= calories[i] - target):
+        i -= 1
+    return dish_ids[i]
+
+
+def pick_pair(first, second, low, high, rng=random):
+    """Пара блюд из двух списков с суммой калорий в [low, high] или None.
+
+    Сначала несколько случайных попыток с бинарным поиском окна во втором списке,
+    затем проход двумя указателями за O(n), который находит пару, если она есть.
+    """
+    calories, dish_ids = first
+    for _ in range(ATTEMPTS):
+        i = rng.randrange(len(dish_ids))
+        dish_id = pick_in_window(second, low - calories[i], high - calories[i], rng)
+        if dish_id is not None:
+            return [dish_ids[i], dish_id]
+
+    second_calories, second_ids = second
+    i, j = 0, len(second_ids) - 1
+    while i < len(dish_ids) and j >= 0:
+        total = calories[i] + second_calories[j]
+        if total < low:
+            i += 1
+        elif total > high:
+            j -= 1
+        else:
+            return [dish_ids[i], second_ids[j]]
+    return None
+
+
+def compose_in_band(candidates, low, high, rng=random):
+    """Выбирает по одному блюду из каждого списка так, чтобы сумма калорий попала в [low, high].
+
+    Все списки, кроме двух последних, дают случайное блюдо, а оставшийся диапазон
+    закрывается `pick_pair`. Если случайные попытки не нашли меню, его ищет
+    `search_in_band`. Возвращает список id в порядке списков или None.
+    """
+    if not candidates or not all(dish_ids for _, dish_ids in candidates):
+        return None
+
+    *head, last = candidates
+    if not head:
+        dish_id = pick_in_window(last, low, high, rng)
+        return None if dish_id is None else [dish_id]
+
+    *head, first = head
+    tail_min = first[0][0] + last[0][0]
+    tail_max = first[0][-1] + last[0][-1]
+    for _ in range(ATTEMPTS if head else 1):
+        picked = [rng.randrange(len(dish_ids)) for _, dish_ids in head]
+        base = sum(calories[i] for (calories, _), i in zip(head, picked))
+        if base + tail_max < low or base + tail_min > high:
+            continue
+        pair = pick_pair(first, last, low - base, high - base, rng)
+        if pair is not None:
+            return [dish_ids[i] for (_, dish_ids), i in zip(head, picked)] + pair
+    return search_in_band(candidates, low, high, rng) if head else None
+
+
+def search_in_band(candidates, low, high, rng=random):
+    """Полный поиск меню с суммой калорий в [low, high]; находит его, если оно есть.
+
+    Перебираются суммы калорий уже выбранных приёмов пищи, а не сочетания блюд:
+    сумм не больше, чем целых чисел в достижимом диапазоне, и из каждого списка
+    берутся только калорийности, с которыми [low, high] ещё достижим.
+    """
+    mins = [calories[0] for calories, _ in candidates]
+    maxs = [calories[-1] for calories, _ in candidates]
+    # сумма калорий -> индексы выбранных блюд
+    reachable = {0: []}
+    for k, (calories, _) in enumerate(candidates[:-1]):
+        rest_min, rest_max = sum(mins[k + 1:]), sum(maxs[k + 1:])
+        step = {}
+        for total, picked in reachable.items():
+            start, end = window_indexes(calories, low - rest_max - total, high - rest_min - total)
+            for i in range(start, end):
+                step.setdefault(total + calories[i], picked + [i])
+        reachable = step
+
+    last = candidates[-1]
+    for total, picked in reachable.items():
+        dish_id = pick_in_window(last, low - total, high - total, rng)
+        if dish_id is not None:
+            return [dish_ids[i] for (_, dish_ids), i in zip(candidates, picked)] + [dish_id]
+    return None
+
+
+def drop_ids(candidates, dish_ids):
+    """Убирает блюда из кандидатов, сохраняя сортировку."""
+    if not dish_ids:
+        return candidates
+    calories, ids = candidates
+    kept = [(c, pk) for c, pk in zip(calories, ids) if pk not in dish_ids]
+    return [c for c, _ in kept], [pk for _, pk in kept]
+
+
+def exclude_ids(candidates, dish_ids):
+    """Убирает недавние блюда, сохраняя сортировку; если не остаётся ничего — возвращает исходный список."""
+    kept = drop_ids(candidates, dish_ids)
+    return kept if kept[1] else candidates
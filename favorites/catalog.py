@@ -0,0 +1,237 @@
+import csv
+import json
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import (
+    Allergy, Dish, DishIngredient, Ingredient, recalculate_dish_totals, refresh_dish_allergens,
+    refresh_ingredient_unit_columns,
+)
+from .search import index_dishes
+from .shopping import Echo
+
+
+INGREDIENT_FIELDS = ('id', 'name', 'unit', 'average_price', 'calories', 'protein', 'fat', 'carbohydrates', 'allergies')
+DISH_FIELDS = ('id', 'name', 'description', 'recipe', 'image', 'diet_type', 'meal_type', 'is_active')
+DISH_INGREDIENT_FIELDS = ('dish_id', 'ingredient_id', 'quantity')
+
+CSV_COLUMNS = ('record',) + tuple(dict.fromkeys(INGREDIENT_FIELDS + DISH_FIELDS + DISH_INGREDIENT_FIELDS))
+
+ITERATOR_CHUNK_SIZE = 2000
+IMPORT_CHUNK_SIZE = 1000
+
+
+def iter_catalog_records(dishes=None):
+    """Построчно отдаёт каталог: ингредиенты, блюда и их состав.
+
+    Если передан queryset `dishes`, выгружаются только эти блюда и их ингредиенты.
+    """
+    ingredients = Ingredient.objects.all()
+    dish_ingredients = DishIngredient.objects.all()
+    if dishes is None:
+        dishes = Dish.objects.all()
+    else:
+        dish_ingredients = dish_ingredients.filter(dish__in=dishes.values('pk'))
+        ingredients = ingredients.filter(pk__in=dish_ingredients.values('ingredient_id'))
+
+    allergy_slugs = dict(Allergy.objects.values_list('pk', 'slug'))
+    through = Ingredient.allergies.through
+    ingredient_fields = [field for field in INGREDIENT_FIELDS if field != 'allergies']
+    rows = ingredients.order_by('pk').values(*ingredient_fields).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    for chunk in _chunked(rows, ITERATOR_CHUNK_SIZE):
+        ingredient_allergies = {}
+        links = through.objects.filter(
+            ingredient_id__in=[row['id'] for row in chunk]
+        ).values_list('ingredient_id', 'allergy_id')
+        for ingredient_id, allergy_id in links:
+            ingredient_allergies.setdefault(ingredient_id, []).append(allergy_slugs[allergy_id])
+        for row in chunk:
+            row['allergies'] = ','.join(sorted(ingredient_allergies.get(row['id'], [])))
+            yield 'ingredient', row
+
+    for row in dishes.order_by('pk').values(*DISH_FIELDS).iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        yield 'dish', row
+
+    rows = dish_ingredients.order_by('pk').values(*DISH_INGREDIENT_FIELDS).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    for row in rows:
+        yield 'dish_ingredient', row
+
+
+def iter_catalog_csv(dishes=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for record, row in iter_catalog_records(dishes):
+        yield writer.writerow([record] + ['' if row.get(column) is None else row.get(column) for column in CSV_COLUMNS[1:]])
+
+
+def iter_catalog_jsonl(dishes=None):
+    for record, row in iter_catalog_records(dishes):
+        yield json.dumps({'record': record, **row}, ensure_ascii=False, default=str) + '\n'
+
+
+def read_catalog_csv(lines):
+    for row in csv.DictReader(lines):
+        record = row.pop('record')
+        yield record, {key: value for key, value in row.items() if value != ''}
+
+
+def read_catalog_jsonl(lines):
+    for line in lines:
+        if line.strip():
+            row = json.loads(line)
+            yield row.pop('record'), row
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'да')
+    return bool(value)
+
+
+class CatalogImporter:
+    """Загружает каталог пачками через bulk_create(update_conflicts=True).
+
+    Сигналы пересчёта при этом не срабатывают, поэтому стоимость, калорийность
+    и аллергены затронутых блюд пересчитываются одним проходом в `finish()`.
+    """
+
+    def __init__(self, chunk_size=IMPORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.buffers = {'ingredient': [], 'dish': [], 'dish_ingredient': []}
+        self.ingredient_allergies = {}
+        self.touched_dish_ids = set()
+        self.touched_ingredient_ids = set()
+        self.counts = {'ingredient': 0, 'dish': 0, 'dish_ingredient': 0}
+        self.allergies_by_slug = dict(Allergy.objects.values_list('slug', 'pk'))
+
+    def add(self, record, row):
+        if record not in self.buffers:
+            raise ValueError(f'Неизвестный тип записи: {record}')
+
+        self.buffers[record].append(getattr(self, f'_build_{record}')(row))
+        if len(self.buffers[record]) >= self.chunk_size:
+            self.flush(record)
+
+    def _build_ingredient(self, row):
+        self.touched_ingredient_ids.add(int(row['id']))
+        if 'allergies' in row:
+            slugs = row['allergies'] or ''
+            if isinstance(slugs, str):
+                slugs = [slug for slug in slugs.split(',') if slug]
+            self.ingredient_allergies[int(row['id'])] = [
+                self.allergies_by_slug[slug] for slug in slugs if slug in self.allergies_by_slug
+            ]
+        return Ingredient(
+            id=row['id'],
+            name=row['name'],
+            unit=row.get('unit') or 'GRAM',
+            average_price=row['average_price'],
+            calories=row.get('calories') or None,
+            protein=row.get('protein') or None,
+            fat=row.get('fat') or None,
+            carbohydrates=row.get('carbohydrates') or None,
+        )
+
+    def _build_dish(self, row):
+        dish = Dish(
+            id=row['id'],
+            name=row['name'],
+            description=row.get('description', ''),
+            recipe=row.get('recipe', ''),
+            image=row.get('image', ''),
+            diet_type=row.get('diet_type') or 'CLASSIC',
+            meal_type=row.get('meal_type') or 'LUNCH',
+            is_active=_to_bool(row.get('is_active', True)),
+        )
+        self.touched_dish_ids.add(int(dish.id))
+        return dish
+
+    def _build_dish_ingredient(self, row):
+        self.touched_dish_ids.add(int(row['dish_id']))
+        return DishIngredient(
+            dish_id=row['dish_id'],
+            ingredient_id=row['ingredient_id'],
+            quantity=row['quantity'],
+        )
+
+    def flush(self, record):
+        objs = self.buffers[record]
+        if not objs:
+            return
+
+        if record == 'ingredient':
+            Ingredient.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=['id'],
+                update_fields=['name', 'unit', 'average_price', 'calories', 'protein', 'fat', 'carbohydrates'],
+            )
+            self._flush_ingredient_allergies()
+        elif record == 'dish':
+            Dish.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=['id'],
+                update_fields=['name', 'description', 'recipe', 'image', 'diet_type', 'meal_type', 'is_active'],
+            )
+        else:
+            DishIngredient.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=['dish', 'ingredient'],
+                update_fields=['quantity'],
+            )
+
+        self.counts[record] += len(objs)
+        self.buffers[record] = []
+
+    def _flush_ingredient_allergies(self):
+        if not self.ingredient_allergies:
+            return
+
+        through = Ingredient.allergies.through
+        through.objects.filter(ingredient_id__in=self.ingredient_allergies).delete()
+        through.objects.bulk_create([
+            through(ingredient_id=ingredient_id, allergy_id=allergy_id)
+            for ingredient_id, allergy_ids in self.ingredient_allergies.items()
+            for allergy_id in allergy_ids
+        ])
+        self.ingredient_allergies = {}
+
+    def finish(self):
+        for record in ('ingredient', 'dish', 'dish_ingredient'):
+            self.flush(record)
+
+        for ingredient_ids in _chunked(self.touched_ingredient_ids, IMPORT_CHUNK_SIZE):
+            refresh_ingredient_unit_columns(ingredient_ids)
+            # изменённые цены и калорийность ингредиентов затрагивают все блюда с ними
+            self.touched_dish_ids.update(
+                DishIngredient.objects.filter(ingredient_id__in=ingredient_ids).values_list('dish_id', flat=True)
+            )
+        for dish_ids in _chunked(self.touched_dish_ids, IMPORT_CHUNK_SIZE):
+            recalculate_dish_totals(dish_ids)
+            refresh_dish_allergens(dish_ids)
+        index_dishes(self.touched_dish_ids)
+        cache.clear()
+        return self.counts
+
+
+def import_catalog(records, chunk_size=IMPORT_CHUNK_SIZE):
+    """Импортирует записи (тип, словарь полей) в одной транзакции и возвращает счётчики."""
+    with transaction.atomic():
+        importer = CatalogImporter(chunk_size)
+        for record, row in records:
+            importer.add(record, row)
+        return importer.finish()
@@ -0,0 +1,72 @@
+from collections import deque
+import struct
+
+from .models import UserProfile
+from .preferences import weighted_choice
+
+
+HISTORY_SIZE = 28  # четыре приёма пищи на неделю вперёд
+_ID_FORMAT = '<I'
+
+
+class DishHistory:
+    """Кольцевой буфер последних блюд пользователя, от старых к новым.
+
+    Хранится в одной колонке UserProfile.recent_dish_ids как упакованные uint32,
+    проверка «было ли блюдо недавно» — поиск в множестве.
+    """
+
+    def __init__(self, data=b'', size=HISTORY_SIZE):
+        data = bytes(data or b'')
+        count = len(data) // struct.calcsize(_ID_FORMAT)
+        self.dish_ids = deque(struct.unpack(f'<{count}I', data[:count * 4]), maxlen=size)
+        self._recent = None
+
+    @classmethod
+    def for_user(cls, user):
+        data = UserProfile.objects.filter(user=user).values_list('recent_dish_ids', flat=True).first()
+        return cls(data)
+
+    @classmethod
+    async def afor_user(cls, user):
+        data = await UserProfile.objects.filter(user=user).values_list('recent_dish_ids', flat=True).afirst()
+        return cls(data)
+
+    def __contains__(self, dish_id):
+        if self._recent is None:
+            self._recent = set(self.dish_ids)
+        return dish_id in self._recent
+
+    def __len__(self):
+        return len(self.dish_ids)
+
+    def push(self, *dish_ids):
+        for dish_id in dish_ids:
+            self.dish_ids.append(dish_id)
+        self._recent = None
+
+    def pack(self):
+        return struct.pack(f'<{len(self.dish_ids)}I', *self.dish_ids)
+
+    def save(self, user):
+        UserProfile.objects.filter(user=user).update(recent_dish_ids=self.pack())
+
+    async def asave(self, user):
+        await UserProfile.objects.filter(user=user).aupdate(recent_dish_ids=self.pack())
+
+    def pick(self, dish_ids, favorite_ids=frozenset()):
+        """Выбирает случайный id среди тех, что не встречались недавно; избранные — с большим весом.
+
+        Если пул целиком в истории (мало подходящих блюд), берёт блюдо,
+        которое показывалось раньше всех остальных.
+        """
+        if not dish_ids:
+            return None
+
+        fresh = [dish_id for dish_id in dish_ids if dish_id not in self]
+        if fresh:
+            return weighted_choice(fresh, favorite_ids)
+
+        last_seen = {dish_id: position for position, dish_id in enumerate(self.dish_ids)}
+        oldest = min(last_seen[dish_id] for dish_id in dish_ids)
+        return self.dish_ids[oldest]
@@ -0,0 +1,126 @@
+import json
+import random
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from favorites.benchmarks import measure, seed_catalog, seed_users
+from favorites.menu import get_daily_menu_for_user, get_filtered_dishes, replace_dish_in_menu
+from favorites.models import Dish, MealTariff, recalculate_dish_totals
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт временную базу с синтетическим каталогом и пользователями, замеряет горячие пути '
+        'генерации меню и рендера lk и выводит перцентили и число запросов в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dishes', type=int, default=10000)
+        parser.add_argument('--ingredients-per-dish', type=int, default=50)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('-o', '--output', help='Файл для записи результатов (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run_benchmarks(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run_benchmarks(self, options):
+        rng = random.Random(options['seed'])
+        iterations = options['iterations']
+
+        started = time.perf_counter()
+        dish_ids = seed_catalog(rng, options['dishes'], options['ingredients_per_dish'])
+        user_ids = seed_users(rng, options['users'])
+        seed_seconds = time.perf_counter() - started
+
+        tariffs = list(MealTariff.objects.filter(
+            user_id__in=rng.sample(user_ids, min(iterations, len(user_ids)))
+        ).select_related('user', 'user__userprofile'))
+
+        def pick_tariff(i):
+            return (tariffs[i % len(tariffs)],)
+
+        def cold_menu(i):
+            cache.clear()
+            return pick_tariff(i)
+
+        results = {
+            'commit': self.current_commit(),
+            'params': {key: options[key] for key in ('dishes', 'ingredients_per_dish', 'users', 'iterations', 'seed')},
+            'seed_seconds': round(seed_seconds, 2),
+        }
+
+        results['get_filtered_dishes'] = measure(
+            lambda tariff: list(get_filtered_dishes(tariff, 'LUNCH', None)), iterations, pick_tariff,
+        )
+        results['get_daily_menu_for_user_cold'] = measure(
+            lambda tariff: get_daily_menu_for_user(tariff.user, tariff, tariff.user.userprofile.max_dish_price),
+            iterations, cold_menu,
+        )
+        for tariff in tariffs:
+            get_daily_menu_for_user(tariff.user, tariff, tariff.user.userprofile.max_dish_price)
+        results['get_daily_menu_for_user_cached'] = measure(
+            lambda tariff: get_daily_menu_for_user(tariff.user, tariff, tariff.user.userprofile.max_dish_price),
+            iterations, pick_tariff,
+        )
+        results['replace_dish_in_menu'] = measure(
+            lambda tariff: replace_dish_in_menu(tariff.user, tariff, 'LUNCH', None), iterations, pick_tariff,
+        )
+        results['recalculate_nutrition_dish_save'] = measure(
+            lambda dish: dish.save(), min(iterations, 50),
+            lambda i: (Dish.objects.get(pk=rng.choice(dish_ids)),),
+        )
+        results['recalculate_nutrition_bulk'] = measure(lambda: recalculate_dish_totals(), 3)
+
+        client = Client()
+        lk_url = reverse('favorites:lk')
+
+        def login(i):
+            cache.clear()
+            client.force_login(pick_tariff(i)[0].user)
+            return ()
+
+        results['lk_render_cold'] = measure(lambda: client.get(lk_url), min(iterations, 100), login)
+        results['lk_render_cached'] = measure(lambda: client.get(lk_url), min(iterations, 100))
+
+        # те же запросы к lk при разных хранилищах сессий: разница в queries_mean — обращения к django_session
+        for mode, engine in settings.SESSION_ENGINES.items():
+            with override_settings(SESSION_ENGINE=engine):
+                session_client = Client()
+                session_client.force_login(pick_tariff(0)[0].user)
+                session_client.get(lk_url)
+                results[f'lk_render_session_{mode}'] = measure(
+                    lambda: session_client.get(lk_url), min(iterations, 100),
+                )
+        return results
+
+    def current_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
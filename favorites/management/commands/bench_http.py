@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand
+
+from favorites.benchmarks import summarize_durations
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагружает запущенные серверы по HTTP и сравнивает запросы в секунду и p99. '
+        'Например, для сравнения WSGI и ASGI: gunicorn recipe.wsgi -b :8000 и '
+        'uvicorn recipe.asgi:application --port 8001, затем '
+        'manage.py bench_http http://127.0.0.1:8000/lk/ http://127.0.0.1:8001/lk/ --cookie sessionid=...'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--cookie', action='append', default=[], help='Cookie вида name=value, можно несколько')
+
+    def handle(self, *args, **options):
+        headers = {'Cookie': '; '.join(options['cookie'])} if options['cookie'] else {}
+        results = {
+            url: self.run(url, headers, options['requests'], options['concurrency'], options['warmup'])
+            for url in options['urls']
+        }
+        self.stdout.write(json.dumps(results, indent=2, ensure_ascii=False))
+
+    def run(self, url, headers, total, concurrency, warmup):
+        def fetch(_):
+            request = urllib.request.Request(url, headers=headers)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                    ok = response.status < 400
+            except (urllib.error.URLError, OSError):
+                ok = False
+            return time.perf_counter() - started, ok
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(fetch, range(warmup)))
+            started = time.perf_counter()
+            samples = list(executor.map(fetch, range(total)))
+            elapsed = time.perf_counter() - started
+
+        summary = summarize_durations([duration for duration, _ in samples])
+        summary['requests_per_second'] = round(total / elapsed, 1)
+        summary['errors'] = sum(1 for _, ok in samples if not ok)
+        return summary
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from favorites.snapshot import build_catalog_snapshot, get_snapshot_path
+
+
+class Command(BaseCommand):
+    help = 'Собирает снимок активного каталога для отображения в память воркерами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Файл снимка (по умолчанию CATALOG_SNAPSHOT_PATH)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or get_snapshot_path()
+        if not path:
+            raise CommandError('Не задан путь: укажите --path или CATALOG_SNAPSHOT_PATH')
+
+        version, count = build_catalog_snapshot(path)
+        self.stdout.write(self.style.SUCCESS(f'Снимок {path}: версия {version}, блюд {count}'))
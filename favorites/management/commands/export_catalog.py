@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from favorites.catalog import iter_catalog_csv, iter_catalog_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Выгружает каталог блюд и ингредиентов в CSV или JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default='jsonl')
+        parser.add_argument('-o', '--output', help='Файл для записи (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        lines = iter_catalog_csv() if options['format'] == 'csv' else iter_catalog_jsonl()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from favorites.catalog import IMPORT_CHUNK_SIZE, import_catalog, read_catalog_csv, read_catalog_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Загружает каталог из CSV или JSONL, обновляя существующие записи по id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='По умолчанию определяется по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        reader = read_catalog_csv if file_format == 'csv' else read_catalog_jsonl
+
+        started = time.perf_counter()
+        try:
+            with open(path, encoding='utf-8', newline='') as source:
+                counts = import_catalog(reader(source), options['chunk_size'])
+        except (OSError, KeyError, ValueError) as e:
+            raise CommandError(f'Не удалось импортировать каталог: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано: ингредиентов {counts["ingredient"]}, блюд {counts["dish"]}, '
+            f'позиций состава {counts["dish_ingredient"]} за {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from favorites.prices import (
+    INGEST_CHUNK_SIZE, PRICE_WINDOW_DAYS, ingest_prices, read_price_feed, recalculate_average_prices,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Добавляет наблюдения цен из CSV (ingredient_id, observed_on, price) в историю и '
+        'пересчитывает среднюю цену затронутых ингредиентов по скользящему окну'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл CSV или «-» для чтения из stdin')
+        parser.add_argument('--window', type=int, default=PRICE_WINDOW_DAYS, help='Окно усреднения в днях')
+        parser.add_argument('--chunk-size', type=int, default=INGEST_CHUNK_SIZE)
+        parser.add_argument('--no-recalculate', action='store_true', help='Только записать наблюдения')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            if options['path'] == '-':
+                count, ingredient_ids = ingest_prices(read_price_feed(sys.stdin), options['chunk_size'])
+            else:
+                with open(options['path'], encoding='utf-8', newline='') as source:
+                    count, ingredient_ids = ingest_prices(read_price_feed(source), options['chunk_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Не удалось загрузить цены: {e}')
+
+        updated = 0
+        if ingredient_ids and not options['no_recalculate']:
+            updated = recalculate_average_prices(ingredient_ids, options['window'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено наблюдений: {count}, ингредиентов с новой средней ценой: {updated} '
+            f'за {time.perf_counter() - started:.2f} с'
+        ))
@@ -0,0 +1,144 @@
+import json
+import os
+import random
+import tempfile
+import threading
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from favorites.benchmarks import run_concurrently, seed_catalog, seed_users
+from favorites.models import Dish, MealTariff, UserProfile
+
+
+SCENARIOS = ('cold_lk', 'swap_storm', 'registration_burst', 'admin_edits')
+
+
+def status_of(response):
+    # исключение из представления поднимаем, чтобы в отчёте было видно его текст, а не просто 500
+    if response.exc_info:
+        raise response.exc_info[1]
+    return response.status_code
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочные сценарии на временной файловой SQLite-базе через потоки тестового клиента: '
+        'lk с холодным кешем (полночь), шквал замен на одном аккаунте, волна регистраций и '
+        'правка каталога админом под нагрузкой. Выводит пропускную способность, долю ошибок и '
+        'ошибки блокировок в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', dest='scenarios', action='append', choices=SCENARIOS,
+            help='Сценарий для запуска; можно указать несколько раз (по умолчанию все)',
+        )
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=25, help='Запросов на поток')
+        parser.add_argument('--dishes', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'] or list(SCENARIOS)
+        if connection.vendor != 'sqlite':
+            raise CommandError('Сценарии рассчитаны на SQLite')
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        old_test_name = test_settings.get('NAME')
+        fd, test_settings['NAME'] = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            rng = random.Random(options['seed'])
+            seed_catalog(rng, options['dishes'], ingredients_per_dish=10)
+            self.user_ids = seed_users(rng, options['users'])
+            results = {
+                scenario: getattr(self, f'scenario_{scenario}')(options['threads'], options['requests'])
+                for scenario in scenarios
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            teardown_test_environment()
+
+        self.stdout.write(json.dumps(results, indent=2, ensure_ascii=False))
+
+    def make_clients(self, threads, user_ids):
+        clients = []
+        for i in range(threads):
+            client = Client(raise_request_exception=False)
+            client.force_login(User.objects.get(pk=user_ids[i % len(user_ids)]))
+            clients.append(client)
+        return clients
+
+    def scenario_cold_lk(self, threads, requests):
+        clients = self.make_clients(threads, self.user_ids)
+        url = reverse('favorites:lk')
+        cache.clear()
+        return run_concurrently(lambda t, i: status_of(clients[t].get(url)), threads, requests)
+
+    def scenario_swap_storm(self, threads, requests):
+        user_id = self.user_ids[0]
+        tariff = MealTariff.objects.get(user_id=user_id)
+        MealTariff.objects.filter(pk=tariff.pk).update(lunch=True)
+        UserProfile.objects.filter(user_id=user_id).update(meal_swaps_remaining=3)
+        clients = self.make_clients(threads, [user_id])
+        url = reverse('favorites:replace_dish', kwargs={'meal_type': 'LUNCH'})
+
+        swaps_done = []
+        lock = threading.Lock()
+
+        def swap(t, i):
+            response = clients[t].post(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            if response.status_code == 200:
+                with lock:
+                    swaps_done.append(1)
+            return status_of(response)
+
+        summary = run_concurrently(swap, threads, requests)
+        summary['swaps_allowed'] = 3
+        summary['swaps_done'] = len(swaps_done)
+        summary['swaps_remaining'] = UserProfile.objects.get(user_id=user_id).meal_swaps_remaining
+        return summary
+
+    def scenario_registration_burst(self, threads, requests):
+        clients = [Client(raise_request_exception=False) for _ in range(threads)]
+        url = reverse('favorites:registration')
+
+        def register(t, i):
+            client = clients[t]
+            client.logout()
+            response = client.post(url, {
+                'first_name': 'Нагрузка',
+                'email': f'load-{t}-{i}@example.com',
+                'password1': 'Sup3r-secret-pass',
+                'password2': 'Sup3r-secret-pass',
+            })
+            return status_of(response)
+
+        return run_concurrently(register, threads, requests)
+
+    def scenario_admin_edits(self, threads, requests):
+        readers = max(threads - 1, 1)
+        clients = self.make_clients(readers, self.user_ids)
+        url = reverse('favorites:lk')
+        dish_ids = list(Dish.objects.values_list('pk', flat=True)[:200])
+
+        def work(t, i):
+            if t == readers:
+                dish = Dish.objects.get(pk=dish_ids[i % len(dish_ids)])
+                dish.is_active = not dish.is_active
+                dish.save()
+                return 200
+            return status_of(clients[t].get(url))
+
+        return run_concurrently(work, readers + 1, requests)
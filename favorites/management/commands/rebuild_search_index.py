@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from favorites.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс блюд'
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано блюд: {count}'))
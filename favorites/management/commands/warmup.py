@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from favorites.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогревает процесс (подключения к базе, маршруты, шаблоны, данные каталога) и выводит время '
+        'каждой фазы. Воркеры gunicorn прогреваются тем же кодом через favorites.warmup.post_fork'
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        for name, seconds, count in warm_up():
+            self.stdout.write(f'{name:<10} {seconds * 1000:9.1f} мс  {count}')
+        self.stdout.write(self.style.SUCCESS(f'Всего: {(time.perf_counter() - started) * 1000:.1f} мс'))
@@ -0,0 +1,561 @@
+from datetime import timedelta
+from decimal import Decimal
+import hashlib
+import random
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .calories import compose_in_band, drop_ids, exclude_ids, pick_in_window, pick_nearest
+from .history import DishHistory
+from .models import Allergy, Dish, MealTariff, UserProfile, WeeklyMenu
+from .popularity import record_swap_away
+from .preferences import DishPreferences
+from .snapshot import get_snapshot
+
+
+WEEK_DAYS = 7
+# сколько id за раз уходит в pk__in при сверке пула со снимком
+ID_CHUNK_SIZE = 500
+
+
+def get_meal_types(user_tariff):
+    meal_types = []
+    if user_tariff.breakfast:
+        meal_types.append('BREAKFAST')
+    if user_tariff.lunch:
+        meal_types.append('LUNCH')
+    if user_tariff.dinner:
+        meal_types.append('DINNER')
+    if user_tariff.desserts:
+        meal_types.append('SNACK')
+    return meal_types
+
+
+def get_allergen_mask(user_tariff):
+    fields = Allergy.TARIFF_FIELD_MAPPING.values()
+    return sum(1 << bit for bit, field in enumerate(fields) if getattr(user_tariff, field))
+
+
+def get_calorie_band(user):
+    band = UserProfile.objects.filter(user=user).values_list('calorie_target_min', 'calorie_target_max').first()
+    return _to_calorie_band(band)
+
+
+async def aget_calorie_band(user):
+    band = await UserProfile.objects.filter(user=user).values_list('calorie_target_min', 'calorie_target_max').afirst()
+    return _to_calorie_band(band)
+
+
+def _to_calorie_band(band):
+    if not band or band == (None, None):
+        return None
+    low, high = band
+    return low or 0, high if high is not None else float('inf')
+
+
+def get_calorie_candidates(user_tariff, meal_type):
+    """Блюда приёма пищи как отсортированные по калорийности списки (калории, id).
+
+    Берутся из снимка каталога, если он настроен; иначе кешируются по (диета, тип приёма
+    пищи, маска аллергенов) и сбрасываются вместе с остальным кешем при изменении каталога.
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.calorie_candidates(user_tariff.diet_type, meal_type, get_allergen_mask(user_tariff))
+
+    cache_key = f"calorie_candidates_{user_tariff.diet_type}_{meal_type}_{get_allergen_mask(user_tariff)}"
+    candidates = cache.get(cache_key)
+    if candidates is None:
+        rows = get_filtered_dishes(user_tariff, meal_type, None).order_by('total_calories', 'pk')
+        rows = list(rows.values_list('total_calories', 'pk'))
+        candidates = ([calories for calories, _ in rows], [pk for _, pk in rows])
+        cache.set(cache_key, candidates, 60 * 60 * 24)
+    return candidates
+
+
+def compose_calorie_menu(user_tariff, band, exclude=(), rng=random, blocked=frozenset()):
+    """Подбирает {тип приёма пищи: id блюда} с суммой калорий в диапазоне `band` или None.
+
+    Блюда из `exclude` избегаются, пока без них диапазон достижим, а из `blocked` не берутся никогда.
+    """
+    meal_types, candidates = [], []
+    for meal_type in get_meal_types(user_tariff):
+        meal_candidates = drop_ids(get_calorie_candidates(user_tariff, meal_type), blocked)
+        if meal_candidates[1]:
+            meal_types.append(meal_type)
+            candidates.append(meal_candidates)
+
+    dish_ids = compose_in_band([exclude_ids(meal_candidates, exclude) for meal_candidates in candidates], *band, rng)
+    if dish_ids is None and exclude:
+        # повтор недавнего блюда лучше, чем меню мимо нормы калорий
+        dish_ids = compose_in_band(candidates, *band, rng)
+    if dish_ids is None:
+        return None
+    return dict(zip(meal_types, dish_ids))
+
+
+def invalidate_user_menus(user):
+    today = timezone.now().date()
+    cache.delete(f"daily_menu_{user.id}_{today}")
+    WeeklyMenu.objects.filter(user=user).delete()
+    UserProfile.objects.filter(user=user).exclude(menu_overrides={}).update(menu_overrides={})
+
+
+def get_candidate_ids(user_tariff, meal_type, max_price=None, ignore_allergies=False):
+    """id подходящих активных блюд: из снимка каталога, если он есть, иначе из базы."""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        allergen_mask = 0 if ignore_allergies else get_allergen_mask(user_tariff)
+        return snapshot.candidate_ids(user_tariff.diet_type, meal_type, allergen_mask, max_price)
+    return list(_candidate_queryset(user_tariff, meal_type, max_price, ignore_allergies).values_list('pk', flat=True))
+
+
+async def aget_candidate_ids(user_tariff, meal_type, max_price=None, ignore_allergies=False):
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        allergen_mask = 0 if ignore_allergies else get_allergen_mask(user_tariff)
+        return snapshot.candidate_ids(user_tariff.diet_type, meal_type, allergen_mask, max_price)
+    dishes = _candidate_queryset(user_tariff, meal_type, max_price, ignore_allergies)
+    return [pk async for pk in dishes.values_list('pk', flat=True)]
+
+
+def _candidate_queryset(user_tariff, meal_type, max_price, ignore_allergies):
+    if ignore_allergies:
+        return Dish.objects.filter(is_active=True, diet_type=user_tariff.diet_type, meal_type=meal_type)
+    return get_filtered_dishes(user_tariff, meal_type, max_price)
+
+
+def _active_dish_ids(dish_ids):
+    """id из `dish_ids`, которые есть в базе среди активных блюд, в исходном порядке."""
+    dish_ids = list(dish_ids)
+    active = set()
+    for start in range(0, len(dish_ids), ID_CHUNK_SIZE):
+        chunk = dish_ids[start:start + ID_CHUNK_SIZE]
+        active.update(Dish.objects.filter(pk__in=chunk, is_active=True).values_list('pk', flat=True))
+    return [pk for pk in dish_ids if pk in active]
+
+
+async def _aactive_dish_ids(dish_ids):
+    dish_ids = list(dish_ids)
+    active = set()
+    for start in range(0, len(dish_ids), ID_CHUNK_SIZE):
+        chunk = dish_ids[start:start + ID_CHUNK_SIZE]
+        active.update([pk async for pk in Dish.objects.filter(pk__in=chunk, is_active=True).values_list('pk', flat=True)])
+    return [pk for pk in dish_ids if pk in active]
+
+
+def _pick_dish(dish_ids, history, preferences):
+    """Выбирает и загружает блюдо; None, если выбрать не из чего.
+
+    Снимок каталога может отставать от базы (блюдо удалено или снято до пересборки).
+    Тогда пул один раз сверяется с базой и выбор повторяется среди блюд, которые в ней есть.
+    """
+    dish_ids = preferences.allowed(dish_ids)
+    dish_id = history.pick(dish_ids, preferences.favorite_ids)
+    if dish_id is None:
+        return None
+    dish = Dish.objects.filter(pk=dish_id, is_active=True).first()
+    if dish is None:
+        dish_id = history.pick(_active_dish_ids(dish_ids), preferences.favorite_ids)
+        dish = Dish.objects.filter(pk=dish_id).first() if dish_id is not None else None
+    return dish
+
+
+def seeded_choice(dish_ids, user_id, day, meal_type):
+    """Детерминированно выбирает id блюда пользователю на день.
+
+    Пул перемешивается генератором с зерном из пользователя и типа приёма пищи, а дни
+    идут по перестановке по кругу: в любые len(пул) дней подряд блюдо не повторяется.
+    Версией каталога служит сам отсортированный пул — любое его изменение меняет выбор,
+    а правки, которые пул не затрагивают, меню не сдвигают.
+    """
+    dish_ids = sorted(dish_ids)
+    if not dish_ids:
+        return None
+
+    _seeded_random(user_id, meal_type, len(dish_ids)).shuffle(dish_ids)
+    return dish_ids[day.toordinal() % len(dish_ids)]
+
+
+def _seeded_random(*parts):
+    digest = hashlib.sha256(':'.join(map(str, parts)).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+def get_menu_overrides(user, day):
+    overrides = UserProfile.objects.filter(user=user).values_list('menu_overrides', flat=True).first() or {}
+    return overrides.get('dishes', {}) if overrides.get('date') == day.isoformat() else {}
+
+
+def save_menu_override(user, day, meal_type, dish_id):
+    dishes = get_menu_overrides(user, day)
+    dishes[meal_type] = dish_id
+    UserProfile.objects.filter(user=user).update(menu_overrides={'date': day.isoformat(), 'dishes': dishes})
+
+
+def get_seeded_menu(user, user_tariff, day, max_price=None):
+    """Меню без состояния: одни и те же пользователь, день и каталог дают одно меню в любом процессе.
+
+    Поверх выбора накладываются замены пользователя за этот день.
+    """
+    overrides = get_menu_overrides(user, day)
+    preferences = DishPreferences.for_user(user)
+    band = get_calorie_band(user)
+    composed = compose_calorie_menu(
+        user_tariff, band, rng=_seeded_random(user.id, day), blocked=preferences.blocked_ids,
+    ) if band else None
+
+    chosen = {}
+    for meal_type in get_meal_types(user_tariff):
+        if composed is not None:
+            if meal_type in composed:
+                chosen[meal_type] = (overrides.get(meal_type), composed[meal_type])
+            continue
+
+        if not preferences.allowed(get_candidate_ids(user_tariff, meal_type, max_price)):
+            continue
+
+        dish_ids = preferences.allowed(get_candidate_ids(user_tariff, meal_type))
+        if not dish_ids:
+            dish_ids = preferences.allowed(get_candidate_ids(user_tariff, meal_type, ignore_allergies=True))
+        if dish_ids:
+            dish_ids = preferences.weighted_pool(dish_ids)
+            chosen[meal_type] = (overrides.get(meal_type), seeded_choice(dish_ids, user.id, day, meal_type))
+
+    dishes = Dish.objects.in_bulk({pk for pks in chosen.values() for pk in pks if pk is not None})
+    menu = {}
+    for meal_type, (override_id, seeded_id) in chosen.items():
+        dish = dishes.get(override_id) if override_id in dishes and dishes[override_id].is_active else None
+        dish = dish or dishes.get(seeded_id)
+        # блюдо из отставшего снимка могло исчезнуть из базы
+        if dish is not None:
+            menu[meal_type] = dish
+    return menu
+
+
+def get_daily_menu_for_user(user, user_tariff, max_price=None):
+    today = timezone.now().date()
+    cache_key = f"daily_menu_{user.id}_{today}"
+
+    menu = cache.get(cache_key)
+    if menu:
+        return menu
+
+    if settings.DETERMINISTIC_MENUS:
+        menu = get_seeded_menu(user, user_tariff, today, max_price)
+        cache.set(cache_key, menu, 60 * 60 * 24)
+        return menu
+
+    history = DishHistory.for_user(user)
+    preferences = DishPreferences.for_user(user)
+    band = get_calorie_band(user)
+    composed = compose_calorie_menu(user_tariff, band, history, blocked=preferences.blocked_ids) if band else None
+
+    if composed is not None:
+        dishes = Dish.objects.in_bulk(composed.values())
+        menu = {meal_type: dishes[dish_id] for meal_type, dish_id in composed.items() if dish_id in dishes}
+    else:
+        menu = _pick_daily_menu(user_tariff, max_price, history, preferences)
+
+    if menu:
+        history.push(*(dish.pk for dish in menu.values()))
+        history.save(user)
+    cache.set(cache_key, menu, 60 * 60 * 24)
+    return menu
+
+
+def _pick_daily_menu(user_tariff, max_price, history, preferences):
+    menu = {}
+    for meal_type in get_meal_types(user_tariff):
+        if preferences.allowed(get_candidate_ids(user_tariff, meal_type, max_price)):
+            selected_dish = _pick_dish(get_candidate_ids(user_tariff, meal_type), history, preferences)
+            if selected_dish is None:
+                selected_dish = _pick_dish(
+                    get_candidate_ids(user_tariff, meal_type, ignore_allergies=True), history, preferences,
+                )
+            if selected_dish is not None:
+                menu[meal_type] = selected_dish
+    return menu
+
+
+def get_filtered_dishes(user_tariff, meal_type=None, max_price=None):
+    try:
+        dishes = Dish.objects.filter(is_active=True, diet_type=user_tariff.diet_type)
+
+        if not hasattr(dishes, 'filter'):
+            return Dish.objects.none()
+
+        if meal_type:
+            dishes = dishes.filter(meal_type=meal_type)
+
+        if max_price is not None:
+            try:
+                max_price_decimal = Decimal(str(max_price))
+                dishes = dishes.filter(total_price__lte=max_price_decimal)
+            except (ValueError, TypeError) as e:
+                print(f"Error converting max_price to Decimal: {e}")
+
+        allergen_mask = get_allergen_mask(user_tariff)
+        if allergen_mask:
+            dishes = dishes.alias(
+                forbidden_allergens=F('allergen_mask').bitand(allergen_mask)
+            ).filter(forbidden_allergens=0)
+
+        return dishes
+    except Exception as e:
+        return Dish.objects.none()
+
+
+def _pick_calorie_swap(user, user_tariff, menu, meal_type, history, preferences):
+    """Замена, при которой сумма калорий за день остаётся в диапазоне пользователя."""
+    band = get_calorie_band(user)
+    if not band:
+        return None
+
+    current_dish = menu.get(meal_type)
+    others = sum(dish.total_calories for other, dish in menu.items() if other != meal_type)
+    exclude = set(history.dish_ids) | ({current_dish.pk} if current_dish else set())
+    candidates = exclude_ids(drop_ids(get_calorie_candidates(user_tariff, meal_type), preferences.blocked_ids), exclude)
+    low, high = band[0] - others, band[1] - others
+    dish_id = pick_in_window(candidates, low, high)
+    if dish_id is None:
+        dish_id = pick_nearest(candidates, low if high == float('inf') else (low + high) / 2)
+    if dish_id is None or (current_dish and dish_id == current_dish.pk):
+        return None
+    return Dish.objects.filter(pk=dish_id).first()
+
+
+def replace_dish_in_menu(user, user_tariff, meal_type, max_price=None):
+    today = timezone.now().date()
+    cache_key = f"daily_menu_{user.id}_{today}"
+
+    menu = cache.get(cache_key)
+    if not menu:
+        menu = get_seeded_menu(user, user_tariff, today, max_price) if settings.DETERMINISTIC_MENUS else {}
+
+    dish_ids = get_candidate_ids(user_tariff, meal_type, max_price)
+
+    current_dish = menu.get(meal_type)
+    if current_dish:
+        dish_ids = [pk for pk in dish_ids if pk != current_dish.pk]
+
+    history = DishHistory.for_user(user)
+    preferences = DishPreferences.for_user(user)
+    new_dish = _pick_calorie_swap(user, user_tariff, menu, meal_type, history, preferences)
+    if new_dish is None:
+        new_dish = _pick_dish(dish_ids, history, preferences)
+    if new_dish:
+        if current_dish:
+            record_swap_away(current_dish.pk)
+        menu[meal_type] = new_dish
+        if settings.DETERMINISTIC_MENUS:
+            save_menu_override(user, today, meal_type, new_dish.pk)
+        cache.set(cache_key, menu, 60 * 60 * 24)
+        history.push(new_dish.pk)
+        history.save(user)
+        return new_dish
+
+    return None
+
+
+async def _apick_dish(dish_ids, history, preferences):
+    dish_ids = preferences.allowed(dish_ids)
+    dish_id = history.pick(dish_ids, preferences.favorite_ids)
+    if dish_id is None:
+        return None
+    dish = await Dish.objects.filter(pk=dish_id, is_active=True).afirst()
+    if dish is None:
+        dish_id = history.pick(await _aactive_dish_ids(dish_ids), preferences.favorite_ids)
+        dish = await Dish.objects.filter(pk=dish_id).afirst() if dish_id is not None else None
+    return dish
+
+
+async def aget_daily_menu_for_user(user, user_tariff, max_price=None):
+    """Асинхронный вариант get_daily_menu_for_user на async ORM и async API кеша."""
+    today = timezone.now().date()
+    cache_key = f"daily_menu_{user.id}_{today}"
+
+    menu = await cache.aget(cache_key)
+    if menu:
+        return menu
+
+    if settings.DETERMINISTIC_MENUS or await aget_calorie_band(user):
+        return await sync_to_async(get_daily_menu_for_user)(user, user_tariff, max_price)
+
+    history = await DishHistory.afor_user(user)
+    preferences = await DishPreferences.afor_user(user)
+    menu = {}
+    for meal_type in get_meal_types(user_tariff):
+        if not preferences.allowed(await aget_candidate_ids(user_tariff, meal_type, max_price)):
+            continue
+
+        selected_dish = await _apick_dish(await aget_candidate_ids(user_tariff, meal_type), history, preferences)
+        if selected_dish is None:
+            selected_dish = await _apick_dish(
+                await aget_candidate_ids(user_tariff, meal_type, ignore_allergies=True), history, preferences,
+            )
+        if selected_dish is not None:
+            menu[meal_type] = selected_dish
+
+    if menu:
+        history.push(*(dish.pk for dish in menu.values()))
+        await history.asave(user)
+    await cache.aset(cache_key, menu, 60 * 60 * 24)
+    return menu
+
+
+async def areplace_dish_in_menu(user, user_tariff, meal_type, max_price=None):
+    if settings.DETERMINISTIC_MENUS or await aget_calorie_band(user):
+        return await sync_to_async(replace_dish_in_menu)(user, user_tariff, meal_type, max_price)
+
+    today = timezone.now().date()
+    cache_key = f"daily_menu_{user.id}_{today}"
+
+    menu = await cache.aget(cache_key) or {}
+
+    dish_ids = await aget_candidate_ids(user_tariff, meal_type, max_price)
+
+    current_dish = menu.get(meal_type)
+    if current_dish:
+        dish_ids = [pk for pk in dish_ids if pk != current_dish.pk]
+
+    history = await DishHistory.afor_user(user)
+    preferences = await DishPreferences.afor_user(user)
+    new_dish = await _apick_dish(dish_ids, history, preferences)
+    if new_dish:
+        if current_dish:
+            record_swap_away(current_dish.pk)
+        menu[meal_type] = new_dish
+        await cache.aset(cache_key, menu, 60 * 60 * 24)
+        history.push(new_dish.pk)
+        await history.asave(user)
+
+    return new_dish
+
+
+def toggle_blocked_dish(user, dish, max_price=None):
+    """Скрывает блюдо или возвращает его в подбор; True, если теперь оно скрыто.
+
+    Из меню на сегодня и плана на неделю убираются только слоты со скрытым блюдом,
+    без списания замен; остальные блюда и сделанные за день замены остаются.
+    """
+    user_tariff = MealTariff.objects.filter(user=user).first()
+    today = timezone.now().date()
+    if user_tariff is not None and settings.DETERMINISTIC_MENUS:
+        # детерминированное меню зависит от пула кандидатов, который сейчас изменится,
+        # поэтому показанные блюда закрепляются заменами за этот день
+        menu = get_daily_menu_for_user(user, user_tariff, max_price)
+        overrides = {meal_type: pk for meal_type, pk in get_menu_overrides(user, today).items() if pk != dish.pk}
+        overrides.update({meal_type: menu_dish.pk for meal_type, menu_dish in menu.items() if menu_dish.pk != dish.pk})
+        UserProfile.objects.filter(user=user).update(menu_overrides={'date': today.isoformat(), 'dishes': overrides})
+
+    blocked = DishPreferences.toggle_for_user(user, dish.pk, blocked=True)
+    if blocked and user_tariff is not None:
+        _replace_blocked_in_daily_menu(user, user_tariff, dish, max_price)
+        _replace_blocked_in_weekly_plan(user, user_tariff, dish, max_price)
+    return blocked
+
+
+def _replace_blocked_in_daily_menu(user, user_tariff, dish, max_price):
+    cache_key = f"daily_menu_{user.id}_{timezone.now().date()}"
+    menu = cache.get(cache_key)
+    if not menu:
+        return
+
+    for meal_type, menu_dish in list(menu.items()):
+        if menu_dish.pk == dish.pk and replace_dish_in_menu(user, user_tariff, meal_type, max_price) is None:
+            menu = cache.get(cache_key) or menu
+            menu.pop(meal_type, None)
+            cache.set(cache_key, menu, 60 * 60 * 24)
+
+
+def _replace_blocked_in_weekly_plan(user, user_tariff, dish, max_price):
+    weekly_menu = WeeklyMenu.objects.filter(user=user).first()
+    if weekly_menu is None or dish.pk not in weekly_menu.get_dish_ids():
+        return
+
+    preferences = DishPreferences.for_user(user)
+    plan = weekly_menu.plan
+    for meal_type, pks in list(plan.items()):
+        if dish.pk not in pks:
+            continue
+        pool = preferences.allowed(get_candidate_ids(user_tariff, meal_type, max_price))
+        unused = [pk for pk in pool if pk not in pks] or pool
+        if unused:
+            plan[meal_type] = [random.choice(unused) if pk == dish.pk else pk for pk in pks]
+        else:
+            del plan[meal_type]
+    weekly_menu.save(update_fields=['plan'])
+
+
+def get_week_start(day=None):
+    day = day or timezone.now().date()
+    return day - timedelta(days=day.weekday())
+
+
+def build_weekly_plan(user_tariff, max_price=None, days=WEEK_DAYS, preferences=None):
+    """Составляет план на `days` дней одним запросом кандидатов на все приёмы пищи.
+
+    Блюда внутри одного приёма пищи не повторяются, пока не исчерпан пул кандидатов.
+    Скрытые пользователем блюда не попадают в план, а избранные идут в каждом круге первыми.
+    """
+    preferences = preferences or DishPreferences()
+    meal_types = get_meal_types(user_tariff)
+    if not meal_types:
+        return {}
+
+    if get_snapshot() is not None:
+        candidates = {meal_type: get_candidate_ids(user_tariff, meal_type, max_price) for meal_type in meal_types}
+    else:
+        candidates = {meal_type: [] for meal_type in meal_types}
+        dishes = get_filtered_dishes(user_tariff, None, max_price).filter(meal_type__in=meal_types)
+        for pk, meal_type in dishes.values_list('pk', 'meal_type'):
+            candidates[meal_type].append(pk)
+
+    plan = {}
+    for meal_type, pks in candidates.items():
+        pks = preferences.allowed(pks)
+        if not pks:
+            continue
+        picked = []
+        while len(picked) < days:
+            random.shuffle(pks)
+            if preferences.favorite_ids:
+                pks.sort(key=lambda pk: pk not in preferences.favorite_ids)
+            picked.extend(pks[:days - len(picked)])
+        plan[meal_type] = picked
+    return plan
+
+
+def get_weekly_menu_for_user(user, user_tariff, max_price=None):
+    """Возвращает список дней недели вида {'date': ..., 'dishes': [(тип, блюдо), ...]}."""
+    week_start = get_week_start()
+    weekly_menu = WeeklyMenu.objects.filter(user=user).first()
+
+    dishes_by_pk = None
+    if weekly_menu and weekly_menu.week_start == week_start:
+        dishes_by_pk = Dish.objects.filter(is_active=True).in_bulk(weekly_menu.get_dish_ids())
+        if len(dishes_by_pk) != len(weekly_menu.get_dish_ids()):
+            dishes_by_pk = None
+
+    if dishes_by_pk is None:
+        plan = build_weekly_plan(user_tariff, max_price, preferences=DishPreferences.for_user(user))
+        weekly_menu, _ = WeeklyMenu.objects.update_or_create(
+            user=user,
+            defaults={'week_start': week_start, 'plan': plan},
+        )
+        dishes_by_pk = Dish.objects.in_bulk(weekly_menu.get_dish_ids())
+
+    days = []
+    for offset in range(WEEK_DAYS):
+        dishes = []
+        for meal_type in get_meal_types(user_tariff):
+            pks = weekly_menu.plan.get(meal_type)
+            if pks and pks[offset] in dishes_by_pk:
+                dishes.append((meal_type, dishes_by_pk[pks[offset]]))
+        days.append({'date': week_start + timedelta(days=offset), 'dishes': dishes})
+    return days
@@ -0,0 +1,113 @@
+"""Метрики запросов, SQL и кеша в памяти процесса в текстовом формате Prometheus.
+
+На горячем пути только увеличиваются счётчики под блокировкой; текст собирается
+лишь при обращении к /metrics.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+import threading
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.request_latency = defaultdict(Histogram)
+        self.requests = defaultdict(int)
+        self.sql_queries = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+        self.cache_operations = defaultdict(int)
+
+    def observe_request(self, view, method, status, duration, query_count=0, query_seconds=0.0):
+        with self.lock:
+            self.request_latency[view].observe(duration)
+            self.requests[(view, method, status)] += 1
+            self.sql_queries[view] += query_count
+            self.sql_seconds[view] += query_seconds
+
+    def record_cache(self, operation, result=''):
+        with self.lock:
+            self.cache_operations[(operation, result)] += 1
+
+    def render(self):
+        with self.lock:
+            lines = [
+                '# HELP favorites_request_duration_seconds Время обработки запроса по представлению',
+                '# TYPE favorites_request_duration_seconds histogram',
+            ]
+            for view, histogram in sorted(self.request_latency.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'favorites_request_duration_seconds_bucket{{view="{view}",le="{le}"}} {cumulative}')
+                lines.append(f'favorites_request_duration_seconds_sum{{view="{view}"}} {histogram.sum:.6f}')
+                lines.append(f'favorites_request_duration_seconds_count{{view="{view}"}} {histogram.count}')
+
+            lines += ['# TYPE favorites_requests_total counter']
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'favorites_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+            lines += ['# TYPE favorites_sql_queries_total counter']
+            for view, count in sorted(self.sql_queries.items()):
+                lines.append(f'favorites_sql_queries_total{{view="{view}"}} {count}')
+
+            lines += ['# TYPE favorites_sql_seconds_total counter']
+            for view, seconds in sorted(self.sql_seconds.items()):
+                lines.append(f'favorites_sql_seconds_total{{view="{view}"}} {seconds:.6f}')
+
+            lines += ['# TYPE favorites_cache_operations_total counter']
+            for (operation, result), count in sorted(self.cache_operations.items()):
+                lines.append(f'favorites_cache_operations_total{{operation="{operation}",result="{result}"}} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentedLocMemCache(LocMemCache):
+    """LocMemCache, который считает обращения, попадания и промахи."""
+
+    _missing = object()
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._missing, version)
+        if value is self._missing:
+            registry.record_cache('get', 'miss')
+            return default
+        registry.record_cache('get', 'hit')
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        registry.record_cache('set')
+        return super().set(key, value, timeout, version)
+
+    def delete(self, key, version=None):
+        registry.record_cache('delete')
+        return super().delete(key, version)
+
+    def clear(self):
+        registry.record_cache('clear')
+        return super().clear()
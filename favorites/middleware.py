@@ -0,0 +1,138 @@
+import cProfile
+import itertools
+import logging
+import os
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .metrics import registry
+
+
+slow_request_logger = logging.getLogger('favorites.slow_requests')
+profiler_logger = logging.getLogger('favorites.profiler')
+
+
+class QueryRecorder:
+    """Обёртка для connection.execute_wrapper: считает запросы и их суммарное время."""
+
+    def __init__(self, keep_sql=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.seconds += duration
+            if self.keep_sql:
+                self.statements.append((duration, sql))
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    """Собирает задержку, число и время SQL-запросов по представлениям и пишет медленные запросы в лог.
+
+    Под ASGI для асинхронных представлений учитывается только задержка: запросы к базе
+    выполняются в отдельном потоке и сюда не попадают.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD', None)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder(keep_sql=self.slow_threshold is not None)
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.finish(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.finish(request, response, time.perf_counter() - started, QueryRecorder())
+        return response
+
+    def finish(self, request, response, duration, recorder):
+        view = _view_name(request)
+        registry.observe_request(view, request.method, response.status_code, duration, recorder.count, recorder.seconds)
+
+        if self.slow_threshold is not None and duration >= self.slow_threshold:
+            statements = '\n'.join(f'  {sql_duration * 1000:.1f} ms: {sql}' for sql_duration, sql in recorder.statements)
+            slow_request_logger.warning(
+                'Медленный запрос %s %s (%s): %.1f ms, SQL: %d запросов за %.1f ms\n%s',
+                request.method, request.get_full_path(), view, duration * 1000,
+                recorder.count, recorder.seconds * 1000, statements,
+            )
+
+
+class ProfilerMiddleware:
+    """Профилирует запрос через cProfile и сохраняет дамп pstats в PROFILER_DIR.
+
+    Персонал включает профилирование параметром ?profile=1 или заголовком X-Profile: 1
+    (при PROFILER_ENABLED), а PROFILER_SAMPLE_RATE = N профилирует каждый N-й запрос.
+    Дампы открываются snakeviz, flameprof или gprof2dot. Если оба режима выключены,
+    Django вовсе не подключает middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'PROFILER_ENABLED', False)
+        self.sample_rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0)
+        if not self.enabled and not self.sample_rate:
+            raise MiddlewareNotUsed
+        self.directory = settings.PROFILER_DIR
+        self.counter = itertools.count(1)
+
+    def __call__(self, request):
+        mode = self.get_mode(request)
+        if mode is None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        path = self.dump(profiler, request, mode)
+        if mode == 'manual':
+            response['X-Profile-File'] = os.path.basename(path)
+        return response
+
+    def get_mode(self, request):
+        if self.enabled and (request.GET.get('profile') == '1' or request.headers.get('X-Profile') == '1'):
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_staff:
+                return 'manual'
+        if self.sample_rate and next(self.counter) % self.sample_rate == 0:
+            return 'sampled'
+        return None
+
+    def dump(self, profiler, request, mode):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^a-zA-Z0-9]+', '-', request.path).strip('-') or 'root'
+        filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{time.perf_counter_ns() % 1000000:06d}-{mode}-{slug}.prof'
+        path = os.path.join(self.directory, filename)
+        profiler.dump_stats(path)
+        profiler_logger.info('Профиль %s %s сохранён в %s', request.method, request.path, path)
+        return path
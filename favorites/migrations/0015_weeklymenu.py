@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0014_allergy_dish_allergies'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeeklyMenu',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('week_start', models.DateField(verbose_name='Начало недели')),
+                ('plan', models.JSONField(default=dict, verbose_name='План')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='weekly_menu', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Меню на неделю',
+                'verbose_name_plural': 'Меню на неделю',
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+SEARCH_TABLE = 'favorites_dish_search'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5('
+        "name, description, recipe, ingredients, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    schema_editor.execute(
+        f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, name, description, recipe, ingredients)
+        SELECT d.id,
+               replace(replace(d.name, 'ё', 'е'), 'Ё', 'Е'),
+               replace(replace(d.description, 'ё', 'е'), 'Ё', 'Е'),
+               replace(replace(d.recipe, 'ё', 'е'), 'Ё', 'Е'),
+               replace(replace(coalesce(group_concat(i.name, ' '), ''), 'ё', 'е'), 'Ё', 'Е')
+        FROM favorites_dish d
+        LEFT JOIN favorites_dishingredient di ON di.dish_id = d.id
+        LEFT JOIN favorites_ingredient i ON i.id = di.ingredient_id
+        GROUP BY d.id
+        """
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0015_weeklymenu'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0016_dish_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='recent_dish_ids',
+            field=models.BinaryField(default=b'', help_text='Упакованные id последних показанных блюд, см. favorites.history', verbose_name='Недавние блюда'),
+        ),
+    ]
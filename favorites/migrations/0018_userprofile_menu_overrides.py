@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0017_userprofile_recent_dish_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='menu_overrides',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Замены в меню'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0018_userprofile_menu_overrides'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='calorie_target_max',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Калорий в день до'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='calorie_target_min',
+            field=models.PositiveIntegerField(blank=True, help_text='Если задан диапазон, меню подбирается так, чтобы сумма калорий за день попала в него', null=True, verbose_name='Калорий в день от'),
+        ),
+    ]
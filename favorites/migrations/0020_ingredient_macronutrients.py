@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0019_userprofile_calorie_target'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='total_carbohydrates',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8, verbose_name='Углеводы (г)'),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='total_fat',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8, verbose_name='Жиры (г)'),
+        ),
+        migrations.AddField(
+            model_name='dish',
+            name='total_protein',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8, verbose_name='Белки (г)'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='carbohydrates',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Граммы углеводов на 100 грамм (1 единицу) продукта', max_digits=6, null=True, verbose_name='Углеводы на 100г (1 единицу)'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='fat',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Граммы жира на 100 грамм (1 единицу) продукта', max_digits=6, null=True, verbose_name='Жиры на 100г (1 единицу)'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='protein',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Граммы белка на 100 грамм (1 единицу) продукта', max_digits=6, null=True, verbose_name='Белки на 100г (1 единицу)'),
+        ),
+    ]
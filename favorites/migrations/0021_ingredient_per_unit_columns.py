@@ -0,0 +1,82 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:52
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Floor
+
+
+UNIT_FACTORS = {'KILOGRAM': 10}
+PER_UNIT_FIELDS = {
+    'cost_per_unit': 'average_price',
+    'calories_per_unit': 'calories',
+    'protein_per_unit': 'protein',
+    'fat_per_unit': 'fat',
+    'carbohydrates_per_unit': 'carbohydrates',
+}
+DISH_TOTALS = {
+    'total_calories': 'calories_per_unit',
+    'total_price': 'cost_per_unit',
+    'total_protein': 'protein_per_unit',
+    'total_fat': 'fat_per_unit',
+    'total_carbohydrates': 'carbohydrates_per_unit',
+}
+
+
+def fill_per_unit_columns(apps, schema_editor):
+    Ingredient = apps.get_model('favorites', 'Ingredient')
+    Dish = apps.get_model('favorites', 'Dish')
+    DishIngredient = apps.get_model('favorites', 'DishIngredient')
+
+    factor = Case(*[When(unit=unit, then=Value(factor)) for unit, factor in UNIT_FACTORS.items()], default=Value(1))
+    Ingredient.objects.update(**{field: F(source) * factor for field, source in PER_UNIT_FIELDS.items()})
+
+    decimal_field = DecimalField(max_digits=12, decimal_places=2)
+    ingredients = DishIngredient.objects.filter(dish=OuterRef('pk')).order_by().values('dish')
+    totals = {}
+    for total_field, per_unit_field in DISH_TOTALS.items():
+        total = Subquery(ingredients.annotate(
+            total=Sum(F('quantity') * F(f'ingredient__{per_unit_field}'), output_field=decimal_field)
+        ).values('total'))
+        if total_field == 'total_calories':
+            totals[total_field] = Coalesce(Cast(Floor(total), IntegerField()), 0)
+        else:
+            totals[total_field] = Coalesce(total, Value(Decimal('0')), output_field=decimal_field)
+    Dish.objects.update(**totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0020_ingredient_macronutrients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='calories_per_unit',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True, verbose_name='Ккал за единицу количества'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='carbohydrates_per_unit',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='cost_per_unit',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Цена за единицу количества'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='fat_per_unit',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='protein_per_unit',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=8, null=True),
+        ),
+        migrations.RunPython(fill_per_unit_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:54
+
+from django.db import migrations, models
+
+
+# порядок битов совпадает с Allergy.TARIFF_FIELD_MAPPING
+MASK_SLUGS = ('fish', 'meat', 'grains', 'honey', 'nuts', 'dairy')
+
+
+def fill_allergen_mask(apps, schema_editor):
+    """Маска для существующих блюд строится по уже проставленным аллергенам.
+
+    Аллергенов у ингредиентов пока нет, поэтому сами связи блюд не пересобираются.
+    """
+    Dish = apps.get_model('favorites', 'Dish')
+    through = Dish.allergies.through
+
+    masks = {}
+    links = through.objects.filter(allergy__slug__in=MASK_SLUGS).values_list('dish_id', 'allergy__slug')
+    for dish_id, slug in links:
+        masks[dish_id] = masks.get(dish_id, 0) | 1 << MASK_SLUGS.index(slug)
+
+    dishes_by_mask = {}
+    for dish_id, mask in masks.items():
+        dishes_by_mask.setdefault(mask, []).append(dish_id)
+    for mask, dish_ids in dishes_by_mask.items():
+        for start in range(0, len(dish_ids), 1000):
+            Dish.objects.filter(pk__in=dish_ids[start:start + 1000]).update(allergen_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0021_ingredient_per_unit_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dish',
+            name='allergen_mask',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Маска аллергенов'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='allergies',
+            field=models.ManyToManyField(blank=True, related_name='ingredients', to='favorites.allergy', verbose_name='Содержит аллергены'),
+        ),
+        migrations.AlterField(
+            model_name='dish',
+            name='allergies',
+            field=models.ManyToManyField(blank=True, help_text='Собираются автоматически из аллергенов ингредиентов', to='favorites.allergy', verbose_name='Содержит аллергены'),
+        ),
+        migrations.RunPython(fill_allergen_mask, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 19:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0022_ingredient_allergies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observed_on', models.DateField(verbose_name='Дата')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8, verbose_name='Цена за 100 грамм (1 единицу)')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='favorites.ingredient')),
+            ],
+            options={
+                'verbose_name': 'Цена ингредиента',
+                'verbose_name_plural': 'История цен ингредиентов',
+                'constraints': [models.UniqueConstraint(fields=('ingredient', 'observed_on'), name='unique_ingredient_price_per_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 20:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0023_ingredientprice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DishDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('impressions', models.PositiveIntegerField(default=0, verbose_name='Показы в меню')),
+                ('swaps_away', models.PositiveIntegerField(default=0, verbose_name='Замены')),
+                ('card_views', models.PositiveIntegerField(default=0, verbose_name='Открытия карточки')),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='favorites.dish')),
+            ],
+            options={
+                'verbose_name': 'Статистика блюда за день',
+                'verbose_name_plural': 'Статистика блюд по дням',
+                'indexes': [models.Index(fields=['day'], name='dish_stats_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dish', 'day'), name='unique_dish_stats_per_day')],
+            },
+        ),
+    ]
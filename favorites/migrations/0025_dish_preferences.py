@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0024_dishdailystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='blocked_dish_ids',
+            field=models.BinaryField(default=b'', verbose_name='Скрытые блюда'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='favorite_dish_ids',
+            field=models.BinaryField(default=b'', help_text='Упакованные id, см. favorites.preferences', verbose_name='Избранные блюда'),
+        ),
+    ]
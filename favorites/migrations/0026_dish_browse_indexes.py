@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 20:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0025_dish_preferences'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['created_at', 'id'], name='dish_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dish',
+            index=models.Index(fields=['diet_type', 'created_at', 'id'], name='dish_browse_idx'),
+        ),
+    ]
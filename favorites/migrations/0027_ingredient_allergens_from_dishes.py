@@ -0,0 +1,57 @@
+# Generated by Django 5.2.7 on 2026-10-19 20:14
+
+from django.db import migrations
+
+
+def tag_ingredients_from_dishes(apps, schema_editor):
+    """Переносит проставленные вручную аллергены блюд на их ингредиенты.
+
+    Без этого первая же пересборка из ингредиентов стёрла бы аллергены блюд. Ингредиент
+    получает аллерген, общий для всех блюд, где он встречается. Если у блюда остался
+    непокрытый аллерген, он достаётся всем его ингредиентам: лишний аллерген только
+    скрывает блюдо, а потерянный показал бы его аллергику.
+    """
+    Dish = apps.get_model('favorites', 'Dish')
+    DishIngredient = apps.get_model('favorites', 'DishIngredient')
+    Ingredient = apps.get_model('favorites', 'Ingredient')
+
+    dish_allergens = {}
+    for dish_id, allergy_id in Dish.allergies.through.objects.values_list('dish_id', 'allergy_id'):
+        dish_allergens.setdefault(dish_id, set()).add(allergy_id)
+    if not dish_allergens:
+        return
+
+    ingredients_by_dish, dishes_by_ingredient = {}, {}
+    for dish_id, ingredient_id in DishIngredient.objects.values_list('dish_id', 'ingredient_id'):
+        ingredients_by_dish.setdefault(dish_id, []).append(ingredient_id)
+        dishes_by_ingredient.setdefault(ingredient_id, []).append(dish_id)
+
+    ingredient_allergens = {}
+    for ingredient_id, dish_ids in dishes_by_ingredient.items():
+        common = set.intersection(*(dish_allergens.get(dish_id, set()) for dish_id in dish_ids))
+        if common:
+            ingredient_allergens[ingredient_id] = common
+
+    for dish_id, allergy_ids in dish_allergens.items():
+        ingredient_ids = ingredients_by_dish.get(dish_id, [])
+        covered = set().union(*(ingredient_allergens.get(pk, set()) for pk in ingredient_ids))
+        for ingredient_id in ingredient_ids:
+            ingredient_allergens.setdefault(ingredient_id, set()).update(allergy_ids - covered)
+
+    through = Ingredient.allergies.through
+    through.objects.bulk_create([
+        through(ingredient_id=ingredient_id, allergy_id=allergy_id)
+        for ingredient_id, allergy_ids in ingredient_allergens.items()
+        for allergy_id in allergy_ids
+    ], batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('favorites', '0026_dish_browse_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(tag_ingredients_from_dishes, migrations.RunPython.noop),
+    ]
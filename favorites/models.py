@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from django.db import connection, models, transaction
+from django.db.models import Case, DecimalField, Exists, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Floor
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete, pre_delete
+from django.dispatch import Signal, receiver
 from decimal import Decimal
 from django.utils import timezone
 from django.core.cache import cache
@@ -34,6 +36,32 @@ class UserProfile(models.Model):
         verbose_name='Последнее обновление замен'
     )
 
+    recent_dish_ids = models.BinaryField(
+        default=b'',
+        editable=False,
+        verbose_name='Недавние блюда',
+        help_text='Упакованные id последних показанных блюд, см. favorites.history'
+    )
+
+    calorie_target_min = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Калорий в день от',
+        help_text='Если задан диапазон, меню подбирается так, чтобы сумма калорий за день попала в него'
+    )
+    calorie_target_max = models.PositiveIntegerField(null=True, blank=True, verbose_name='Калорий в день до')
+
+    favorite_dish_ids = models.BinaryField(
+        default=b'',
+        editable=False,
+        verbose_name='Избранные блюда',
+        help_text='Упакованные id, см. favorites.preferences'
+    )
+    blocked_dish_ids = models.BinaryField(default=b'', editable=False, verbose_name='Скрытые блюда')
+
+    # {'date': 'ГГГГ-ММ-ДД', 'dishes': {тип приёма пищи: id блюда}} — замены в детерминированном меню
+    menu_overrides = models.JSONField(default=dict, blank=True, editable=False, verbose_name='Замены в меню')
+
     def __str__(self):
         return f'Профиль {self.user.username}'
 
@@ -44,10 +72,45 @@ class UserProfile(models.Model):
         if time_since_reset >= timedelta(hours=24):
             self.meal_swaps_remaining = 3
             self.last_swap_reset = now
-            self.save()
+            self.save(update_fields=['meal_swaps_remaining', 'last_swap_reset'])
             return True
         return False
 
+    async def areset_swaps_if_needed(self):
+        now = timezone.now()
+        if now - self.last_swap_reset >= timedelta(hours=24):
+            self.meal_swaps_remaining = 3
+            self.last_swap_reset = now
+            await self.asave(update_fields=['meal_swaps_remaining', 'last_swap_reset'])
+            return True
+        return False
+
+    def take_swap(self):
+        """Атомарно списывает одну замену; False, если замен не осталось.
+
+        Условный UPDATE не даёт параллельным запросам потратить больше замен, чем есть.
+        """
+        taken = UserProfile.objects.filter(pk=self.pk, meal_swaps_remaining__gt=0).update(
+            meal_swaps_remaining=F('meal_swaps_remaining') - 1
+        )
+        self.refresh_from_db(fields=['meal_swaps_remaining'])
+        return bool(taken)
+
+    def return_swap(self):
+        UserProfile.objects.filter(pk=self.pk).update(meal_swaps_remaining=F('meal_swaps_remaining') + 1)
+        self.refresh_from_db(fields=['meal_swaps_remaining'])
+
+    async def atake_swap(self):
+        taken = await UserProfile.objects.filter(pk=self.pk, meal_swaps_remaining__gt=0).aupdate(
+            meal_swaps_remaining=F('meal_swaps_remaining') - 1
+        )
+        await self.arefresh_from_db(fields=['meal_swaps_remaining'])
+        return bool(taken)
+
+    async def areturn_swap(self):
+        await UserProfile.objects.filter(pk=self.pk).aupdate(meal_swaps_remaining=F('meal_swaps_remaining') + 1)
+        await self.arefresh_from_db(fields=['meal_swaps_remaining'])
+
     def get_daily_budget(self):
         return self.weekly_budget / 7
 
@@ -74,6 +137,12 @@ class Allergy(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def get_bits(cls):
+        """{id аллергена: бит в Dish.allergen_mask} для аллергенов, которые можно выбрать в тарифе."""
+        slugs = list(cls.TARIFF_FIELD_MAPPING)
+        return {pk: 1 << slugs.index(slug) for pk, slug in cls.objects.filter(slug__in=slugs).values_list('pk', 'slug')}
+
     class Meta:
         verbose_name = 'Аллерген'
         verbose_name_plural = 'Аллергены'
@@ -111,8 +180,10 @@ class Dish(models.Model):
         Allergy, 
         blank=True, 
         verbose_name='Содержит аллергены',
-        help_text='Аллергены, которые содержатся в этом блюде'
+        help_text='Собираются автоматически из аллергенов ингредиентов'
     )
+    # биты аллергенов из Allergy.TARIFF_FIELD_MAPPING, чтобы фильтровать меню без JOIN
+    allergen_mask = models.PositiveIntegerField(default=0, editable=False, verbose_name='Маска аллергенов')
 
     # which diet this dish belongs to — aligns with menu options a user can choose
     diet_type = models.CharField(max_length=20, choices=DIET_CHOICES, default='CLASSIC', verbose_name='Тип меню')
@@ -123,6 +194,15 @@ class Dish(models.Model):
         help_text='Автоматически рассчитывается из ингредиентов',
         editable=False
     )
+    total_protein = models.DecimalField(
+        max_digits=8, decimal_places=2, default=0, editable=False, verbose_name='Белки (г)'
+    )
+    total_fat = models.DecimalField(
+        max_digits=8, decimal_places=2, default=0, editable=False, verbose_name='Жиры (г)'
+    )
+    total_carbohydrates = models.DecimalField(
+        max_digits=8, decimal_places=2, default=0, editable=False, verbose_name='Углеводы (г)'
+    )
 
     meal_type = models.CharField(
         max_length=20,
@@ -137,28 +217,17 @@ class Dish(models.Model):
     def __str__(self):
         return self.name
 
-    def calculate_total_calories(self):
-        total = 0
-        for dish_ingredient in self.dish_ingredients.all():
-            if dish_ingredient.ingredient.calories and dish_ingredient.quantity:
-                total += dish_ingredient.ingredient.calories * dish_ingredient.quantity
-        return int(total)
-
-    def calculate_total_price(self):
-        total = Decimal('0')
-        for dish_ingredient in self.dish_ingredients.all():
-            if dish_ingredient.ingredient.average_price and dish_ingredient.quantity:
-                total += dish_ingredient.ingredient.average_price * dish_ingredient.quantity
-        return total
-
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
-        self.total_calories = self.calculate_total_calories()
-        self.total_price = self.calculate_total_price()
-        Dish.objects.filter(pk=self.pk).update(
-            total_calories=self.total_calories,
-            total_price=self.total_price
-        )
+        recalculate_dish_totals([self.pk])
+        self.refresh_from_db(fields=DISH_TOTAL_FIELDS)
+
+    class Meta:
+        # ключи постраничного просмотра каталога (favorites.browse): весь каталог и одна диета
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='dish_created_id_idx'),
+            models.Index(fields=['diet_type', 'created_at', 'id'], name='dish_browse_idx'),
+        ]
 
 
 class Ingredient(models.Model):
@@ -181,16 +250,98 @@ class Ingredient(models.Model):
         default='GRAM',
         verbose_name='Единица измерения'
     )
+    allergies = models.ManyToManyField(
+        Allergy,
+        blank=True,
+        related_name='ingredients',
+        verbose_name='Содержит аллергены'
+    )
     calories = models.PositiveIntegerField(
         verbose_name='Калорийность на 100г (1 единицу)',
         help_text='Ккал на 100 грамм (1 единицу) продукта',
         null=True,
         blank=True
     )
+    protein = models.DecimalField(
+        max_digits=6,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name='Белки на 100г (1 единицу)',
+        help_text='Граммы белка на 100 грамм (1 единицу) продукта'
+    )
+    fat = models.DecimalField(
+        max_digits=6,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name='Жиры на 100г (1 единицу)',
+        help_text='Граммы жира на 100 грамм (1 единицу) продукта'
+    )
+    carbohydrates = models.DecimalField(
+        max_digits=6,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        verbose_name='Углеводы на 100г (1 единицу)',
+        help_text='Граммы углеводов на 100 грамм (1 единицу) продукта'
+    )
+
+    # сколько базовых порций (100 г или 1 шт.), на которые указаны цена и пищевая ценность,
+    # приходится на единицу количества в составе блюда
+    UNIT_FACTORS = {
+        'GRAM': 1,
+        'KILOGRAM': 10,
+        'PIECE': 1,
+        'TABLESPOON': 1,
+    }
+    # поле на единицу количества -> исходное поле на базовую порцию
+    PER_UNIT_FIELDS = {
+        'cost_per_unit': 'average_price',
+        'calories_per_unit': 'calories',
+        'protein_per_unit': 'protein',
+        'fat_per_unit': 'fat',
+        'carbohydrates_per_unit': 'carbohydrates',
+    }
+
+    cost_per_unit = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0, editable=False, verbose_name='Цена за единицу количества'
+    )
+    calories_per_unit = models.DecimalField(
+        max_digits=10, decimal_places=2, null=True, editable=False, verbose_name='Ккал за единицу количества'
+    )
+    protein_per_unit = models.DecimalField(max_digits=8, decimal_places=2, null=True, editable=False)
+    fat_per_unit = models.DecimalField(max_digits=8, decimal_places=2, null=True, editable=False)
+    carbohydrates_per_unit = models.DecimalField(max_digits=8, decimal_places=2, null=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        factor = self.UNIT_FACTORS.get(self.unit, 1)
+        for per_unit_field, field in self.PER_UNIT_FIELDS.items():
+            value = getattr(self, field)
+            setattr(self, per_unit_field, None if value is None else Decimal(str(value)) * factor)
+        super().save(*args, **kwargs)
+
+
+class IngredientPrice(models.Model):
+    """Наблюдение цены ингредиента за день. Записи только добавляются."""
+
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='prices')
+    observed_on = models.DateField(verbose_name='Дата')
+    price = models.DecimalField(max_digits=8, decimal_places=2, verbose_name='Цена за 100 грамм (1 единицу)')
+
+    def __str__(self):
+        return f'{self.ingredient_id}: {self.price} на {self.observed_on}'
+
+    class Meta:
+        verbose_name = 'Цена ингредиента'
+        verbose_name_plural = 'История цен ингредиентов'
+        constraints = [
+            models.UniqueConstraint(fields=['ingredient', 'observed_on'], name='unique_ingredient_price_per_day'),
+        ]
+
 
 class DishIngredient(models.Model):
     dish = models.ForeignKey(Dish, on_delete=models.CASCADE, related_name='dish_ingredients')
@@ -244,11 +395,215 @@ class MealTariff(models.Model):
         return f'{self.name} ({self.get_diet_type_display()})'
 
 
+class WeeklyMenu(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='weekly_menu')
+    week_start = models.DateField(verbose_name='Начало недели')
+    # {'BREAKFAST': [id блюда на каждый день недели], ...}
+    plan = models.JSONField(default=dict, verbose_name='План')
+
+    def __str__(self):
+        return f'Меню {self.user.username} на неделю с {self.week_start}'
+
+    def get_dish_ids(self):
+        return {pk for pks in self.plan.values() for pk in pks}
+
+    class Meta:
+        verbose_name = 'Меню на неделю'
+        verbose_name_plural = 'Меню на неделю'
+
+
+class DishDailyStats(models.Model):
+    """Дневные счётчики популярности блюда; пополняются пачками из favorites.popularity."""
+
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField(verbose_name='День')
+    impressions = models.PositiveIntegerField(default=0, verbose_name='Показы в меню')
+    swaps_away = models.PositiveIntegerField(default=0, verbose_name='Замены')
+    card_views = models.PositiveIntegerField(default=0, verbose_name='Открытия карточки')
+
+    def __str__(self):
+        return f'{self.dish_id} за {self.day}'
+
+    class Meta:
+        verbose_name = 'Статистика блюда за день'
+        verbose_name_plural = 'Статистика блюд по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['dish', 'day'], name='unique_dish_stats_per_day'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='dish_stats_day_idx'),
+        ]
+
+
+# итоговое поле блюда -> поле ингредиента, которое умножается на количество
+DISH_TOTALS = {
+    'total_calories': 'calories_per_unit',
+    'total_price': 'cost_per_unit',
+    'total_protein': 'protein_per_unit',
+    'total_fat': 'fat_per_unit',
+    'total_carbohydrates': 'carbohydrates_per_unit',
+}
+DISH_TOTAL_FIELDS = tuple(DISH_TOTALS)
+
+
+# рассылается после изменения стоимости, калорийности или аллергенов блюд
+catalog_changed = Signal()
+
+
+def refresh_dish_allergens(dish_ids=None):
+    """Собирает аллергены блюд из аллергенов их ингредиентов.
+
+    Пересобираются связи Dish.allergies и allergen_mask только переданных блюд
+    (или всех, если `dish_ids` не задан). У блюд без состава выводить аллергены не
+    из чего, поэтому их связи, проставленные вручную, остаются как есть, а маска
+    считается по ним. Возвращает число затронутых блюд.
+    """
+    has_ingredients = Exists(DishIngredient.objects.filter(dish=OuterRef('pk')))
+    dishes = Dish.objects.all()
+    links = DishIngredient.objects.filter(ingredient__allergies__isnull=False)
+    if dish_ids is not None:
+        dish_ids = set(dish_ids)
+        if not dish_ids:
+            return 0
+        dishes = dishes.filter(pk__in=dish_ids)
+        links = links.filter(dish_id__in=dish_ids)
+
+    allergens = {}
+    for dish_id, allergy_id in links.values_list('dish_id', 'ingredient__allergies').distinct():
+        allergens.setdefault(dish_id, set()).add(allergy_id)
+
+    through = Dish.allergies.through
+    manual_allergens = {}
+    for dish_id, allergy_id in through.objects.filter(
+        dish__in=dishes.exclude(has_ingredients),
+    ).values_list('dish_id', 'allergy_id'):
+        manual_allergens.setdefault(dish_id, set()).add(allergy_id)
+
+    bits = Allergy.get_bits()
+    dishes_by_mask = {}
+    for dish_id, allergy_ids in (allergens | manual_allergens).items():
+        mask = sum(bits.get(allergy_id, 0) for allergy_id in allergy_ids)
+        dishes_by_mask.setdefault(mask, []).append(dish_id)
+
+    with transaction.atomic():
+        through.objects.filter(dish__in=dishes.filter(has_ingredients)).delete()
+        through.objects.bulk_create([
+            through(dish_id=dish_id, allergy_id=allergy_id)
+            for dish_id, allergy_ids in allergens.items()
+            for allergy_id in allergy_ids
+        ], batch_size=1000)
+        updated = dishes.update(allergen_mask=0)
+        for mask, mask_dish_ids in dishes_by_mask.items():
+            for start in range(0, len(mask_dish_ids), 1000):
+                Dish.objects.filter(pk__in=mask_dish_ids[start:start + 1000]).update(allergen_mask=mask)
+    catalog_changed.send(sender=Dish)
+    return updated
+
+
+def refresh_ingredient_unit_columns(ingredient_ids=None):
+    """Пересчитывает поля «на единицу количества» одним UPDATE — для bulk_create и update(), минующих save()."""
+    factor = Case(
+        *[When(unit=unit, then=Value(factor)) for unit, factor in Ingredient.UNIT_FACTORS.items() if factor != 1],
+        default=Value(1),
+    )
+    ingredients = Ingredient.objects.all() if ingredient_ids is None else Ingredient.objects.filter(pk__in=ingredient_ids)
+    return ingredients.update(**{
+        per_unit_field: F(field) * factor
+        for per_unit_field, field in Ingredient.PER_UNIT_FIELDS.items()
+    })
+
+
+def _supports_update_from():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33)
+
+
+def recalculate_dish_totals(dish_ids=None):
+    """Пересчитывает стоимость, калорийность и БЖУ блюд.
+
+    Суммы считаются одним GROUP BY по составу блюд (произведение разреженной матрицы
+    блюдо×ингредиент на столбцы ингредиентов) и записываются через UPDATE ... FROM.
+    Там, где такого синтаксиса нет, используется UPDATE с коррелированными подзапросами.
+    Возвращает число обновлённых блюд.
+    """
+    decimal_field = DecimalField(max_digits=12, decimal_places=2)
+    dishes = Dish.objects.all() if dish_ids is None else Dish.objects.filter(pk__in=dish_ids)
+
+    def total(expression, total_field):
+        if total_field == 'total_calories':
+            return Coalesce(Cast(Floor(expression), IntegerField()), 0)
+        return Coalesce(expression, Value(Decimal('0')), output_field=decimal_field)
+
+    if not _supports_update_from():
+        ingredients = DishIngredient.objects.filter(dish=OuterRef('pk')).order_by().values('dish')
+        updated = dishes.update(**{
+            total_field: total(Subquery(ingredients.annotate(
+                total=Sum(F('quantity') * F(f'ingredient__{ingredient_field}'), output_field=decimal_field)
+            ).values('total')), total_field)
+            for total_field, ingredient_field in DISH_TOTALS.items()
+        })
+        catalog_changed.send(sender=Dish)
+        return updated
+
+    totals = dishes.order_by().values('pk').annotate(dish_pk=F('pk'), **{
+        f'new_{total_field}': total(Sum(
+            F('dish_ingredients__quantity') * F(f'dish_ingredients__ingredient__{ingredient_field}'),
+            output_field=decimal_field,
+        ), total_field)
+        for total_field, ingredient_field in DISH_TOTALS.items()
+    }).values('dish_pk', *(f'new_{total_field}' for total_field in DISH_TOTALS))
+    sql, params = totals.query.sql_with_params()
+
+    quote = connection.ops.quote_name
+    table = quote(Dish._meta.db_table)
+    assignments = ', '.join(f'{quote(field)} = totals.{quote("new_" + field)}' for field in DISH_TOTALS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET {assignments} FROM ({sql}) AS totals WHERE {table}.{quote("id")} = totals.{quote("dish_pk")}',
+            params,
+        )
+    catalog_changed.send(sender=Dish)
+    return cursor.rowcount
+
+
 @receiver([post_save, post_delete], sender=DishIngredient)
 def update_dish_nutrition(sender, instance, **kwargs):
-    instance.dish.total_calories = instance.dish.calculate_total_calories()
-    instance.dish.total_price = instance.dish.calculate_total_price()
-    instance.dish.save()
+    # одна транзакция на оба пересчёта: иначе в autocommit снимок каталога
+    # пересобирался бы после каждого из них
+    with transaction.atomic():
+        # save() пишет все поля, поэтому маска пересчитывается после него, а не до
+        instance.dish.save()
+        refresh_dish_allergens([instance.dish_id])
+    instance.dish.refresh_from_db(fields=['allergen_mask'])
+
+
+@receiver(m2m_changed, sender=Ingredient.allergies.through)
+def update_dish_allergens_on_ingredient_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        ingredient_ids = [instance.pk]
+    elif pk_set is not None:
+        ingredient_ids = pk_set
+    else:
+        # post_clear со стороны аллергена: состав неизвестен, пересобираем всё
+        refresh_dish_allergens()
+        cache.clear()
+        return
+
+    refresh_dish_allergens(
+        DishIngredient.objects.filter(ingredient_id__in=ingredient_ids).values_list('dish_id', flat=True)
+    )
+    cache.clear()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_dishes_on_ingredient_change(sender, instance, created, **kwargs):
+    if not created:
+        recalculate_dish_totals(DishIngredient.objects.filter(ingredient=instance).values('dish_id'))
+        cache.clear()
 
 
 @receiver(post_save, sender=User)
@@ -276,8 +631,39 @@ def invalidate_cache_on_dish_change(sender, instance, **kwargs):
         pass
 
 
-@receiver([post_save, post_delete], sender=Allergy)
-def invalidate_cache_on_allergy_change(sender, instance, **kwargs):
+def _dishes_with_allergy(allergy):
+    """id блюд, у которых аллерген проставлен сейчас или придёт с ингредиентов."""
+    return set(Dish.allergies.through.objects.filter(allergy=allergy).values_list('dish_id', flat=True)) | set(
+        DishIngredient.objects.filter(ingredient__allergies=allergy).values_list('dish_id', flat=True)
+    )
+
+
+@receiver(post_init, sender=Allergy)
+def remember_allergy_slug(sender, instance, **kwargs):
+    instance._mask_slug = instance.__dict__.get('slug')
+
+
+@receiver(post_save, sender=Allergy)
+def invalidate_cache_on_allergy_change(sender, instance, created, **kwargs):
+    # от слага зависит бит в allergen_mask; переименование маски не меняет
+    if not created and instance.slug != instance._mask_slug:
+        refresh_dish_allergens(_dishes_with_allergy(instance))
+    instance._mask_slug = instance.slug
+    try:
+        cache.clear()
+    except Exception:
+        pass
+
+
+@receiver(pre_delete, sender=Allergy)
+def remember_dishes_with_allergy(sender, instance, **kwargs):
+    # после удаления связи уже стёрты каскадом, поэтому блюда запоминаются заранее
+    instance._affected_dish_ids = _dishes_with_allergy(instance)
+
+
+@receiver(post_delete, sender=Allergy)
+def invalidate_cache_on_allergy_delete(sender, instance, **kwargs):
+    refresh_dish_allergens(getattr(instance, '_affected_dish_ids', set()))
     try:
         cache.clear()
     except Exception:
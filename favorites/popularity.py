@@ -0,0 +1,126 @@
+"""Счётчики популярности блюд с отложенной записью.
+
+События (показ в меню, замена блюда, открытие карточки) копятся в памяти процесса и
+пишутся в DishDailyStats пачками upsert'ов по окончании первого запроса, после которого
+прошло POPULARITY_FLUSH_INTERVAL секунд с прошлой записи. На горячем пути — только
+увеличение счётчика под блокировкой, а запись идёт после отправки ответа. Простаивающий
+воркер gunicorn дописывает накопленное при остановке (хук worker_exit в favorites.warmup),
+так что теряется только то, что не успел записать упавший процесс.
+"""
+from collections import defaultdict
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, connection, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Dish, DishDailyStats
+
+
+EVENTS = ('impressions', 'swaps_away', 'card_views')
+FLUSH_BATCH_SIZE = 500
+
+logger = logging.getLogger('favorites.popularity')
+
+
+class PopularityCounters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(lambda: [0] * len(EVENTS))
+        self.last_flush = time.monotonic()
+
+    def record(self, event, *dish_ids):
+        index = EVENTS.index(event)
+        day = timezone.now().date()
+        with self.lock:
+            for dish_id in dish_ids:
+                self.counts[(day, dish_id)][index] += 1
+
+    def flush_if_due(self):
+        interval = getattr(settings, 'POPULARITY_FLUSH_INTERVAL', 60)
+        with self.lock:
+            if not self.counts or time.monotonic() - self.last_flush < interval:
+                return 0
+            self.last_flush = time.monotonic()
+        return self.flush()
+
+    def flush(self):
+        """Записывает накопленное и возвращает число затронутых строк (блюдо, день)."""
+        with self.lock:
+            counts, self.counts = self.counts, defaultdict(lambda: [0] * len(EVENTS))
+        if not counts:
+            return 0
+
+        rows = [(dish_id, day, *values) for (day, dish_id), values in counts.items()]
+        batch_size = get_flush_batch_size()
+        try:
+            with transaction.atomic():
+                for start in range(0, len(rows), batch_size):
+                    batch = rows[start:start + batch_size]
+                    # блюда, удалённые после события, отбрасываются, иначе пачка упадёт на внешнем ключе
+                    existing = set(Dish.objects.filter(pk__in={row[0] for row in batch}).values_list('pk', flat=True))
+                    batch = [row for row in batch if row[0] in existing]
+                    if batch:
+                        upsert_daily_stats(batch)
+        except DatabaseError:
+            # вернём счётчики, чтобы дописать их при следующем сбросе
+            with self.lock:
+                for key, values in counts.items():
+                    self.counts[key] = [a + b for a, b in zip(self.counts[key], values)]
+            raise
+        return len(rows)
+
+
+def get_flush_batch_size():
+    """Строк в одном upsert: не больше FLUSH_BATCH_SIZE и не больше, чем позволяет число параметров базы."""
+    max_params = connection.features.max_query_params
+    if max_params is None:
+        return FLUSH_BATCH_SIZE
+    return min(FLUSH_BATCH_SIZE, max_params // (2 + len(EVENTS)))
+
+
+def upsert_daily_stats(rows):
+    """Прибавляет строки (dish_id, day, impressions, swaps_away, card_views) к DishDailyStats.
+
+    Один INSERT ... ON CONFLICT DO UPDATE на пачку (SQLite 3.24+ и PostgreSQL): строки нет —
+    вставляется, есть — счётчики увеличиваются на месте без чтения.
+    """
+    table = connection.ops.quote_name(DishDailyStats._meta.db_table)
+    quote = connection.ops.quote_name
+    columns = ('dish_id', 'day') + EVENTS
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    increments = ', '.join(f'{quote(event)} = {table}.{quote(event)} + excluded.{quote(event)}' for event in EVENTS)
+    params = [value for row in rows for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(map(quote, columns))}) VALUES {placeholders} '
+            f'ON CONFLICT ({quote("dish_id")}, {quote("day")}) DO UPDATE SET {increments}',
+            params,
+        )
+
+
+counters = PopularityCounters()
+
+
+def record_impressions(*dish_ids):
+    counters.record('impressions', *dish_ids)
+
+
+def record_swap_away(dish_id):
+    counters.record('swaps_away', dish_id)
+
+
+def record_card_view(dish_id):
+    counters.record('card_views', dish_id)
+
+
+@receiver(request_finished)
+def flush_counters_after_request(sender, **kwargs):
+    try:
+        counters.flush_if_due()
+    except DatabaseError:
+        logger.exception('Не удалось записать счётчики популярности')
@@ -0,0 +1,106 @@
+import random
+import struct
+
+from django.db import transaction
+
+from .models import UserProfile
+
+
+FAVORITE_WEIGHT = 3  # во сколько раз избранное блюдо вероятнее обычного
+
+
+def unpack_ids(data):
+    data = bytes(data or b'')
+    count = len(data) // 4
+    return frozenset(struct.unpack(f'<{count}I', data[:count * 4]))
+
+
+def pack_ids(dish_ids):
+    dish_ids = sorted(dish_ids)
+    return struct.pack(f'<{len(dish_ids)}I', *dish_ids)
+
+
+def weighted_choice(dish_ids, favorite_ids, rng=random):
+    """Случайный id, где каждое избранное блюдо весит FAVORITE_WEIGHT, а остальные — 1."""
+    favorites = [dish_id for dish_id in dish_ids if dish_id in favorite_ids] if favorite_ids else []
+    if not favorites:
+        return rng.choice(dish_ids)
+
+    others = [dish_id for dish_id in dish_ids if dish_id not in favorite_ids]
+    r = rng.randrange(len(favorites) * FAVORITE_WEIGHT + len(others))
+    if r < len(favorites) * FAVORITE_WEIGHT:
+        return favorites[r // FAVORITE_WEIGHT]
+    return others[r - len(favorites) * FAVORITE_WEIGHT]
+
+
+class DishPreferences:
+    """Избранные и скрытые блюда пользователя.
+
+    Хранятся в UserProfile.favorite_dish_ids и blocked_dish_ids как отсортированные
+    упакованные uint32 и читаются одним запросом; при подборе меню скрытые блюда
+    вычитаются из кандидатов, а избранные получают больший вес — всё на множествах
+    в памяти, без дополнительных JOIN.
+    """
+
+    def __init__(self, favorite=b'', blocked=b''):
+        self.favorite_ids = unpack_ids(favorite)
+        self.blocked_ids = unpack_ids(blocked)
+
+    @classmethod
+    def for_user(cls, user):
+        row = UserProfile.objects.filter(user=user).values_list('favorite_dish_ids', 'blocked_dish_ids').first()
+        return cls(*row) if row else cls()
+
+    @classmethod
+    async def afor_user(cls, user):
+        row = await UserProfile.objects.filter(user=user).values_list(
+            'favorite_dish_ids', 'blocked_dish_ids'
+        ).afirst()
+        return cls(*row) if row else cls()
+
+    def allowed(self, dish_ids):
+        if not self.blocked_ids:
+            return dish_ids
+        return [dish_id for dish_id in dish_ids if dish_id not in self.blocked_ids]
+
+    def weighted_pool(self, dish_ids):
+        """Пул для детерминированного выбора, где избранные блюда встречаются FAVORITE_WEIGHT раз."""
+        favorites = [dish_id for dish_id in dish_ids if dish_id in self.favorite_ids]
+        return list(dish_ids) + favorites * (FAVORITE_WEIGHT - 1)
+
+    @classmethod
+    def toggle_for_user(cls, user, dish_id, blocked=False):
+        """Переключает блюдо в избранном или, при `blocked`, в скрытых; True, если теперь оно там.
+
+        Оба списка читаются и пишутся в одной транзакции под блокировкой строки профиля,
+        поэтому параллельные переключения не затирают друг друга.
+        """
+        with transaction.atomic():
+            row = UserProfile.objects.select_for_update().filter(user=user).values_list(
+                'favorite_dish_ids', 'blocked_dish_ids'
+            ).first()
+            preferences = cls(*row) if row else cls()
+            enabled = preferences.toggle_blocked(dish_id) if blocked else preferences.toggle_favorite(dish_id)
+            UserProfile.objects.filter(user=user).update(
+                favorite_dish_ids=pack_ids(preferences.favorite_ids),
+                blocked_dish_ids=pack_ids(preferences.blocked_ids),
+            )
+        return enabled
+
+    def toggle_favorite(self, dish_id):
+        """Добавляет блюдо в избранное или убирает оттуда; True, если теперь оно в избранном."""
+        if dish_id in self.favorite_ids:
+            self.favorite_ids -= {dish_id}
+            return False
+        self.favorite_ids |= {dish_id}
+        self.blocked_ids -= {dish_id}
+        return True
+
+    def toggle_blocked(self, dish_id):
+        """Скрывает блюдо или возвращает его в подбор; True, если теперь оно скрыто."""
+        if dish_id in self.blocked_ids:
+            self.blocked_ids -= {dish_id}
+            return False
+        self.blocked_ids |= {dish_id}
+        self.favorite_ids -= {dish_id}
+        return True
@@ -0,0 +1,88 @@
+import csv
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, DecimalField, Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from .catalog import _chunked
+from .models import (
+    DishIngredient, Ingredient, IngredientPrice, recalculate_dish_totals, refresh_ingredient_unit_columns,
+)
+
+
+PRICE_WINDOW_DAYS = 30
+INGEST_CHUNK_SIZE = 5000
+
+
+def read_price_feed(lines):
+    """Читает CSV с колонками ingredient_id, observed_on (ГГГГ-ММ-ДД), price."""
+    for line_number, row in enumerate(csv.DictReader(lines), start=2):
+        try:
+            yield int(row['ingredient_id']), date.fromisoformat(row['observed_on']), Decimal(row['price'])
+        except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+            raise ValueError(f'строка {line_number}: {e}')
+
+
+def ingest_prices(observations, chunk_size=INGEST_CHUNK_SIZE):
+    """Добавляет наблюдения пачками; повтор той же пары (ингредиент, день) пропускается.
+
+    Возвращает число добавленных наблюдений и множество затронутых ингредиентов.
+    """
+    known_ids = set(Ingredient.objects.values_list('pk', flat=True))
+    count = 0
+    ingredient_ids = set()
+    for chunk in _chunked(observations, chunk_size):
+        # как и ignore_conflicts, из повторов за день оставляем первое наблюдение
+        prices = {}
+        for ingredient_id, observed_on, price in chunk:
+            if ingredient_id in known_ids:
+                prices.setdefault((ingredient_id, observed_on), price)
+        chunk_ids = {ingredient_id for ingredient_id, _ in prices}
+
+        # уже записанные пары отсеиваются заранее, иначе bulk_create молча их пропустит и счёт разойдётся
+        with transaction.atomic():
+            existing = set(IngredientPrice.objects.filter(
+                ingredient_id__in=chunk_ids, observed_on__in={observed_on for _, observed_on in prices},
+            ).values_list('ingredient_id', 'observed_on'))
+            new_prices = [
+                IngredientPrice(ingredient_id=ingredient_id, observed_on=observed_on, price=price)
+                for (ingredient_id, observed_on), price in prices.items()
+                if (ingredient_id, observed_on) not in existing
+            ]
+            IngredientPrice.objects.bulk_create(new_prices, ignore_conflicts=True)
+        ingredient_ids.update(chunk_ids)
+        count += len(new_prices)
+    return count, ingredient_ids
+
+
+def recalculate_average_prices(ingredient_ids=None, window_days=PRICE_WINDOW_DAYS, today=None):
+    """Ставит average_price средним за последние `window_days` дней одним UPDATE.
+
+    Ингредиенты без наблюдений в окне не меняются. Затем пересчитываются зависящие
+    от цены поля ингредиентов и стоимость блюд с ними. Возвращает число обновлённых ингредиентов.
+    """
+    today = today or timezone.now().date()
+    window = IngredientPrice.objects.filter(
+        ingredient=OuterRef('pk'),
+        observed_on__gt=today - timedelta(days=window_days),
+        observed_on__lte=today,
+    )
+    average = window.order_by().values('ingredient').annotate(
+        average=Avg('price', output_field=DecimalField(max_digits=8, decimal_places=2))
+    ).values('average')
+
+    ingredients = Ingredient.objects.all() if ingredient_ids is None else Ingredient.objects.filter(pk__in=ingredient_ids)
+    with transaction.atomic():
+        updated_ids = list(ingredients.filter(Exists(window)).values_list('pk', flat=True))
+        for chunk in _chunked(updated_ids, INGEST_CHUNK_SIZE):
+            Ingredient.objects.filter(pk__in=chunk).update(average_price=Subquery(average))
+            refresh_ingredient_unit_columns(chunk)
+            recalculate_dish_totals(
+                DishIngredient.objects.filter(ingredient_id__in=chunk).values('dish_id').distinct()
+            )
+    if updated_ids:
+        cache.clear()
+    return len(updated_ids)
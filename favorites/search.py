@@ -0,0 +1,148 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import Dish, DishIngredient, Ingredient
+
+
+SEARCH_TABLE = 'favorites_dish_search'
+SEARCH_LIMIT = 50
+INDEX_CHUNK_SIZE = 500
+
+# веса колонок для bm25: name, description, recipe, ingredients
+RANK_EXPRESSION = f'bm25({SEARCH_TABLE}, 10.0, 2.0, 1.0, 4.0)'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_search_supported():
+    return connection.vendor == 'sqlite'
+
+
+def normalize_text(text):
+    # unicode61 сам приводит регистр, но не считает «ё» и «е» одной буквой
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def build_match_query(query):
+    """Превращает пользовательский запрос в MATCH-выражение FTS5 с поиском по префиксу."""
+    tokens = TOKEN_RE.findall(normalize_text(query))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def index_dishes(dish_ids):
+    if not is_search_supported():
+        return
+
+    dish_ids = list(dish_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(dish_ids), INDEX_CHUNK_SIZE):
+            chunk = dish_ids[start:start + INDEX_CHUNK_SIZE]
+            ingredient_names = {}
+            rows = DishIngredient.objects.filter(dish_id__in=chunk).values_list('dish_id', 'ingredient__name')
+            for dish_id, name in rows:
+                ingredient_names.setdefault(dish_id, []).append(name)
+
+            placeholders = ', '.join(['%s'] * len(chunk))
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', chunk)
+            dishes = Dish.objects.filter(pk__in=chunk).values_list('pk', 'name', 'description', 'recipe')
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, recipe, ingredients) VALUES (%s, %s, %s, %s, %s)',
+                [
+                    (pk, normalize_text(name), normalize_text(description), normalize_text(recipe),
+                     normalize_text(' '.join(ingredient_names.get(pk, []))))
+                    for pk, name, description, recipe in dishes
+                ],
+            )
+
+
+def remove_dishes(dish_ids):
+    if not is_search_supported():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in dish_ids])
+
+
+def rebuild_search_index():
+    if not is_search_supported():
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+    dish_ids = list(Dish.objects.values_list('pk', flat=True))
+    index_dishes(dish_ids)
+    return len(dish_ids)
+
+
+def search_dish_ids(query, limit=SEARCH_LIMIT, active_only=False):
+    """Возвращает id блюд, упорядоченные по релевантности.
+
+    С `active_only` неактивные блюда отсекаются до LIMIT, чтобы не занимать места в выдаче.
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+
+    if not is_search_supported():
+        dishes = Dish.objects.filter(name__icontains=query.strip()).order_by('name')
+        if active_only:
+            dishes = dishes.filter(is_active=True)
+        return list(dishes.values_list('pk', flat=True)[:limit])
+
+    active_filter = ''
+    if active_only:
+        dish_table = connection.ops.quote_name(Dish._meta.db_table)
+        active_filter = f'AND rowid IN (SELECT id FROM {dish_table} WHERE is_active)'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s {active_filter} '
+            f'ORDER BY {RANK_EXPRESSION} LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def filter_dishes_by_search(queryset, query):
+    """Ограничивает queryset блюдами, подходящими под запрос, без загрузки id в память."""
+    match = build_match_query(query)
+    if not match:
+        return queryset
+
+    if not is_search_supported():
+        return queryset.filter(name__icontains=query.strip())
+
+    return queryset.filter(
+        pk__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', (match,))
+    )
+
+
+def search_dishes(query, limit=SEARCH_LIMIT):
+    dish_ids = search_dish_ids(query, limit, active_only=True)
+    dishes = Dish.objects.filter(is_active=True).in_bulk(dish_ids)
+    return [dishes[pk] for pk in dish_ids if pk in dishes]
+
+
+@receiver(post_save, sender=Dish)
+def update_search_index_on_dish_save(sender, instance, **kwargs):
+    index_dishes([instance.pk])
+
+
+@receiver(post_delete, sender=Dish)
+def update_search_index_on_dish_delete(sender, instance, **kwargs):
+    remove_dishes([instance.pk])
+
+
+@receiver(post_init, sender=Ingredient)
+def remember_ingredient_name(sender, instance, **kwargs):
+    instance._indexed_name = instance.__dict__.get('name')
+
+
+@receiver(post_save, sender=Ingredient)
+def update_search_index_on_ingredient_save(sender, instance, created, **kwargs):
+    if not created and instance.name != instance._indexed_name:
+        index_dishes(DishIngredient.objects.filter(ingredient=instance).values_list('dish_id', flat=True))
+    instance._indexed_name = instance.name
@@ -0,0 +1,35 @@
+from marshmallow import Schema, fields
+
+
+class DishSchema(Schema):
+    id = fields.Integer()
+    name = fields.String()
+    meal_type = fields.String()
+    total_price = fields.Decimal(places=2, as_string=True)
+    total_calories = fields.Integer()
+    total_protein = fields.Decimal(places=2, as_string=True)
+    total_fat = fields.Decimal(places=2, as_string=True)
+    total_carbohydrates = fields.Decimal(places=2, as_string=True)
+    images = fields.Method('get_images')
+
+    def get_images(self, obj):
+        if not obj.image:
+            return {}
+        return {'original': obj.image.url}
+
+
+class MenuSchema(Schema):
+    date = fields.Date()
+    swaps_remaining = fields.Integer()
+    menu = fields.Dict(keys=fields.String(), values=fields.Nested(DishSchema))
+
+
+class SwapResultSchema(Schema):
+    meal_type = fields.String()
+    swaps_remaining = fields.Integer()
+    dish = fields.Nested(DishSchema)
+
+
+dish_schema = DishSchema()
+menu_schema = MenuSchema()
+swap_result_schema = SwapResultSchema()
@@ -0,0 +1,23 @@
+"""Сессии в подписанной cookie с переходом со старых сессий в базе без разлогина.
+
+Подключается настройкой SESSION_MODE=signed_cookies. Если в cookie пришёл ключ сессии
+из django_session, данные один раз читаются из базы и при ответе переписываются в
+подписанную cookie; дальше запросы к таблице сессий не нужны.
+"""
+import re
+
+from django.contrib.sessions.backends import db, signed_cookies
+
+
+LEGACY_KEY_RE = re.compile(r'[a-z0-9]{32}')
+
+
+class SessionStore(signed_cookies.SessionStore):
+    def load(self):
+        legacy_key = self.session_key
+        session = super().load()
+        # подписанное значение всегда содержит «:», так что в базу ходим только за ключами старого формата
+        if not session and legacy_key and LEGACY_KEY_RE.fullmatch(legacy_key):
+            session = db.SessionStore(legacy_key).load()
+            self.modified = True
+        return session
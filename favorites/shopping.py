@@ -0,0 +1,75 @@
+from collections import Counter
+from decimal import Decimal
+import csv
+
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+
+from .models import DishIngredient, Ingredient
+
+
+CSV_HEADER = ('Ингредиент', 'Количество', 'Ед.', 'Стоимость, руб.')
+
+# количество в DishIngredient хранится в единицах по 100 г для граммовых ингредиентов
+DISPLAY_MULTIPLIERS = {'GRAM': 100}
+CENTS = Decimal('0.01')
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи в файл."""
+
+    def write(self, value):
+        return value
+
+
+def count_menu_dishes(dishes):
+    return Counter(dish.pk for dish in dishes)
+
+
+def get_shopping_list(dish_counts):
+    """Суммирует количество и стоимость ингредиентов по блюдам меню одним GROUP BY.
+
+    `dish_counts` — словарь {id блюда: сколько раз оно встречается в меню}.
+    """
+    if not dish_counts:
+        return []
+
+    repeated = [When(dish_id=pk, then=Value(count)) for pk, count in dish_counts.items() if count != 1]
+    quantity = F('quantity') * Case(*repeated, default=Value(1)) if repeated else F('quantity')
+    decimal_field = DecimalField(max_digits=12, decimal_places=2)
+
+    rows = (
+        DishIngredient.objects
+        .filter(dish_id__in=dish_counts)
+        .values('ingredient_id', 'ingredient__name', 'ingredient__unit')
+        .annotate(
+            total_quantity=Sum(quantity, output_field=decimal_field),
+            total_cost=Sum(quantity * F('ingredient__cost_per_unit'), output_field=decimal_field),
+        )
+        .order_by('ingredient__name')
+    )
+
+    unit_names = dict(Ingredient.UNIT_TYPES)
+    items = []
+    for row in rows:
+        unit = row['ingredient__unit']
+        quantity = (row['total_quantity'] or 0) * DISPLAY_MULTIPLIERS.get(unit, 1)
+        items.append({
+            'name': row['ingredient__name'],
+            'quantity': _round_quantity(Decimal(quantity)),
+            'unit': unit_names.get(unit, unit),
+            'cost': Decimal(row['total_cost'] or 0).quantize(CENTS),
+        })
+    return items
+
+
+def _round_quantity(quantity):
+    if quantity == quantity.to_integral_value():
+        return quantity.quantize(Decimal(1))
+    return quantity.quantize(CENTS)
+
+
+def iter_shopping_list_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for item in items:
+        yield writer.writerow((item['name'], item['quantity'], item['unit'], item['cost']))
@@ -0,0 +1,180 @@
+"""Снимок активного каталога в файле, который воркеры отображают в память только для чтения.
+
+Формат: заголовок (сигнатура, версия, число блюд), таблица отрезков по (диета, приём пищи)
+и упакованные массивы id, цены в копейках, калорий и масок аллергенов. Внутри отрезка
+блюда отсортированы по калорийности. Все воркеры делят одни и те же страницы файла,
+а новый снимок подменяет старый через os.replace, так что читатель видит либо старую,
+либо новую версию целиком.
+"""
+from decimal import Decimal, InvalidOperation
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Dish, catalog_changed
+
+
+MAGIC = b'FAVSNAP1'
+HEADER = struct.Struct('<8sQI')
+DIET_CODES = [code for code, _ in Dish.DIET_CHOICES]
+MEAL_CODES = [code for code, _ in Dish.MEAL_TYPES]
+SEGMENTS = len(DIET_CODES) * len(MEAL_CODES)
+SEGMENT_TABLE = struct.Struct(f'<{SEGMENTS * 2}I')
+# id, цена в копейках, калории, маска аллергенов
+ARRAYS = ('ids', 'price_cents', 'calories', 'allergen_masks')
+
+_lock = threading.Lock()
+_current = None
+_pending = threading.local()
+
+
+def get_snapshot_path():
+    return getattr(settings, 'CATALOG_SNAPSHOT_PATH', '')
+
+
+def _segment(diet_type, meal_type):
+    return DIET_CODES.index(diet_type) * len(MEAL_CODES) + MEAL_CODES.index(meal_type)
+
+
+def build_catalog_snapshot(path=None):
+    """Записывает снимок активных блюд и атомарно подменяет файл. Возвращает (версию, число блюд)."""
+    path = path or get_snapshot_path()
+    rows = Dish.objects.filter(is_active=True).values_list(
+        'pk', 'diet_type', 'meal_type', 'total_price', 'total_calories', 'allergen_mask',
+    )
+    segments = [[] for _ in range(SEGMENTS)]
+    for pk, diet_type, meal_type, price, calories, allergen_mask in rows:
+        if diet_type in DIET_CODES and meal_type in MEAL_CODES:
+            segments[_segment(diet_type, meal_type)].append(
+                (calories, pk, int((price or 0) * 100), allergen_mask)
+            )
+
+    bounds, ordered = [], []
+    for segment in segments:
+        segment.sort()
+        bounds += [len(ordered), len(ordered) + len(segment)]
+        ordered.extend(segment)
+
+    count = len(ordered)
+    version = time.time_ns()
+    columns = (
+        [pk for _, pk, _, _ in ordered],
+        [price for _, _, price, _ in ordered],
+        [calories for calories, _, _, _ in ordered],
+        [mask for _, _, _, mask in ordered],
+    )
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, version, count))
+        f.write(SEGMENT_TABLE.pack(*bounds))
+        for column in columns:
+            f.write(struct.pack(f'<{count}I', *column))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return version, count
+
+
+class CatalogSnapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} не является снимком каталога')
+        bounds = SEGMENT_TABLE.unpack_from(self._mmap, HEADER.size)
+        self.segments = list(zip(bounds[::2], bounds[1::2]))
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size + SEGMENT_TABLE.size
+        size = self.count * 4
+        for name in ARRAYS:
+            setattr(self, name, view[offset:offset + size].cast('I'))
+            offset += size
+
+    def __len__(self):
+        return self.count
+
+    def candidate_ids(self, diet_type, meal_type, allergen_mask=0, max_price=None):
+        """id активных блюд без аллергенов из маски и, если задано, не дороже `max_price`."""
+        start, end = self.segments[_segment(diet_type, meal_type)]
+        ids, masks = self.ids[start:end], self.allergen_masks[start:end]
+        if max_price is None:
+            return [pk for pk, mask in zip(ids, masks) if not mask & allergen_mask]
+
+        limit = int(Decimal(str(max_price)) * 100)
+        prices = self.price_cents[start:end]
+        return [
+            pk for pk, mask, price in zip(ids, masks, prices)
+            if not mask & allergen_mask and price <= limit
+        ]
+
+    def calorie_candidates(self, diet_type, meal_type, allergen_mask=0):
+        """Списки (калории, id), отсортированные по калорийности, как в menu.get_calorie_candidates."""
+        start, end = self.segments[_segment(diet_type, meal_type)]
+        rows = [
+            (calories, pk)
+            for calories, pk, mask in zip(self.calories[start:end], self.ids[start:end], self.allergen_masks[start:end])
+            if not mask & allergen_mask
+        ]
+        return [calories for calories, _ in rows], [pk for _, pk in rows]
+
+
+def get_snapshot():
+    """Текущий снимок или None, если снимки не настроены или файла нет.
+
+    Подмена файла замечается по inode при следующем обращении; старое отображение
+    освобождается, когда на него не остаётся ссылок.
+    """
+    global _current
+    path = get_snapshot_path()
+    if not path:
+        return None
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    snapshot = _current
+    if snapshot is None or (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+        with _lock:
+            snapshot = _current
+            if snapshot is None or (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+                try:
+                    snapshot = _current = CatalogSnapshot(path)
+                except (OSError, ValueError, InvalidOperation):
+                    return None
+    return snapshot
+
+
+def _rebuild_after_commit():
+    # из нескольких колбэков одной транзакции пересобирает только первый
+    if getattr(_pending, 'rebuild', False):
+        _pending.rebuild = False
+        build_catalog_snapshot()
+
+
+@receiver(catalog_changed)
+def schedule_snapshot_rebuild(sender, **kwargs):
+    if not get_snapshot_path() or not getattr(settings, 'CATALOG_SNAPSHOT_AUTO_REBUILD', True):
+        return
+    # флаг на поток, как и соединение с базой; после отката он остаётся поднятым,
+    # и лишней будет разве что одна пересборка при следующем коммите
+    _pending.rebuild = True
+    transaction.on_commit(_rebuild_after_commit)
+
+
+@receiver(post_delete, sender=Dish)
+def rebuild_snapshot_on_dish_delete(sender, **kwargs):
+    schedule_snapshot_rebuild(sender)
@@ -1,3 +1,925 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from itertools import product
+import os
+import random
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.http import HttpResponse, QueryDict
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import re_path, reverse
+from django.urls.converters import StringConverter
+from django.urls.resolvers import RoutePattern
+from django.utils import timezone
+
+from . import urls, views
+from .browse import PAGE_SIZE, browse_dishes, decode_cursor, encode_cursor, parse_filters
+from .calories import compose_in_band, exclude_ids, pick_nearest, pick_pair, search_in_band
+from .catalog import import_catalog, iter_catalog_csv, iter_catalog_jsonl, read_catalog_csv, read_catalog_jsonl
+from .history import HISTORY_SIZE, DishHistory
+from .menu import get_allergen_mask, get_daily_menu_for_user, get_filtered_dishes, get_weekly_menu_for_user
+from .middleware import MetricsMiddleware
+from .models import (
+    Allergy, Dish, DishDailyStats, DishIngredient, Ingredient, IngredientPrice, MealTariff, UserProfile, WeeklyMenu,
+    catalog_changed, recalculate_dish_totals, refresh_dish_allergens, refresh_ingredient_unit_columns,
+)
+from .popularity import PopularityCounters, get_flush_batch_size
+from .preferences import FAVORITE_WEIGHT, DishPreferences, weighted_choice
+from .prices import PRICE_WINDOW_DAYS, ingest_prices, read_price_feed, recalculate_average_prices
+from .search import search_dish_ids, search_dishes
+from .shopping import count_menu_dishes, get_shopping_list
+from .snapshot import build_catalog_snapshot, get_snapshot
+from .warmup import resolve_routes, sample_path_arg, worker_exit
+
+
+def make_dish(name='Блюдо', **kwargs):
+    kwargs.setdefault('description', '')
+    kwargs.setdefault('recipe', '')
+    return Dish.objects.create(name=name, **kwargs)
+
+
+def make_ingredient(name='Ингредиент', **kwargs):
+    kwargs.setdefault('average_price', Decimal('10'))
+    kwargs.setdefault('calories', 100)
+    return Ingredient.objects.create(name=name, **kwargs)
+
+
+def make_user(username='user', **tariff):
+    user = User.objects.create_user(username, password='password')
+    tariff.setdefault('breakfast', True)
+    tariff.setdefault('lunch', True)
+    MealTariff.objects.create(user=user, **tariff)
+    return user
+
+
+class MenuApiTests(TestCase):
+    def setUp(self):
+        make_dish('Каша', meal_type='BREAKFAST', image='img/porridge.jpg')
+        make_dish('Суп', meal_type='LUNCH', image='img/soup.jpg')
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def test_today_returns_daily_menu_without_weekly_plan(self):
+        response = self.client.get(reverse('favorites:api_menu_today'))
+        self.assertEqual(response.status_code, 200)
+        menu = response.json()['menu']
+        self.assertEqual({meal_type: dish['name'] for meal_type, dish in menu.items()}, {'BREAKFAST': 'Каша', 'LUNCH': 'Суп'})
+        self.assertFalse(WeeklyMenu.objects.filter(user=self.user).exists())
+
+    def test_swap_refused_at_limit(self):
+        profile = UserProfile.objects.get(user=self.user)
+        UserProfile.objects.filter(pk=profile.pk).update(meal_swaps_remaining=1)
+        make_dish('Щи', meal_type='LUNCH')
+
+        self.assertTrue(profile.take_swap())
+        self.assertFalse(profile.take_swap())
+        self.assertEqual(profile.meal_swaps_remaining, 0)
+
+        response = self.client.post(reverse('favorites:api_swap_dish', args=['LUNCH']))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['error'], 'У вас не осталось доступных замен')
+        profile.refresh_from_db()
+        self.assertEqual(profile.meal_swaps_remaining, 0)
+
+    def test_failed_replacement_returns_swap(self):
+        # замена не нашлась, списанная замена возвращается
+        with mock.patch('favorites.views.replace_dish_in_menu', return_value=None):
+            response = self.client.post(reverse('favorites:api_swap_dish', args=['LUNCH']))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['error'], 'Не найдено подходящих блюд для замены')
+        self.assertEqual(UserProfile.objects.get(user=self.user).meal_swaps_remaining, 3)
+
+    def test_api_dish_hides_inactive_dish(self):
+        hidden = make_dish('Снят', is_active=False)
+        response = self.client.get(reverse('favorites:api_dish', args=[hidden.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_sync_lk_renders_daily_and_weekly_menu(self):
+        url = reverse('favorites:lk')
+        self.assertIs(self.client.get(url).resolver_match.func, views.lk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['weekly_menu']), 7)
+        self.assertEqual(set(response.context['menu_by_meal_type']), {'BREAKFAST', 'LUNCH'})
+        self.assertContains(response, 'Суп')
+
+
+class SignedSessionTests(TestCase):
+    def setUp(self):
+        make_dish('Суп', meal_type='LUNCH')
+        self.user = make_user(breakfast=False)
+        self.url = reverse('favorites:api_menu_today')
+
+    def test_database_session_survives_switch_to_signed_cookies(self):
+        self.client.force_login(self.user)
+        legacy_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        with override_settings(SESSION_ENGINE='favorites.sessions'):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+            signed = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            self.assertNotEqual(signed, legacy_key)
+            self.assertIn(':', signed)
+
+            # дальше сессия живёт только в cookie
+            Session.objects.all().delete()
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_tampered_cookie_is_rejected(self):
+        with override_settings(SESSION_ENGINE='favorites.sessions'):
+            self.client.force_login(self.user)
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+            signed = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+            payload, signature = signed.rsplit(':', 1)
+            forged = signature[:-1] + ('A' if signature[-1] != 'A' else 'B')
+            self.client.cookies[settings.SESSION_COOKIE_NAME] = f'{payload}:{forged}'
+
+            self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class DishAllergensTests(TestCase):
+    def setUp(self):
+        self.fish = Allergy.objects.create(name='Рыба', slug='fish')
+        self.nuts = Allergy.objects.create(name='Орехи', slug='nuts')
+        self.salmon = make_ingredient('Лосось')
+        self.rice = make_ingredient('Рис')
+        self.dish = make_dish('Лосось с рисом')
+        DishIngredient.objects.create(dish=self.dish, ingredient=self.salmon, quantity=1)
+        DishIngredient.objects.create(dish=self.dish, ingredient=self.rice, quantity=1)
+
+    def test_mask_follows_ingredient_allergens(self):
+        self.salmon.allergies.add(self.fish)
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.allergen_mask, 1)
+        self.assertEqual(list(self.dish.allergies.all()), [self.fish])
+
+        self.salmon.allergies.remove(self.fish)
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.allergen_mask, 0)
+
+    def test_tariff_allergies_filter_by_mask(self):
+        self.salmon.allergies.add(self.fish)
+        rice_bowl = make_dish('Рис')
+        DishIngredient.objects.create(dish=rice_bowl, ingredient=self.rice, quantity=1)
+        tariff = MealTariff(diet_type='CLASSIC', allergy_fish=True, allergy_dairy=True)
+
+        self.assertEqual(get_allergen_mask(tariff), 0b100001)
+        self.assertEqual(list(get_filtered_dishes(tariff, 'LUNCH')), [rice_bowl])
+        self.assertEqual(get_filtered_dishes(MealTariff(diet_type='CLASSIC'), 'LUNCH').count(), 2)
+
+    def test_allergy_rename_keeps_hand_set_tags(self):
+        # аллерген проставлен блюду вручную, ингредиенты ещё не размечены
+        self.dish.allergies.add(self.fish)
+        Dish.objects.filter(pk=self.dish.pk).update(allergen_mask=1)
+
+        self.fish.name = 'Рыба и морепродукты'
+        self.fish.save()
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.allergen_mask, 1)
+        self.assertEqual(list(self.dish.allergies.all()), [self.fish])
+
+    def test_allergy_slug_change_moves_bit(self):
+        self.salmon.allergies.add(self.fish)
+        self.fish.slug = 'seafood'
+        self.fish.save()
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.allergen_mask, 0)
+
+    def test_allergy_delete_clears_bit(self):
+        self.salmon.allergies.add(self.fish)
+        self.fish.delete()
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.allergen_mask, 0)
+
+    def test_dish_without_ingredients_keeps_tags(self):
+        dish = make_dish('Без состава')
+        dish.allergies.add(self.nuts)
+        Dish.objects.filter(pk=dish.pk).update(allergen_mask=16)
+
+        self.salmon.allergies.add(self.fish)
+        self.nuts.slug = 'nuts'
+        self.nuts.save()
+
+        dish.refresh_from_db()
+        self.assertEqual(dish.allergen_mask, 16)
+
+    def test_admin_edits_allergens_of_dish_without_ingredients(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        dish = make_dish('Без состава', description='Описание', recipe='Рецепт', image='img/plate.jpg')
+
+        def form_fields(pk):
+            return self.client.get(reverse('admin:favorites_dish_change', args=[pk])).context['adminform'].form.fields
+
+        # у блюда с составом аллергены только выводятся из ингредиентов
+        self.assertNotIn('allergies', form_fields(self.dish.pk))
+        self.assertIn('allergies', form_fields(dish.pk))
+
+        response = self.client.post(reverse('admin:favorites_dish_change', args=[dish.pk]), {
+            'name': dish.name, 'description': dish.description, 'recipe': dish.recipe,
+            'diet_type': dish.diet_type, 'meal_type': dish.meal_type, 'is_active': 'on',
+            'allergies': [self.fish.pk, self.nuts.pk],
+            'dish_ingredients-TOTAL_FORMS': '0', 'dish_ingredients-INITIAL_FORMS': '0',
+        })
+
+        self.assertEqual(response.status_code, 302)
+        dish.refresh_from_db()
+        self.assertEqual(dish.allergen_mask, 17)
+        self.assertEqual(set(dish.allergies.all()), {self.fish, self.nuts})
+
+    def test_migration_moves_dish_allergens_to_ingredients(self):
+        migration = import_module('favorites.migrations.0027_ingredient_allergens_from_dishes')
+        pasta = make_dish('Рис с орехами')
+        walnut = make_ingredient('Грецкий орех')
+        DishIngredient.objects.create(dish=pasta, ingredient=self.rice, quantity=1)
+        DishIngredient.objects.create(dish=pasta, ingredient=walnut, quantity=1)
+        self.dish.allergies.add(self.fish)
+        pasta.allergies.add(self.nuts)
+
+        migration.tag_ingredients_from_dishes(apps, None)
+
+        # рис есть в обоих блюдах, поэтому общий аллерген ему не достаётся
+        self.assertEqual(list(self.salmon.allergies.all()), [self.fish])
+        self.assertEqual(list(walnut.allergies.all()), [self.nuts])
+        self.assertEqual(list(self.rice.allergies.all()), [])
+
+        # полная пересборка из ингредиентов теперь сохраняет аллергены обоих блюд
+        refresh_dish_allergens()
+        self.dish.refresh_from_db()
+        pasta.refresh_from_db()
+        self.assertEqual(self.dish.allergen_mask, 1)
+        self.assertEqual(pasta.allergen_mask, 16)
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, directory)
+        self.path = os.path.join(directory, 'catalog.snapshot')
+        self.addCleanup(lambda: os.path.exists(self.path) and os.remove(self.path))
+        snapshot_settings = override_settings(CATALOG_SNAPSHOT_PATH=self.path, CATALOG_SNAPSHOT_AUTO_REBUILD=False)
+        snapshot_settings.enable()
+        self.addCleanup(snapshot_settings.disable)
+
+        fish = Allergy.objects.create(name='Рыба', slug='fish')
+        salmon = make_ingredient('Лосось', average_price=Decimal('300'), calories=200)
+        salmon.allergies.add(fish)
+        rice = make_ingredient('Рис', average_price=Decimal('20'), calories=130)
+
+        self.salmon_dish = make_dish('Лосось')
+        DishIngredient.objects.create(dish=self.salmon_dish, ingredient=salmon, quantity=1)
+        self.rice_dish = make_dish('Рис')
+        DishIngredient.objects.create(dish=self.rice_dish, ingredient=rice, quantity=1)
+        self.double_rice = make_dish('Двойной рис')
+        DishIngredient.objects.create(dish=self.double_rice, ingredient=rice, quantity=2)
+        make_dish('Кето-рис', diet_type='KETO')
+        make_dish('Снят', is_active=False)
+
+    def test_candidates_match_filters(self):
+        build_catalog_snapshot()
+        snapshot = get_snapshot()
+
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(
+            sorted(snapshot.candidate_ids('CLASSIC', 'LUNCH')),
+            sorted([self.salmon_dish.pk, self.rice_dish.pk, self.double_rice.pk]),
+        )
+        self.assertEqual(
+            sorted(snapshot.candidate_ids('CLASSIC', 'LUNCH', allergen_mask=1)),
+            sorted([self.rice_dish.pk, self.double_rice.pk]),
+        )
+        self.assertEqual(snapshot.candidate_ids('CLASSIC', 'LUNCH', max_price=Decimal('20')), [self.rice_dish.pk])
+        self.assertEqual(
+            snapshot.calorie_candidates('CLASSIC', 'LUNCH'),
+            ([130, 200, 260], [self.rice_dish.pk, self.salmon_dish.pk, self.double_rice.pk]),
+        )
+
+    def test_stale_snapshot_falls_back_to_database(self):
+        build_catalog_snapshot()
+        Dish.objects.filter(pk__in=[self.salmon_dish.pk, self.rice_dish.pk]).delete()
+        user = make_user(breakfast=False)
+
+        # в снимке первым по калорийности идёт уже удалённый рис
+        with mock.patch('favorites.history.weighted_choice', lambda dish_ids, favorite_ids: dish_ids[0]):
+            menu = get_daily_menu_for_user(user, user.meal_tariff)
+
+        self.assertEqual(menu, {'LUNCH': self.double_rice})
+
+    def test_rebuild_runs_once_per_commit(self):
+        with override_settings(CATALOG_SNAPSHOT_AUTO_REBUILD=True), \
+                mock.patch('favorites.snapshot.build_catalog_snapshot') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                catalog_changed.send(sender=Dish)
+                catalog_changed.send(sender=Dish)
+            self.assertEqual(build.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                catalog_changed.send(sender=Dish)
+            self.assertEqual(build.call_count, 2)
+
+
+class SnapshotRebuildTests(TransactionTestCase):
+    """Без обёртки TestCase колбэки on_commit в autocommit выполняются сразу."""
+
+    def test_one_rebuild_per_ingredient_save(self):
+        dish = make_dish('Рис')
+        rice = make_ingredient('Рис', calories=130)
+        with override_settings(CATALOG_SNAPSHOT_PATH='unused', CATALOG_SNAPSHOT_AUTO_REBUILD=True), \
+                mock.patch('favorites.snapshot.build_catalog_snapshot') as build:
+            link = DishIngredient.objects.create(dish=dish, ingredient=rice, quantity=1)
+            self.assertEqual(build.call_count, 1)
+
+            link.delete()
+            self.assertEqual(build.call_count, 2)
+
+
+class MetricsTests(TestCase):
+    def test_metrics_require_staff_by_default(self):
+        url = reverse('favorites:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('favorites_requests_total', response.content.decode())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_accept_token(self):
+        url = reverse('favorites:metrics')
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer secret'}).status_code, 200)
+
+    def test_sql_is_kept_only_with_slow_log(self):
+        recorders = []
+
+        def view(request):
+            Dish.objects.count()
+            return HttpResponse()
+
+        def finish(request, response, duration, recorder):
+            recorders.append(recorder)
+
+        request = RequestFactory().get('/')
+        for threshold in (None, 0):
+            with override_settings(SLOW_REQUEST_THRESHOLD=threshold):
+                middleware = MetricsMiddleware(view)
+                with mock.patch.object(middleware, 'finish', finish):
+                    middleware(request)
+
+        self.assertEqual([recorder.count for recorder in recorders], [1, 1])
+        self.assertEqual(recorders[0].statements, [])
+        self.assertEqual(len(recorders[1].statements), 1)
+
+
+class DishPreferencesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.porridge = make_dish('Каша', meal_type='BREAKFAST')
+        self.soup = make_dish('Суп', meal_type='LUNCH')
+        self.stew = make_dish('Рагу', meal_type='LUNCH')
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def test_favorite_and_blocked_are_exclusive(self):
+        self.assertTrue(DishPreferences.toggle_for_user(self.user, self.soup.pk))
+        self.assertTrue(DishPreferences.toggle_for_user(self.user, self.stew.pk))
+        self.assertTrue(DishPreferences.toggle_for_user(self.user, self.soup.pk, blocked=True))
+
+        preferences = DishPreferences.for_user(self.user)
+        self.assertEqual(preferences.favorite_ids, {self.stew.pk})
+        self.assertEqual(preferences.blocked_ids, {self.soup.pk})
+
+        self.assertFalse(DishPreferences.toggle_for_user(self.user, self.soup.pk, blocked=True))
+        self.assertEqual(DishPreferences.for_user(self.user).blocked_ids, frozenset())
+
+    def test_favorites_are_weighted(self):
+        rng = random.Random(1)
+        picks = [weighted_choice([1, 2], {1}, rng) for _ in range(4000)]
+        self.assertAlmostEqual(picks.count(1) / picks.count(2), FAVORITE_WEIGHT, delta=0.4)
+
+    def test_blocked_dish_is_never_picked(self):
+        DishPreferences.toggle_for_user(self.user, self.soup.pk, blocked=True)
+        for _ in range(10):
+            cache.clear()
+            menu = get_daily_menu_for_user(self.user, self.user.meal_tariff)
+            self.assertEqual(menu['LUNCH'], self.stew)
+
+    def test_block_replaces_only_that_slot(self):
+        menu = get_daily_menu_for_user(self.user, self.user.meal_tariff)
+        get_weekly_menu_for_user(self.user, self.user.meal_tariff)
+        blocked = menu['LUNCH']
+
+        response = self.client.post(reverse('favorites:block_dish', args=[blocked.pk]))
+        self.assertEqual(response.status_code, 302)
+
+        menu = get_daily_menu_for_user(self.user, self.user.meal_tariff)
+        self.assertEqual(menu['BREAKFAST'], self.porridge)
+        self.assertNotEqual(menu['LUNCH'], blocked)
+        self.assertEqual(UserProfile.objects.get(user=self.user).meal_swaps_remaining, 3)
+
+        plan = WeeklyMenu.objects.get(user=self.user).plan
+        self.assertEqual(plan['BREAKFAST'], [self.porridge.pk] * 7)
+        self.assertNotIn(blocked.pk, plan['LUNCH'])
+
+    @override_settings(DETERMINISTIC_MENUS=True)
+    def test_block_keeps_deterministic_menu(self):
+        other_breakfast = make_dish('Сырники', meal_type='BREAKFAST')
+        menu = get_daily_menu_for_user(self.user, self.user.meal_tariff)
+        blocked = self.soup if menu['LUNCH'] == self.stew else self.stew
+        unblocked = other_breakfast if menu['BREAKFAST'] == self.porridge else self.porridge
+
+        # скрытие блюда не из меню сдвигает пул, но не меню за сегодня
+        self.client.post(reverse('favorites:block_dish', args=[blocked.pk]))
+        self.client.post(reverse('favorites:block_dish', args=[unblocked.pk]))
+        cache.clear()
+        self.assertEqual(get_daily_menu_for_user(self.user, self.user.meal_tariff), menu)
+
+        # второй обед тоже скрыт, поэтому замены нет и слот пустеет
+        self.client.post(reverse('favorites:block_dish', args=[menu['LUNCH'].pk]))
+        self.assertEqual(get_daily_menu_for_user(self.user, self.user.meal_tariff), {'BREAKFAST': menu['BREAKFAST']})
+        cache.clear()
+        self.assertEqual(get_daily_menu_for_user(self.user, self.user.meal_tariff), {'BREAKFAST': menu['BREAKFAST']})
+
+        self.client.post(reverse('favorites:block_dish', args=[blocked.pk]))
+        self.assertEqual(get_daily_menu_for_user(self.user, self.user.meal_tariff)['BREAKFAST'], menu['BREAKFAST'])
+
+
+class PopularityCountersTests(TestCase):
+    def setUp(self):
+        self.dishes = [make_dish(f'Блюдо {i}') for i in range(12)]
+        self.counters = PopularityCounters()
+
+    def totals(self):
+        return {
+            row[0]: row[1:] for row in
+            DishDailyStats.objects.values_list('dish_id', 'impressions', 'swaps_away', 'card_views')
+        }
+
+    def test_flush_upserts_and_accumulates(self):
+        first, second = self.dishes[:2]
+        self.counters.record('impressions', first.pk, second.pk, first.pk)
+        self.counters.record('card_views', second.pk)
+        self.assertEqual(self.counters.flush(), 2)
+
+        self.counters.record('swaps_away', first.pk)
+        self.counters.record('impressions', first.pk)
+        self.counters.flush()
+
+        self.assertEqual(self.totals(), {first.pk: (3, 1, 0), second.pk: (1, 0, 1)})
+        self.assertEqual(self.counters.flush(), 0)
+
+    def test_deleted_dishes_are_dropped(self):
+        gone = self.dishes[0]
+        self.counters.record('impressions', gone.pk, self.dishes[1].pk)
+        gone.delete()
+        self.counters.flush()
+        self.assertEqual(self.totals(), {self.dishes[1].pk: (1, 0, 0)})
+
+    def test_batches_fit_query_params(self):
+        with mock.patch.object(connection.features, 'max_query_params', 25):
+            self.assertEqual(get_flush_batch_size(), 5)
+            self.counters.record('impressions', *(dish.pk for dish in self.dishes))
+            self.assertEqual(self.counters.flush(), 12)
+        self.assertEqual(len(self.totals()), 12)
+        self.assertLessEqual(get_flush_batch_size() * 5, connection.features.max_query_params or float('inf'))
+
+    def test_worker_exit_flushes_pending_counts(self):
+        server, worker = mock.Mock(), mock.Mock(pid=1)
+        with mock.patch('favorites.popularity.counters', self.counters):
+            self.counters.record('card_views', self.dishes[0].pk)
+            worker_exit(server, worker)
+        self.assertEqual(self.totals(), {self.dishes[0].pk: (0, 0, 1)})
+
+
+class SearchTests(TestCase):
+    def test_prefix_and_yo_match(self):
+        honey = make_dish('Мёд с орехами')
+        make_dish('Салат')
+        self.assertEqual(search_dish_ids('мед'), [honey.pk])
+        self.assertEqual(search_dish_ids('оре'), [honey.pk])
+        self.assertEqual(search_dish_ids('!!!'), [])
+
+    def test_ingredients_are_indexed_and_ranked_below_name(self):
+        borscht = make_dish('Борщ')
+        salad = make_dish('Салат')
+        beet = make_ingredient('Свёкла')
+        DishIngredient.objects.create(dish=salad, ingredient=beet, quantity=1)
+        DishIngredient.objects.create(dish=borscht, ingredient=beet, quantity=1)
+        make_dish('Винегрет', description='Почти как свекольный салат')
+
+        self.assertEqual(set(search_dish_ids('свекла')), {borscht.pk, salad.pk})
+        self.assertEqual(search_dish_ids('салат')[0], salad.pk)
+
+        beet.name = 'Буряк'
+        beet.save()
+        self.assertEqual(set(search_dish_ids('буряк')), {borscht.pk, salad.pk})
+
+    def test_inactive_dishes_do_not_take_result_slots(self):
+        for i in range(3):
+            make_dish(f'Борщ {i}', is_active=False)
+        active = make_dish('Борщ зелёный с щавелем')
+
+        self.assertEqual(search_dishes('борщ', limit=2), [active])
+        self.assertEqual(len(search_dish_ids('борщ', limit=2)), 2)
+
+
+class IngredientPriceTests(TestCase):
+    def setUp(self):
+        self.today = date(2026, 3, 31)
+        self.flour = make_ingredient('Мука', average_price=Decimal('50'), unit='KILOGRAM')
+        self.salt = make_ingredient('Соль', average_price=Decimal('5'))
+        self.dish = make_dish('Хлеб')
+        DishIngredient.objects.create(dish=self.dish, ingredient=self.flour, quantity=Decimal('0.5'))
+
+    def test_rolling_average_updates_costs(self):
+        count, ingredient_ids = ingest_prices([
+            (self.flour.pk, self.today - timedelta(days=40), Decimal('1000')),
+            (self.flour.pk, self.today - timedelta(days=10), Decimal('60')),
+            (self.flour.pk, self.today, Decimal('80')),
+            (self.flour.pk, self.today, Decimal('999')),
+            (999999, self.today, Decimal('1')),
+        ])
+        self.assertEqual((count, ingredient_ids), (3, {self.flour.pk}))
+        self.assertEqual(IngredientPrice.objects.filter(ingredient=self.flour).count(), 3)
+
+        # повтор уже записанного дня не считается добавленным
+        self.assertEqual(ingest_prices([(self.flour.pk, self.today, Decimal('90'))]), (0, {self.flour.pk}))
+
+        self.assertEqual(recalculate_average_prices(today=self.today), 1)
+
+        self.flour.refresh_from_db()
+        self.salt.refresh_from_db()
+        self.dish.refresh_from_db()
+        self.assertEqual(self.flour.average_price, Decimal('70'))
+        self.assertEqual(self.flour.cost_per_unit, Decimal('700'))
+        self.assertEqual(self.salt.average_price, Decimal('5'))
+        self.assertEqual(self.dish.total_price, Decimal('350'))
+
+    def test_window_average_ignores_older_observations(self):
+        ingest_prices([
+            (self.salt.pk, self.today - timedelta(days=PRICE_WINDOW_DAYS), Decimal('100')),
+            (self.salt.pk, self.today - timedelta(days=PRICE_WINDOW_DAYS - 1), Decimal('8')),
+            (self.salt.pk, self.today, Decimal('12')),
+            # наблюдение из будущего в окно тоже не попадает
+            (self.salt.pk, self.today + timedelta(days=1), Decimal('500')),
+        ])
+
+        self.assertEqual(recalculate_average_prices([self.salt.pk], today=self.today), 1)
+        self.salt.refresh_from_db()
+        self.assertEqual(self.salt.average_price, Decimal('10'))
+
+        # за окном наблюдений нет — цена остаётся прежней
+        self.assertEqual(recalculate_average_prices([self.salt.pk], today=self.today + timedelta(days=90)), 0)
+        self.salt.refresh_from_db()
+        self.assertEqual(self.salt.average_price, Decimal('10'))
+
+    def test_feed_reports_bad_line(self):
+        lines = ['ingredient_id,observed_on,price', '1,2026-03-01,10', '2,вчера,10']
+        with self.assertRaisesMessage(ValueError, 'строка 3'):
+            list(read_price_feed(lines))
+
+    def test_admin_history_is_append_only(self):
+        IngredientPrice.objects.create(ingredient=self.flour, observed_on=self.today, price=Decimal('60'))
+        admin_user = User.objects.create_superuser('admin', password='password')
+        self.client.force_login(admin_user)
+
+        self.assertEqual(self.client.get(reverse('admin:favorites_ingredientprice_add')).status_code, 403)
+        self.client.post(reverse('admin:favorites_ingredientprice_changelist'), {
+            'action': 'delete_selected', '_selected_action': IngredientPrice.objects.values_list('pk', flat=True),
+        })
+        self.assertEqual(IngredientPrice.objects.count(), 1)
+
+        # а сам ингредиент удаляется вместе с историей
+        response = self.client.post(
+            reverse('admin:favorites_ingredient_delete', args=[self.flour.pk]), {'post': 'yes'},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(IngredientPrice.objects.exists())
+
+
+class CatalogRoundTripTests(TestCase):
+    def setUp(self):
+        nuts = Allergy.objects.create(name='Орехи', slug='nuts')
+        honey = make_ingredient('Мёд', average_price=Decimal('12.50'), unit='TABLESPOON')
+        honey.allergies.add(Allergy.objects.create(name='Мёд', slug='honey'))
+        walnut = make_ingredient('Грецкий орех', average_price=Decimal('90'), protein=Decimal('15.2'))
+        walnut.allergies.add(nuts)
+        oats = make_ingredient('Овсянка', average_price=Decimal('8'), unit='KILOGRAM', calories=350)
+
+        porridge = make_dish('Овсянка, мёд и орехи', description='Завтрак, «как у бабушки»', meal_type='BREAKFAST')
+        for ingredient, quantity in ((oats, '0.3'), (honey, '2'), (walnut, '0.5')):
+            DishIngredient.objects.create(dish=porridge, ingredient=ingredient, quantity=Decimal(quantity))
+        make_dish('Пустая тарелка', recipe='строка 1\nстрока 2', is_active=False, diet_type='KETO')
+
+    def export(self):
+        return ''.join(iter_catalog_csv()), ''.join(iter_catalog_jsonl())
+
+    def wipe(self):
+        Dish.objects.all().delete()
+        Ingredient.objects.all().delete()
+
+    def test_csv_round_trip(self):
+        csv_before, jsonl_before = self.export()
+        totals_before = list(Dish.objects.order_by('pk').values('allergen_mask', 'total_price', 'total_calories'))
+        self.wipe()
+
+        counts = import_catalog(read_catalog_csv(csv_before.splitlines(keepends=True)), chunk_size=2)
+
+        self.assertEqual(counts, {'ingredient': 3, 'dish': 2, 'dish_ingredient': 3})
+        self.assertEqual(self.export(), (csv_before, jsonl_before))
+        self.assertEqual(
+            list(Dish.objects.order_by('pk').values('allergen_mask', 'total_price', 'total_calories')), totals_before,
+        )
+        self.assertEqual(len(search_dish_ids('орехи')), 1)
+
+    def test_jsonl_round_trip_updates_in_place(self):
+        csv_before, jsonl_before = self.export()
+        Dish.objects.update(name='Переименовано')
+
+        import_catalog(read_catalog_jsonl(jsonl_before.splitlines()))
+
+        self.assertEqual(self.export(), (csv_before, jsonl_before))
+        self.assertEqual(Dish.objects.count(), 2)
+
+    def test_admin_import_requires_dish_permissions(self):
+        staff = User.objects.create_user('staff', password='password', is_staff=True)
+        self.client.force_login(staff)
+        url = reverse('admin:favorites_dish_import_catalog')
+
+        self.assertEqual(self.client.get(url).status_code, 403)
+        staff.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='favorites', codename__in=['add_dish', 'change_dish'],
+        ))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_admin_import_reports_database_error(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        csv_before, _ = self.export()
+        upload = SimpleUploadedFile('catalog.csv', csv_before.encode())
+
+        with mock.patch('favorites.admin.import_catalog', side_effect=IntegrityError('UNIQUE constraint failed')):
+            response = self.client.post(reverse('admin:favorites_dish_import_catalog'), {'catalog_file': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Не удалось импортировать каталог: UNIQUE constraint failed')
+
+
+class DishHistoryTests(TestCase):
+    def test_ring_buffer_keeps_newest(self):
+        history = DishHistory(size=3)
+        history.push(1, 2, 3)
+        self.assertIn(1, history)
+        history.push(4)
+
+        self.assertEqual(list(history.dish_ids), [2, 3, 4])
+        self.assertNotIn(1, history)
+        self.assertEqual(list(DishHistory(history.pack(), size=3).dish_ids), [2, 3, 4])
+
+    def test_pack_survives_profile_round_trip(self):
+        user = make_user()
+        history = DishHistory()
+        history.push(*range(1, HISTORY_SIZE + 5))
+        history.save(user)
+
+        restored = DishHistory.for_user(user)
+        self.assertEqual(list(restored.dish_ids), list(range(5, HISTORY_SIZE + 5)))
+        self.assertEqual(list(DishHistory(b'\x01\x00\x00\x00\x02').dish_ids), [1])
+
+    def test_pick_prefers_fresh_then_oldest(self):
+        history = DishHistory()
+        history.push(10, 20, 30)
+
+        self.assertEqual(history.pick([10, 20, 40]), 40)
+        self.assertEqual(history.pick([30, 20]), 20)
+        self.assertIsNone(history.pick([]))
+
+    def test_daily_menu_avoids_recent_dishes(self):
+        soups = [make_dish(f'Суп {i}') for i in range(3)]
+        user = make_user(breakfast=False)
+        seen = []
+        for _ in range(3):
+            cache.clear()
+            seen.append(get_daily_menu_for_user(user, user.meal_tariff)['LUNCH'])
+        self.assertEqual(sorted(dish.pk for dish in seen), sorted(dish.pk for dish in soups))
+
+
+def calorie_candidates(rng, size):
+    calories = sorted(rng.randrange(50, 900) for _ in range(size))
+    return calories, [rng.randrange(1, 10 ** 6) for _ in calories]
+
+
+class CalorieBandTests(SimpleTestCase):
+    def test_pick_pair_is_exact(self):
+        rng = random.Random(7)
+        for _ in range(300):
+            first, second = calorie_candidates(rng, rng.randrange(1, 15)), calorie_candidates(rng, rng.randrange(1, 15))
+            low = rng.randrange(100, 1800)
+            high = low + rng.randrange(0, 40)
+            exists = any(low <= a + b <= high for a in first[0] for b in second[0])
+
+            pair = pick_pair(first, second, low, high, rng)
+
+            self.assertEqual(pair is not None, exists)
+            if pair:
+                total = first[0][first[1].index(pair[0])] + second[0][second[1].index(pair[1])]
+                self.assertTrue(low <= total <= high)
+
+    def test_compose_in_band_sums_into_band(self):
+        rng = random.Random(11)
+        candidates = [([100, 300, 500], [1, 2, 3]), ([200, 400], [4, 5]), ([50, 650], [6, 7])]
+        for low, high in ((350, 360), (1140, 1160), (1550, 1550)):
+            dish_ids = compose_in_band(candidates, low, high, rng)
+            calories = {pk: c for cals, pks in candidates for c, pk in zip(cals, pks)}
+            self.assertTrue(low <= sum(calories[pk] for pk in dish_ids) <= high)
+            self.assertEqual([pk in pks for pk, (_, pks) in zip(dish_ids, candidates)], [True] * 3)
+
+        self.assertIsNone(compose_in_band(candidates, 2000, 3000, rng))
+        self.assertIsNone(compose_in_band(candidates + [([], [])], 0, 5000, rng))
+        self.assertEqual(compose_in_band(candidates[:1], 250, 350, rng), [2])
+
+    def test_compose_in_band_finds_rare_menu(self):
+        # в диапазон попадает одно сочетание из тысяч, случайные попытки его почти наверняка минуют
+        rng = random.Random(3)
+        candidates = [
+            (list(range(100, 1100)), list(range(1000))),
+            ([0, 1000], [1000, 1001]),
+            ([0], [2000]),
+            ([0], [3000]),
+        ]
+        self.assertEqual(compose_in_band(candidates, 2099, 2099, rng), [999, 1001, 2000, 3000])
+        self.assertEqual(search_in_band(candidates, 150, 150, rng), [50, 1000, 2000, 3000])
+        self.assertIsNone(search_in_band(candidates, 2200, 2300, rng))
+
+        for _ in range(100):
+            lists = [calorie_candidates(rng, rng.randrange(1, 6)) for _ in range(4)]
+            low = rng.randrange(200, 3600)
+            high = low + rng.randrange(0, 20)
+            exists = any(low <= sum(combo) <= high for combo in product(*(cals for cals, _ in lists)))
+            self.assertEqual(search_in_band(lists, low, high, rng) is not None, exists)
+
+    def test_nearest_and_exclusion(self):
+        candidates = ([100, 200, 400], [1, 2, 3])
+        self.assertEqual(pick_nearest(candidates, 150), 1)
+        self.assertEqual(pick_nearest(candidates, 310), 3)
+        self.assertEqual(pick_nearest(candidates, 10 ** 6), 3)
+        self.assertIsNone(pick_nearest(([], []), 100))
+
+        self.assertEqual(exclude_ids(candidates, {2}), ([100, 400], [1, 3]))
+        self.assertEqual(exclude_ids(candidates, {1, 2, 3}), candidates)
+
+
+class CalorieMenuTests(TestCase):
+    def test_daily_menu_fits_calorie_target(self):
+        ingredient = make_ingredient('База', calories=100)
+        for meal_type, quantities in (('BREAKFAST', (2, 3, 6)), ('LUNCH', (4, 7, 9))):
+            for quantity in quantities:
+                dish = make_dish(f'{meal_type} {quantity}', meal_type=meal_type)
+                DishIngredient.objects.create(dish=dish, ingredient=ingredient, quantity=quantity)
+        user = make_user()
+        UserProfile.objects.filter(user=user).update(calorie_target_min=1150, calorie_target_max=1250)
+
+        for _ in range(5):
+            cache.clear()
+            menu = get_daily_menu_for_user(user, user.meal_tariff)
+            self.assertEqual(sum(dish.total_calories for dish in menu.values()), 1200)
+
+
+class PerUnitColumnsTests(TestCase):
+    def setUp(self):
+        self.butter = make_ingredient('Масло', average_price=Decimal('80'), calories=700, fat=Decimal('82.5'))
+        self.potato = make_ingredient('Картофель', average_price=Decimal('6'), unit='KILOGRAM', calories=None)
+        self.dish = make_dish('Пюре')
+        DishIngredient.objects.create(dish=self.dish, ingredient=self.butter, quantity=Decimal('0.5'))
+        DishIngredient.objects.create(dish=self.dish, ingredient=self.potato, quantity=Decimal('1.5'))
+
+    def test_save_scales_by_unit(self):
+        self.assertEqual(self.butter.cost_per_unit, Decimal('80'))
+        self.assertEqual(self.potato.cost_per_unit, Decimal('60'))
+        self.assertIsNone(self.potato.calories_per_unit)
+
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.total_price, Decimal('130'))
+        self.assertEqual(self.dish.total_calories, 350)
+        self.assertEqual(self.dish.total_fat, Decimal('41.25'))
+
+    def test_unit_change_recalculates_dishes(self):
+        self.butter.unit = 'KILOGRAM'
+        self.butter.save()
+        self.dish.refresh_from_db()
+        self.assertEqual(self.dish.total_price, Decimal('490'))
+        self.assertEqual(self.dish.total_calories, 3500)
+
+    def test_bulk_update_refresh(self):
+        Ingredient.objects.filter(pk=self.potato.pk).update(unit='PIECE', calories=80)
+        self.assertEqual(refresh_ingredient_unit_columns([self.potato.pk]), 1)
+        recalculate_dish_totals([self.dish.pk])
+
+        self.potato.refresh_from_db()
+        self.dish.refresh_from_db()
+        self.assertEqual((self.potato.cost_per_unit, self.potato.calories_per_unit), (Decimal('6'), Decimal('80')))
+        self.assertEqual(self.dish.total_price, Decimal('49'))
+        self.assertEqual(self.dish.total_calories, 470)
+
+
+    def test_shopping_list_sums_across_days(self):
+        pancakes = make_dish('Драники')
+        DishIngredient.objects.create(dish=pancakes, ingredient=self.potato, quantity=Decimal('0.5'))
+        # пюре в оба дня, драники только во второй
+        days = [[self.dish], [self.dish, pancakes]]
+
+        items = get_shopping_list(count_menu_dishes(dish for day in days for dish in day))
+
+        self.assertEqual(items, [
+            {'name': 'Картофель', 'quantity': Decimal('3.5'), 'unit': 'кг', 'cost': Decimal('210')},
+            {'name': 'Масло', 'quantity': Decimal('100'), 'unit': 'г', 'cost': Decimal('80')},
+        ])
+
+
+class CatalogBrowseTests(TestCase):
+    def setUp(self):
+        # по три блюда на одну и ту же секунду, чтобы курсор проверялся и на равных created_at
+        start = timezone.now().replace(microsecond=0)
+        self.dishes = []
+        for i in range(10):
+            dish = make_dish(f'Блюдо {i}', diet_type='KETO' if i % 2 else 'CLASSIC')
+            Dish.objects.filter(pk=dish.pk).update(created_at=start + timedelta(seconds=i // 3))
+            self.dishes.append(dish)
+        make_dish('Снято', is_active=False)
+        self.filters = parse_filters(QueryDict())
+
+    def walk(self, filters, page_size):
+        pages, cursor = [], None
+        while True:
+            page, cursor = browse_dishes(filters, cursor, page_size)
+            pages.append([dish.pk for dish in page])
+            if cursor is None:
+                return pages
+
+    def test_walk_matches_ordering(self):
+        expected = list(Dish.objects.filter(is_active=True).order_by('-created_at', '-id').values_list('pk', flat=True))
+        for page_size in (1, 3, 4, 10, 11):
+            pages = self.walk(self.filters, page_size)
+            self.assertEqual([pk for page in pages for pk in page], expected)
+            self.assertTrue(all(0 < len(page) <= page_size for page in pages))
+
+    def test_filters_apply_to_every_page(self):
+        filters = parse_filters(QueryDict('diet=KETO&max_price=abc&exclude=nuts&exclude=bogus'))
+        self.assertEqual(filters, {'diet': 'KETO', 'meal': '', 'max_price': None, 'exclude': ['nuts']})
+
+        pages = self.walk(filters, 2)
+        self.assertEqual(sorted(pk for page in pages for pk in page), [dish.pk for dish in self.dishes[1::2]])
+
+    def test_cursor_round_trip(self):
+        dish = Dish.objects.get(pk=self.dishes[4].pk)
+        self.assertEqual(decode_cursor(encode_cursor(dish)), (dish.created_at, dish.pk))
+        for garbage in (None, '', 'abc', '1-2-3', '99999999999999999999999-1'):
+            self.assertIsNone(decode_cursor(garbage))
+
+    def test_view_pages_forward(self):
+        url = reverse('favorites:catalog')
+        for i in range(PAGE_SIZE - 4):
+            make_dish(f'Ещё блюдо {i}')
+
+        response = self.client.get(url, {'diet': 'CLASSIC'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['dishes']), PAGE_SIZE)
+        next_params = QueryDict(response.context['next_params'])
+        self.assertEqual(next_params['diet'], 'CLASSIC')
+
+        response = self.client.get(url, next_params)
+        self.assertEqual(len(response.context['dishes']), 1)
+        self.assertIsNone(response.context['next_params'])
+        self.assertEqual(response.context['first_params'], 'diet=CLASSIC')
+
+        self.assertEqual(self.client.get(url, {'after': 'мусор', 'max_price': '-1'}).status_code, 200)
+
+
+class WarmupTests(SimpleTestCase):
+    def test_sample_args_follow_converter_classes(self):
+        class MealTypeConverter(StringConverter):
+            regex = '[A-Z]+'
+
+        self.assertEqual(sample_path_arg(RoutePattern('<meal_type>/').converters['meal_type']), 'LUNCH')
+        self.assertEqual(sample_path_arg(MealTypeConverter()), 'LUNCH')
+        self.assertIsNone(sample_path_arg(object()))
+
+    def test_resolve_routes_logs_skipped_routes(self):
+        routes = len(urls.urlpatterns)
+        with self.assertNoLogs('favorites.warmup', 'INFO'):
+            self.assertEqual(resolve_routes(), routes)
+
+        legacy = re_path(r'^legacy/(?P<pk>[0-9]+)/$', views.index, name='legacy')
+        with mock.patch.object(urls, 'urlpatterns', urls.urlpatterns + [legacy]), \
+                self.assertLogs('favorites.warmup', 'INFO') as logs:
+            self.assertEqual(resolve_routes(), routes)
+        self.assertIn('legacy', logs.output[0])
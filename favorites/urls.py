@@ -1,15 +1,28 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'favorites'
 
+page_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('auth/', views.auth_view, name='auth'),
-    path('card/<int:pk>/', views.card, name='card'),
-    path('lk/', views.lk, name='lk'),
+    path('card/<int:pk>/', page_views.card, name='card'),
+    path('search/', views.search, name='search'),
+    path('catalog/', views.catalog, name='catalog'),
+    path('lk/', page_views.lk, name='lk'),
     path('order/', views.order, name='order'),
     path('registration/', views.registration, name='registration'),
     path('logout/', views.logout_view, name='logout'),
-    path('replace-dish/<str:meal_type>/', views.replace_dish, name='replace_dish'),
+    path('shopping-list/', views.shopping_list, name='shopping_list'),
+    path('replace-dish/<str:meal_type>/', page_views.replace_dish, name='replace_dish'),
+    path('dish/<int:pk>/favorite/', views.favorite_dish, name='favorite_dish'),
+    path('dish/<int:pk>/block/', views.block_dish, name='block_dish'),
+    path('api/menu/today/', views.api_menu_today, name='api_menu_today'),
+    path('api/menu/swap/<str:meal_type>/', views.api_swap_dish, name='api_swap_dish'),
+    path('api/dish/<int:pk>/', views.api_dish, name='api_dish'),
+    path('api/search/', views.api_search, name='api_search'),
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -5,11 +5,34 @@ from django.contrib import messages
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, MealTariffForm
 from django import forms
 from .models import MealTariff, UserProfile, Dish, Allergy
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.utils import timezone
-import random
-from django.core.cache import cache
-from decimal import Decimal
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import require_GET, require_POST
+import hashlib
+import json
+import logging
+from django.conf import settings
+from .browse import browse_dishes, parse_filters
+from .metrics import registry
+from .popularity import record_card_view, record_impressions
+from .preferences import DishPreferences
+from .menu import (
+    get_daily_menu_for_user,
+    get_weekly_menu_for_user,
+    invalidate_user_menus,
+    replace_dish_in_menu,
+    toggle_blocked_dish,
+)
+from .search import search_dishes
+from .serializers import dish_schema, menu_schema, swap_result_schema
+from .shopping import count_menu_dishes, get_shopping_list, iter_shopping_list_csv
+
+
+logger = logging.getLogger(__name__)
 
 
 def index(request):
@@ -22,12 +45,44 @@ def card(request, pk):
     except Http404:
         return redirect('favorites:lk')
 
+    record_card_view(dish.pk)
     context = {
-        'dish': dish
+        'dish': dish,
+        'preferences': DishPreferences.for_user(request.user) if request.user.is_authenticated else None,
     }
     return render(request, 'card.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    dishes = search_dishes(query) if query else []
+    return render(request, 'search.html', {'query': query, 'dishes': dishes})
+
+
+def catalog(request):
+    filters = parse_filters(request.GET)
+    dishes, next_cursor = browse_dishes(filters, request.GET.get('after'))
+
+    next_params = None
+    if next_cursor:
+        next_params = request.GET.copy()
+        next_params['after'] = next_cursor
+        next_params = next_params.urlencode()
+    first_params = request.GET.copy()
+    first_params.pop('after', None)
+
+    context = {
+        'dishes': dishes,
+        'filters': filters,
+        'diet_choices': Dish.DIET_CHOICES,
+        'meal_choices': Dish.MEAL_TYPES,
+        'allergens': Allergy.objects.filter(slug__in=Allergy.TARIFF_FIELD_MAPPING).order_by('name'),
+        'next_params': next_params,
+        'first_params': first_params.urlencode() if 'after' in request.GET else None,
+    }
+    return render(request, 'catalog.html', context)
+
+
 def order(request):
     if request.method == 'POST':
         if not request.user.is_authenticated:
@@ -103,112 +158,6 @@ def logout_view(request):
     return redirect('favorites:auth')
 
 
-def get_daily_menu_for_user(user, user_tariff, max_price=None):
-    today = timezone.now().date()
-    cache_key = f"daily_menu_{user.id}_{today}"
-
-    menu = cache.get(cache_key)
-    if menu:
-        return menu
-
-    meal_types = []
-    if user_tariff.breakfast:
-        meal_types.append('BREAKFAST')
-    if user_tariff.lunch:
-        meal_types.append('LUNCH')
-    if user_tariff.dinner:
-        meal_types.append('DINNER')
-    if user_tariff.desserts:
-        meal_types.append('SNACK')
-
-    menu = {}
-    for meal_type in meal_types:
-        dishes = get_filtered_dishes(user_tariff, meal_type, max_price)
-
-        if hasattr(dishes, 'exists') and dishes.exists():
-            selected_dish = random.choice(list(dishes))
-            menu[meal_type] = selected_dish
-            dishes_no_price_limit = get_filtered_dishes(user_tariff, meal_type, None)
-
-            if hasattr(dishes_no_price_limit, 'exists') and dishes_no_price_limit.exists():
-                selected_dish = random.choice(list(dishes_no_price_limit))
-                menu[meal_type] = selected_dish
-            else:
-                fallback_dishes = Dish.objects.filter(
-                    is_active=True,
-                    diet_type=user_tariff.diet_type,
-                    meal_type=meal_type
-                )
-                if fallback_dishes.exists():
-                    selected_dish = random.choice(list(fallback_dishes))
-                    menu[meal_type] = selected_dish
-
-    cache.set(cache_key, menu, 60 * 60 * 24)
-    return menu
-
-
-def get_filtered_dishes(user_tariff, meal_type=None, max_price=None):
-    try:
-        dishes = Dish.objects.filter(is_active=True, diet_type=user_tariff.diet_type)
-
-        if not hasattr(dishes, 'filter'):
-            return Dish.objects.none()
-
-        if meal_type:
-            dishes = dishes.filter(meal_type=meal_type)
-
-        if max_price is not None:
-            try:
-                max_price_decimal = Decimal(str(max_price))
-                dishes = dishes.filter(total_price__lte=max_price_decimal)
-            except (ValueError, TypeError) as e:
-                print(f"Error converting max_price to Decimal: {e}")
-
-        user_allergies = []
-        if user_tariff.allergy_fish:
-            user_allergies.append('fish')
-        if user_tariff.allergy_meat:
-            user_allergies.append('meat')
-        if user_tariff.allergy_grains:
-            user_allergies.append('grains')
-        if user_tariff.allergy_honey:
-            user_allergies.append('honey')
-        if user_tariff.allergy_nuts:
-            user_allergies.append('nuts')
-        if user_tariff.allergy_dairy:
-            user_allergies.append('dairy')
-
-        if user_allergies:
-            existing_allergies = Allergy.objects.filter(slug__in=user_allergies)
-            if existing_allergies.exists():
-                dishes = dishes.exclude(allergies__in=existing_allergies)
-
-        return dishes
-    except Exception as e:
-        return Dish.objects.none()
-
-
-def replace_dish_in_menu(user, user_tariff, meal_type, max_price=None):
-    today = timezone.now().date()
-    cache_key = f"daily_menu_{user.id}_{today}"
-
-    menu = cache.get(cache_key) or {}
-
-    dishes = get_filtered_dishes(user_tariff, meal_type, max_price)
-
-    current_dish = menu.get(meal_type)
-    if current_dish:
-        dishes = dishes.exclude(pk=current_dish.pk)
-
-    if dishes.exists():
-        new_dish = random.choice(list(dishes))
-        menu[meal_type] = new_dish
-        cache.set(cache_key, menu, 60 * 60 * 24)
-        return new_dish
-
-    return None
-
-
 def reset_user_swaps(user_profile):
     return user_profile.reset_swaps_if_needed()
 
@@ -225,12 +174,10 @@ def lk(request):
         if 'reset_price' in request.POST:
             user_profile = UserProfile.objects.get(user=request.user)
             user_profile.max_dish_price = None
-            user_profile.save()
+            user_profile.save(update_fields=['max_dish_price'])
             messages.success(request, 'Фильтр цены сброшен!')
 
-            today = timezone.now().date()
-            cache_key = f"daily_menu_{request.user.id}_{today}"
-            cache.delete(cache_key)
+            invalidate_user_menus(request.user)
 
             return redirect('favorites:lk')
 
@@ -242,10 +189,35 @@ def lk(request):
                 user_tariff.save()
                 messages.success(request, f'Тип диеты изменен на {user_tariff.get_diet_type_display()}!')
 
-                today = timezone.now().date()
-                cache_key = f"daily_menu_{request.user.id}_{today}"
-                cache.delete(cache_key)
+                invalidate_user_menus(request.user)
+
+            return redirect('favorites:lk')
+
+        if 'calorie_target_min' in request.POST or 'calorie_target_max' in request.POST:
+            user_profile = UserProfile.objects.get(user=request.user)
+            try:
+                low, high = (
+                    int(value) if value.strip() else None
+                    for value in (request.POST.get('calorie_target_min', ''), request.POST.get('calorie_target_max', ''))
+                )
+            except ValueError:
+                messages.error(request, 'Неверное значение калорий')
+                return redirect('favorites:lk')
+
+            if (low is not None and low < 0) or (high is not None and high < 0) or (
+                    low is not None and high is not None and low > high):
+                messages.error(request, 'Неверный диапазон калорий')
+                return redirect('favorites:lk')
+
+            user_profile.calorie_target_min = low
+            user_profile.calorie_target_max = high
+            user_profile.save(update_fields=['calorie_target_min', 'calorie_target_max'])
+            if low is None and high is None:
+                messages.success(request, 'Норма калорий сброшена!')
+            else:
+                messages.success(request, 'Норма калорий обновлена!')
 
+            invalidate_user_menus(request.user)
             return redirect('favorites:lk')
 
         max_price = request.POST.get('max_price')
@@ -256,16 +228,13 @@ def lk(request):
                     max_price_value = float(max_price)
                     user_profile.max_dish_price = max_price_value
                     messages.success(request, f'Настройки цены обновлены! Будут показаны блюда до {max_price_value} руб.')
-                    print(f"DEBUG: Установлена максимальная цена: {max_price_value}")
+                    logger.debug('Установлена максимальная цена %s для пользователя %s', max_price_value, request.user.id)
                 else:
                     user_profile.max_dish_price = None
                     messages.success(request, 'Фильтр цены сброшен!')
-                user_profile.save()
+                user_profile.save(update_fields=['max_dish_price'])
 
-                today = timezone.now().date()
-                cache_key = f"daily_menu_{request.user.id}_{today}"
-                cache.delete(cache_key)
-                print(f"DEBUG: Кеш очищен для пользователя {request.user.id}")
+                invalidate_user_menus(request.user)
 
             except ValueError:
                 messages.error(request, 'Неверное значение цены')
@@ -281,6 +250,8 @@ def lk(request):
     reset_user_swaps(user_profile)
 
     daily_menu = get_daily_menu_for_user(request.user, user_tariff, user_profile.max_dish_price)
+    weekly_menu = get_weekly_menu_for_user(request.user, user_tariff, user_profile.max_dish_price)
+    record_impressions(*(dish.pk for dish in daily_menu.values()))
 
     menu_by_meal_type = {}
     for meal_type, dish in daily_menu.items():
@@ -292,39 +263,242 @@ def lk(request):
             'meal_type': meal_type
         })
 
+    preferences = DishPreferences.for_user(request.user)
+    listed = Dish.objects.only('pk', 'name').in_bulk(preferences.favorite_ids | preferences.blocked_ids)
+
     context = {
         'menu_by_meal_type': menu_by_meal_type,
+        'weekly_menu': weekly_menu,
         'user': request.user,
         'user_profile': user_profile,
         'user_tariff': user_tariff,
         'today': timezone.now().date(),
+        'favorite_dishes': [listed[pk] for pk in sorted(preferences.favorite_ids) if pk in listed],
+        'blocked_dishes': [listed[pk] for pk in sorted(preferences.blocked_ids) if pk in listed],
     }
     return render(request, 'lk.html', context)
 
 
-def replace_dish(request, meal_type):
-    if request.method == 'POST':
-        user_profile = UserProfile.objects.get(user=request.user)
-        reset_user_swaps(user_profile)
+@login_required
+def shopping_list(request):
+    user_tariff = MealTariff.objects.filter(user=request.user).first()
+    if user_tariff is None:
+        return redirect('favorites:order')
 
-        if user_profile.meal_swaps_remaining <= 0:
-            messages.error(request, 'У вас не осталось доступных замен')
-            return redirect('favorites:lk')
+    user_profile = UserProfile.objects.get_or_create(user=request.user)[0]
+    period = 'week' if request.GET.get('period') == 'week' else 'day'
+
+    if period == 'week':
+        weekly_menu = get_weekly_menu_for_user(request.user, user_tariff, user_profile.max_dish_price)
+        dishes = [dish for day in weekly_menu for _, dish in day['dishes']]
+    else:
+        dishes = get_daily_menu_for_user(request.user, user_tariff, user_profile.max_dish_price).values()
+
+    items = get_shopping_list(count_menu_dishes(dishes))
 
-        user_tariff = MealTariff.objects.get(user=request.user)
+    if request.GET.get('format') == 'csv':
+        response = StreamingHttpResponse(iter_shopping_list_csv(items), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="shopping_list_{period}.csv"'
+        return response
 
-        new_dish = replace_dish_in_menu(
-            request.user,
-            user_tariff,
-            meal_type,
-            user_profile.max_dish_price
+    context = {
+        'items': items,
+        'period': period,
+        'total_cost': sum(item['cost'] for item in items),
+        'today': timezone.now().date(),
+    }
+    return render(request, 'shopping_list.html', context)
+
+
+def swap_dish_for_user(user, meal_type):
+    """Заменяет блюдо в меню пользователя и списывает одну замену.
+
+    Возвращает кортеж (новое блюдо, профиль, текст ошибки).
+    """
+    user_profile = UserProfile.objects.get(user=user)
+    reset_user_swaps(user_profile)
+
+    if not user_profile.take_swap():
+        return None, user_profile, 'У вас не осталось доступных замен'
+
+    user_tariff = MealTariff.objects.get(user=user)
+
+    new_dish = replace_dish_in_menu(
+        user,
+        user_tariff,
+        meal_type,
+        user_profile.max_dish_price
+    )
+
+    if not new_dish:
+        user_profile.return_swap()
+        return None, user_profile, 'Не найдено подходящих блюд для замены'
+
+    return new_dish, user_profile, None
+
+
+def wants_swap_fragment(request):
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.GET.get('fragment') == '1'
+
+
+def render_swap_fragment(request, meal_type, new_dish, user_profile, error):
+    """Ответ на замену блюда для обновления карточки на месте: HTML карточки или JSON."""
+    if error:
+        return HttpResponse(error, status=409, content_type='text/plain; charset=utf-8')
+
+    if 'application/json' in request.headers.get('Accept', ''):
+        response = JsonResponse(
+            swap_result_schema.dump({
+                'meal_type': meal_type,
+                'swaps_remaining': user_profile.meal_swaps_remaining,
+                'dish': new_dish,
+            }),
+            json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')},
         )
+    else:
+        html = render_to_string('menu_item.html', {
+            'menu_item': {'dish': new_dish, 'meal_type': meal_type},
+            'user_profile': user_profile,
+        }, request=request)
+        response = HttpResponse(html)
+
+    response['X-Swaps-Remaining'] = user_profile.meal_swaps_remaining
+    return response
+
+
+def replace_dish(request, meal_type):
+    if request.method == 'POST':
+        new_dish, user_profile, error = swap_dish_for_user(request.user, meal_type)
+
+        if wants_swap_fragment(request):
+            return render_swap_fragment(request, meal_type, new_dish, user_profile, error)
 
         if new_dish:
-            user_profile.meal_swaps_remaining -= 1
-            user_profile.save()
             messages.success(request, f'Блюдо успешно заменено!')
         else:
-            messages.error(request, 'Не найдено подходящих блюд для замены')
+            messages.error(request, error)
 
     return redirect('favorites:lk')
+
+
+def _redirect_back(request, default):
+    next_url = request.POST.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, {request.get_host()}, request.is_secure()):
+        return redirect(next_url)
+    return redirect(default)
+
+
+@login_required
+@require_POST
+def favorite_dish(request, pk):
+    dish = get_object_or_404(Dish, pk=pk)
+    if DishPreferences.toggle_for_user(request.user, dish.pk):
+        messages.success(request, f'«{dish.name}» добавлено в избранное')
+    else:
+        messages.success(request, f'«{dish.name}» убрано из избранного')
+    return _redirect_back(request, 'favorites:lk')
+
+
+@login_required
+@require_POST
+def block_dish(request, pk):
+    dish = get_object_or_404(Dish, pk=pk)
+    max_price = UserProfile.objects.filter(user=request.user).values_list('max_dish_price', flat=True).first()
+    if toggle_blocked_dish(request.user, dish, max_price):
+        messages.success(request, f'«{dish.name}» больше не будет предлагаться')
+    else:
+        messages.success(request, f'«{dish.name}» снова может попасть в меню')
+    return _redirect_back(request, 'favorites:lk')
+
+
+def _json_response_with_etag(request, payload):
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode()
+    etag = f'"{hashlib.md5(body).hexdigest()}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(payload, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _api_error(message, status):
+    return JsonResponse({'error': message}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+@require_GET
+def api_menu_today(request):
+    if not request.user.is_authenticated:
+        return _api_error('Требуется авторизация', 401)
+
+    user_tariff = MealTariff.objects.filter(user=request.user).first()
+    if user_tariff is None:
+        return _api_error('У вас нет активного тарифа', 404)
+
+    user_profile = UserProfile.objects.get_or_create(user=request.user)[0]
+    reset_user_swaps(user_profile)
+
+    daily_menu = get_daily_menu_for_user(request.user, user_tariff, user_profile.max_dish_price)
+    record_impressions(*(dish.pk for dish in daily_menu.values()))
+
+    payload = menu_schema.dump({
+        'date': timezone.now().date(),
+        'swaps_remaining': user_profile.meal_swaps_remaining,
+        'menu': daily_menu,
+    })
+    return _json_response_with_etag(request, payload)
+
+
+@require_GET
+def api_dish(request, pk):
+    dish = Dish.objects.filter(pk=pk, is_active=True).only(
+        'id', 'name', 'meal_type', 'total_price', 'total_calories',
+        'total_protein', 'total_fat', 'total_carbohydrates', 'image'
+    ).first()
+    if dish is None:
+        return _api_error('Блюдо не найдено', 404)
+
+    return _json_response_with_etag(request, dish_schema.dump(dish))
+
+
+@require_GET
+def api_search(request):
+    query = request.GET.get('q', '').strip()
+    dishes = search_dishes(query) if query else []
+    return JsonResponse(
+        {'query': query, 'results': dish_schema.dump(dishes, many=True)},
+        json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')},
+    )
+
+
+@require_POST
+def api_swap_dish(request, meal_type):
+    if not request.user.is_authenticated:
+        return _api_error('Требуется авторизация', 401)
+
+    if meal_type not in dict(Dish.MEAL_TYPES):
+        return _api_error('Неизвестный тип приема пищи', 400)
+
+    if not MealTariff.objects.filter(user=request.user).exists():
+        return _api_error('У вас нет активного тарифа', 404)
+
+    new_dish, user_profile, error = swap_dish_for_user(request.user, meal_type)
+    if error:
+        return _api_error(error, 409)
+
+    payload = swap_result_schema.dump({
+        'meal_type': meal_type,
+        'swaps_remaining': user_profile.meal_swaps_remaining,
+        'dish': new_dish,
+    })
+    return JsonResponse(payload, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')})
+
+
+@require_GET
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    has_token = bool(token) and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not has_token and not request.user.is_staff:
+        return HttpResponse(status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
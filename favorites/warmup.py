@@ -0,0 +1,153 @@
+"""Прогрев процесса перед первыми запросами.
+
+Первые запросы после деплоя платят за компиляцию шаблонов, сборку URL-резолвера,
+реестра админки, подключение к базе и холодные кеши каталога. warm_up() проходит эти
+фазы заранее и возвращает время каждой. Вызывается командой manage.py warmup и в
+каждом воркере gunicorn через post_fork (см. gunicorn.conf.py). Там же worker_exit —
+последняя запись накопленных в воркере счётчиков при его остановке.
+"""
+import logging
+import os
+from pathlib import Path
+import time
+from uuid import UUID
+
+from django.urls.converters import IntConverter, PathConverter, SlugConverter, StringConverter, UUIDConverter
+
+
+logger = logging.getLogger('favorites.warmup')
+
+# значения для конвертеров путей при проверке маршрутов; <name> без конвертера — это StringConverter
+SAMPLE_PATH_ARGS = {
+    IntConverter: 1,
+    StringConverter: 'LUNCH',
+    SlugConverter: 'sample',
+    PathConverter: 'sample',
+    UUIDConverter: UUID(int=0),
+}
+
+
+def open_connections():
+    from django.db import connections
+
+    for connection in connections.all():
+        connection.ensure_connection()
+    return len(connections.all())
+
+
+def sample_path_arg(converter):
+    """Значение для конвертера пути, в том числе для наследников встроенных; None, если подходящего нет."""
+    for cls in type(converter).__mro__:
+        if cls in SAMPLE_PATH_ARGS:
+            return SAMPLE_PATH_ARGS[cls]
+    return None
+
+
+def resolve_routes():
+    from django.urls import NoReverseMatch, get_resolver, resolve, reverse
+
+    from . import urls
+
+    get_resolver()._populate()
+    resolved = 0
+    for pattern in urls.urlpatterns:
+        # у re_path конвертеров нет, а именованные группы подставить нечем
+        converters = getattr(pattern.pattern, 'converters', None)
+        if converters is None and pattern.pattern.regex.groupindex:
+            logger.info('Прогрев пропускает маршрут %s: регулярное выражение с параметрами', pattern.name)
+            continue
+        kwargs = {name: sample_path_arg(converter) for name, converter in (converters or {}).items()}
+        unknown = [name for name, value in kwargs.items() if value is None]
+        if unknown:
+            logger.info('Прогрев пропускает маршрут %s: нет примера для параметров %s', pattern.name, ', '.join(unknown))
+            continue
+        try:
+            resolve(reverse(f'{urls.app_name}:{pattern.name}', kwargs=kwargs))
+        except NoReverseMatch:
+            logger.info('Прогрев пропускает маршрут %s: не удалось построить URL', pattern.name)
+            continue
+        resolved += 1
+    resolve(reverse('admin:index'))
+    return resolved
+
+
+def load_templates():
+    from django.template.loader import get_template
+
+    root = Path(__file__).resolve().parent / 'templates'
+    names = sorted(path.relative_to(root).as_posix() for path in root.rglob('*.html'))
+    for name in names:
+        get_template(name)
+    return len(names)
+
+
+def prime_catalog():
+    """Отображает снимок каталога или кеширует кандидатов по калориям для тарифов без аллергий."""
+    from .menu import get_calorie_candidates
+    from .models import Dish, MealTariff
+    from .snapshot import get_snapshot
+
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return len(snapshot)
+
+    count = 0
+    for diet_type, _ in Dish.DIET_CHOICES:
+        tariff = MealTariff(diet_type=diet_type)
+        for meal_type, _ in Dish.MEAL_TYPES:
+            count += len(get_calorie_candidates(tariff, meal_type)[1])
+    return count
+
+
+PHASES = (
+    ('db', open_connections),
+    ('urls', resolve_routes),
+    ('templates', load_templates),
+    ('catalog', prime_catalog),
+)
+
+
+def warm_up():
+    """Прогревает текущий процесс и возвращает [(фаза, секунды, число объектов), ...]."""
+    timings = []
+    for name, phase in PHASES:
+        started = time.perf_counter()
+        count = phase()
+        seconds = time.perf_counter() - started
+        logger.info('Прогрев %s: %.3f с (%s)', name, seconds, count)
+        timings.append((name, seconds, count))
+    return timings
+
+
+def post_fork(server, worker):
+    """Хук gunicorn: прогревает воркер до того, как он начнёт принимать запросы."""
+    import django
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'recipe.settings')
+    started = time.perf_counter()
+    django.setup()
+    setup_seconds = time.perf_counter() - started
+
+    try:
+        timings = warm_up()
+    except Exception:
+        # недогретый воркер всё равно обслужит запросы, просто первые будут медленнее
+        server.log.exception('Не удалось прогреть воркер %s', worker.pid)
+        return
+    phases = ', '.join(f'{name} {seconds:.3f} с' for name, seconds, _ in timings)
+    server.log.info('Воркер %s прогрет: django.setup %.3f с, %s', worker.pid, setup_seconds, phases)
+
+
+def worker_exit(server, worker):
+    """Хук gunicorn: дописывает счётчики популярности, которые воркер не успел сбросить."""
+    from django.db import DatabaseError
+
+    from .popularity import counters
+
+    try:
+        rows = counters.flush()
+    except DatabaseError:
+        server.log.exception('Воркер %s не записал счётчики популярности', worker.pid)
+        return
+    if rows:
+        server.log.info('Воркер %s записал счётчики популярности: %d строк', worker.pid, rows)
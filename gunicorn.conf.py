@@ -0,0 +1,2 @@
+# gunicorn подхватывает этот файл автоматически при запуске из корня проекта
+from favorites.warmup import post_fork, worker_exit  # noqa: F401
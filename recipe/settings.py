@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'favorites.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,10 +52,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'favorites.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'recipe.urls'
 
+# use the native async versions of lk, card and replace_dish (enabled by recipe/asgi.py)
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -81,6 +86,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL не блокирует читателей на время записи, а IMMEDIATE берёт блокировку записи в начале
+        # транзакции, поэтому конкурирующие запросы ждут timeout, а не падают с «database is locked»
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 
@@ -144,7 +156,47 @@ AUTHENTICATION_BACKENDS = [
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'favorites.metrics.InstrumentedLocMemCache',
         'LOCATION': 'unique-snowflake',
     }
-}
\ No newline at end of file
+}
+
+# requests slower than this many seconds are logged with their SQL to favorites.slow_requests;
+# unset disables the log, and SQL text is only kept per request while it is enabled
+SLOW_REQUEST_THRESHOLD = env.float('SLOW_REQUEST_THRESHOLD', default=None)
+
+# /metrics is open to staff users; a scraper authenticates with an "Authorization: Bearer <token>" header
+METRICS_TOKEN = env.str('METRICS_TOKEN', default='')
+
+# staff can profile a request with ?profile=1 or "X-Profile: 1"; every Nth request is profiled when the rate is set
+PROFILER_ENABLED = env.bool('PROFILER_ENABLED', default=False)
+PROFILER_SAMPLE_RATE = env.int('PROFILER_SAMPLE_RATE', default=0)
+PROFILER_DIR = env.str('PROFILER_DIR', default=str(BASE_DIR / 'profiles'))
+
+# daily menus are derived from (user, date, eligible dishes) instead of random.choice + cache;
+# swaps are stored in UserProfile.menu_overrides
+DETERMINISTIC_MENUS = env.bool('DETERMINISTIC_MENUS', default=False)
+
+# path of the mmap-ed catalog snapshot shared by all workers (see favorites/snapshot.py);
+# empty disables it and menus read candidates from the database
+CATALOG_SNAPSHOT_PATH = env.str('CATALOG_SNAPSHOT_PATH', default='')
+CATALOG_SNAPSHOT_AUTO_REBUILD = env.bool('CATALOG_SNAPSHOT_AUTO_REBUILD', default=True)
+
+# where sessions live: "db" (default), "cached_db" (reads from CACHES, so it needs a cache shared by
+# all workers — with the per-process locmem cache a logout is not seen by other workers) or
+# "signed_cookies" (no session table access at all; sessions from the table are moved into the
+# cookie on first request, so switching to it does not log anyone out)
+SESSION_MODE = env.str('SESSION_MODE', default='db')
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'favorites.sessions',
+}
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+
+# flash messages ride in their own cookie instead of falling back to the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# dish impression/swap/card counters are kept in memory and written to DishDailyStats
+# after the first request that finishes this many seconds after the previous write
+POPULARITY_FLUSH_INTERVAL = env.int('POPULARITY_FLUSH_INTERVAL', default=60)